@@ -0,0 +1,168 @@
+import functools
+import numpy as np
+import cv2
+
+# Canvas pixels (x, y) of the wrist and elbow ends of the stimulated arm axis,
+# where Location is 0 and 1, and their distance on the arm in centimetres
+wrist_pixel = (330, 155)
+elbow_pixel = (190, 155)
+axis_length_cm = 10
+
+# --- Location (0 at the wrist, 1 at the elbow) <-> canvas pixels ---
+def location_to_pixel(location):
+    """
+    Canvas (x, y) of a Location, scalar or array.
+    """
+    location = np.asarray(location, dtype=np.float64)
+    x = wrist_pixel[0] + (elbow_pixel[0] - wrist_pixel[0]) * location
+    y = wrist_pixel[1] + (elbow_pixel[1] - wrist_pixel[1]) * location
+    return x, y
+
+def location_to_column(location):
+    """
+    Nearest canvas pixel column of a Location.
+    """
+    return np.rint(location_to_pixel(location)[0]).astype(int)
+
+def pixel_to_location(x, y=wrist_pixel[1]):
+    """
+    Location of canvas pixels, projected on the arm axis.
+    """
+    axis = np.subtract(elbow_pixel, wrist_pixel, dtype=np.float64)
+    length = np.hypot(*axis)
+    ux, uy = axis / length
+    dx = np.asarray(x, dtype=np.float64) - wrist_pixel[0]
+    dy = np.asarray(y, dtype=np.float64) - wrist_pixel[1]
+    return (dx * ux + dy * uy) / length
+
+# --- Location -> the analyses' units ---
+def location_from_elbow(location):
+    """
+    Location measured from the elbow, as the analyses report it (wrist at 1).
+    """
+    return 1 - location
+
+def fraction_to_cm(value):
+    """
+    Converts a location or displacement in axis fractions to centimetres.
+    """
+    return value * axis_length_cm
+
+# --- Canvas pixels <-> arm centimetres ---
+def arm_axis():
+    """
+    Unit vector (ux, uy) from the elbow towards the wrist on the canvas, and pixels per centimetre.
+    """
+    axis = np.subtract(wrist_pixel, elbow_pixel, dtype=np.float64)
+    length = np.hypot(*axis)
+    return axis / length, length / axis_length_cm
+
+def canvas_to_arm(x, y):
+    """
+    Arm (along, across) centimetres of canvas pixels.
+
+    "along" runs from the elbow (0) to the wrist (axis_length_cm), so it equals
+    fraction_to_cm(location_from_elbow(location)) on the axis, and "across" is
+    the distance from the axis, positive towards the bottom of the canvas.
+    """
+    (ux, uy), pixels_per_cm = arm_axis()
+    dx = np.asarray(x, dtype=np.float64) - elbow_pixel[0]
+    dy = np.asarray(y, dtype=np.float64) - elbow_pixel[1]
+    return (dx * ux + dy * uy) / pixels_per_cm, (dy * ux - dx * uy) / pixels_per_cm
+
+def arm_to_canvas(along, across=0):
+    """
+    Canvas (x, y) of points given in arm centimetres.
+    """
+    (ux, uy), pixels_per_cm = arm_axis()
+    along = np.asarray(along, dtype=np.float64) * pixels_per_cm
+    across = np.asarray(across, dtype=np.float64) * pixels_per_cm
+    return elbow_pixel[0] + along * ux - across * uy, elbow_pixel[1] + along * uy + across * ux
+
+def canvas_to_arm_matrix():
+    """
+    2x3 affine of canvas_to_arm, e.g. for cv2.warpAffine.
+    """
+    (ux, uy), pixels_per_cm = arm_axis()
+    rotation = np.array([[ux, uy], [-uy, ux]]) / pixels_per_cm
+    return np.hstack([rotation, -(rotation @ np.asarray(elbow_pixel, dtype=np.float64))[:, None]])
+
+# --- Canonical arm frame ---
+@functools.lru_cache(maxsize=8)
+def arm_grid(canvas_shape, cm_per_cell=None, along_range=None, across_range=None):
+    """
+    Lookup grid that resamples canvas images into the canonical arm frame.
+
+    Each cell of the grid is a cm_per_cell square of the arm, columns running
+    along the axis from the elbow and rows across it. The grid is computed once
+    per setting and shared, treat its arrays as read-only.
+
+    Args:
+        canvas_shape (tuple): (H, W) of the drawings.
+        cm_per_cell (float): Cell size in centimetres, one canvas pixel by default.
+        along_range, across_range (tuple): (min, max) centimetres covered, the
+            whole canvas by default.
+
+    Returns:
+        dict: "map_x", "map_y" (float32 canvas coordinates per cell, for cv2.remap),
+        "rows", "cols" (nearest canvas pixel per cell), "inside" (cell falls on the canvas),
+        "along", "across" (cm of the cell centers per column / row), "extent"
+        ((left, right, bottom, top) cm of the grid's outer edges, for imshow) and "shape".
+    """
+    height, width = canvas_shape
+    if cm_per_cell is None:
+        cm_per_cell = 1 / arm_axis()[1]
+    if along_range is None or across_range is None:
+        corners_along, corners_across = canvas_to_arm([-0.5, width - 0.5, -0.5, width - 0.5],
+                                                      [-0.5, -0.5, height - 0.5, height - 0.5])
+        along_range = along_range or (corners_along.min(), corners_along.max())
+        across_range = across_range or (corners_across.min(), corners_across.max())
+
+    along = np.arange(along_range[0] + cm_per_cell / 2, along_range[1], cm_per_cell)
+    across = np.arange(across_range[0] + cm_per_cell / 2, across_range[1], cm_per_cell)
+    map_x, map_y = arm_to_canvas(along[None, :], across[:, None])
+
+    rows, cols = np.rint(map_y).astype(np.intp), np.rint(map_x).astype(np.intp)
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    grid = {
+        "map_x": map_x.astype(np.float32), "map_y": map_y.astype(np.float32),
+        "rows": np.where(inside, rows, 0), "cols": np.where(inside, cols, 0), "inside": inside,
+        "along": along, "across": across, "shape": inside.shape,
+        "extent": (along[0] - cm_per_cell / 2, along[-1] + cm_per_cell / 2,
+                   across[-1] + cm_per_cell / 2, across[0] - cm_per_cell / 2),
+    }
+    for value in grid.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return grid
+
+def warp_to_arm(stack, grid, interpolation="nearest"):
+    """
+    Resamples canvas images into the canonical arm frame.
+
+    Nearest sampling gathers the whole (..., H, W) stack through the grid in
+    one indexing operation, so masks and counts keep their values. "linear"
+    uses cv2.remap plane by plane, for smooth images such as heatmaps.
+
+    Args:
+        stack (np.ndarray): (..., H, W) images on the canvas.
+        grid (dict): From arm_grid for the canvas shape.
+        interpolation (str): "nearest" or "linear".
+
+    Returns:
+        np.ndarray: (..., rows, cols) images in the arm frame, 0 off the canvas.
+    """
+    if interpolation == "nearest":
+        warped = stack[..., grid["rows"], grid["cols"]]
+        warped[..., ~grid["inside"]] = 0
+        return warped
+    if interpolation != "linear":
+        raise ValueError(f"Unknown interpolation: {interpolation}")
+
+    height, width = stack.shape[-2:]
+    flat = stack.reshape(-1, height, width).astype(np.float32, copy=False)
+    warped = np.empty((len(flat),) + grid["shape"], dtype=np.float32)
+    for i, plane in enumerate(flat):
+        warped[i] = cv2.remap(plane, grid["map_x"], grid["map_y"], cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return warped.reshape(stack.shape[:-2] + grid["shape"])
@@ -0,0 +1,157 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# p value above which a check passes, as the studies' check_data used
+check_alpha = 0.005
+
+def run_assumption_checks(df, measures, by, group, alpha=check_alpha, correction="holm", workers=1):
+    """
+    Normality and homogeneity checks of every measure and cell in one call.
+
+    Each measure is reshaped once into a NaN-padded (cell, trial) array, on
+    which Shapiro-Wilk, Levene and the Q-Q statistics run along the trial axis
+    for all cells at once. Measures are spread over a process pool.
+
+    Args:
+        df (pd.DataFrame): Trials.
+        measures (list of str): Dependent variables to check.
+        by (list of str): Factors whose combinations are the cells checked for normality.
+        group (str): Factor of `by` whose levels are compared for homogeneity of
+            variances, within each combination of the other factors.
+        alpha (float): p value above which a check passes.
+        correction (str): "holm" or "fdr_bh", applied over all tests of a table.
+        workers (int): Number of processes to spread the measures over.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Normality per cell (N, Shapiro_W, p_value,
+        p_corrected, Normality_OK, Skewness, Kurtosis, QQ_r) and homogeneity per
+        cell without `group` (Levene_W, p_value, p_corrected, Homoscedasticity_OK),
+        one block of rows per measure.
+    """
+    jobs = [(df[list(by) + [measure]], measure, list(by), group) for measure in measures]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(check_measure, jobs))
+    else:
+        results = [check_measure(job) for job in jobs]
+
+    normality = pd.concat([result[0] for result in results], ignore_index=True)
+    homogeneity = pd.concat([result[1] for result in results], ignore_index=True)
+
+    normality.insert(normality.columns.get_loc("p_value") + 1, "p_corrected", adjust_p_values(normality["p_value"], correction))
+    normality.insert(normality.columns.get_loc("p_corrected") + 1, "Normality_OK", (normality["p_value"] > alpha).astype(int))
+    homogeneity["p_corrected"] = adjust_p_values(homogeneity["p_value"], correction)
+    homogeneity["Homoscedasticity_OK"] = (homogeneity["p_value"] > alpha).astype(int)
+    return normality, homogeneity
+
+def check_measure(job):
+    """
+    Normality and homogeneity tables of one measure, see run_assumption_checks.
+    """
+    df, measure, by, group = job
+    df = df.dropna(subset=[measure])
+
+    keys, padded = padded_cells(df, measure, by)
+    normality = keys.copy()
+    normality.insert(len(by), "Measure", measure)
+    n = np.sum(~np.isnan(padded), axis=1)
+    normality["N"] = n
+    normality["Shapiro_W"], normality["p_value"] = np.nan, np.nan
+    testable = n >= 3
+    if testable.any():
+        with warnings.catch_warnings():
+            # Shapiro-Wilk warns about small or constant samples, which still get a result
+            warnings.simplefilter("ignore", UserWarning)
+            w, p = stats.shapiro(padded[testable], axis=1, nan_policy="omit")
+        normality.loc[testable, "Shapiro_W"], normality.loc[testable, "p_value"] = w, p
+    normality["Skewness"], normality["Kurtosis"], normality["QQ_r"] = qq_summary(padded)
+
+    outer = [factor for factor in by if factor != group]
+    keys, padded = padded_cells(df, measure, outer + [group])
+    levels = sorted(keys[group].unique())
+    # (cell without group, level, trial), NaN where a cell lacks a level
+    cells = keys[outer].drop_duplicates().reset_index(drop=True)
+    cell_index = keys[outer].merge(cells.reset_index(), on=outer, how="left")["index"].to_numpy()
+    samples = np.full((len(cells), len(levels), padded.shape[1]), np.nan)
+    samples[cell_index, np.searchsorted(levels, keys[group].to_numpy())] = padded
+
+    homogeneity = cells.copy()
+    homogeneity["Measure"] = measure
+    homogeneity["Levene_W"], homogeneity["p_value"] = np.nan, np.nan
+    # Every level needs two values for a spread
+    testable = (np.sum(~np.isnan(samples), axis=2) >= 2).all(axis=1)
+    if testable.any() and len(levels) > 1:
+        w, p = stats.levene(*samples[testable].transpose(1, 0, 2), axis=1, nan_policy="omit")
+        homogeneity.loc[testable, "Levene_W"], homogeneity.loc[testable, "p_value"] = w, p
+    return normality, homogeneity
+
+def padded_cells(df, measure, by):
+    """
+    Values of a measure as a (cell, trial) array padded with NaN.
+
+    Returns:
+        (pd.DataFrame, np.ndarray): The cells' factor levels in sorted order and the array.
+    """
+    grouped = df.groupby(by, sort=True)
+    cell = grouped.ngroup().to_numpy()
+    position = grouped.cumcount().to_numpy()
+    padded = np.full((grouped.ngroups, position.max() + 1 if len(position) else 0), np.nan)
+    padded[cell, position] = df[measure].to_numpy(dtype=np.float64)
+    keys = pd.DataFrame(list(grouped.groups.keys()), columns=by) if len(by) > 1 else pd.DataFrame({by[0]: list(grouped.groups.keys())})
+    return keys, padded
+
+def qq_summary(padded):
+    """
+    Shape of each cell's distribution next to a normal one.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Skewness, excess kurtosis and the
+        correlation of the sorted values with normal quantiles (Blom positions),
+        which is 1 for a perfectly straight Q-Q plot.
+    """
+    with warnings.catch_warnings():
+        # Constant cells have no shape, they come out as NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        skewness = stats.skew(padded, axis=1, nan_policy="omit")
+        kurtosis = stats.kurtosis(padded, axis=1, nan_policy="omit")
+
+        ordered = np.sort(padded, axis=1)  # NaN padding sorts last
+        n = np.sum(~np.isnan(padded), axis=1, keepdims=True)
+        rank = np.arange(1, padded.shape[1] + 1)
+        quantiles = np.where(rank <= n, stats.norm.ppf((rank - 0.375) / (n + 0.25)), np.nan)
+
+        x = ordered - np.nanmean(ordered, axis=1, keepdims=True)
+        y = quantiles - np.nanmean(quantiles, axis=1, keepdims=True)
+        r = np.nansum(x * y, axis=1) / np.sqrt(np.nansum(x * x, axis=1) * np.nansum(y * y, axis=1))
+    r = np.where(n[:, 0] >= 3, r, np.nan)
+    return np.asarray(skewness, dtype=np.float64), np.asarray(kurtosis, dtype=np.float64), r
+
+def adjust_p_values(p_values, method="holm"):
+    """
+    Multiple-comparison corrected p values, NaN ones are left out of the family.
+
+    Args:
+        p_values (array-like): Raw p values.
+        method (str): "holm" (Holm-Bonferroni) or "fdr_bh" (Benjamini-Hochberg).
+    """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full(p_values.shape, np.nan)
+    tested = ~np.isnan(p_values)
+    p = p_values[tested]
+    if not len(p):
+        return adjusted
+
+    if method == "fdr_bh":
+        adjusted[tested] = stats.false_discovery_control(p, method="bh")
+    elif method == "holm":
+        order = np.argsort(p)
+        steps = np.maximum.accumulate(p[order] * (len(p) - np.arange(len(p))))
+        holm = np.empty_like(p)
+        holm[order] = np.minimum(steps, 1)
+        adjusted[tested] = holm
+    else:
+        raise ValueError(f"Unknown correction: {method}")
+    return adjusted
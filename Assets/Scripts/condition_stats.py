@@ -0,0 +1,252 @@
+import os
+import numpy as np
+import pandas as pd
+
+summary_filename = "condition_summaries.parquet"
+
+def summarize_trials(df, by, values=(), matches=(), valid=None, bins=None):
+    """
+    Reduces trials to mergeable sufficient statistics per participant and condition.
+
+    Every statistic is a sum over trials, so the records of any set of
+    participants merge by adding them up (see merge_summaries).
+
+    Args:
+        df (pd.DataFrame): Trials with a Participant column.
+        by (list of str): Columns identifying a condition.
+        values (list of str): Numeric columns to summarize over the valid trials.
+        matches (list of str): 0/1 columns counted over all trials.
+        valid (array-like of bool): Trials whose values count, all by default.
+        bins (dict): {value column: bin edges} to histogram over the valid trials,
+            values outside go to the end bins.
+
+    Returns:
+        pd.DataFrame: One row per (Participant, *by) with "Trials", per value
+        "<v>_n", "<v>_sum", "<v>_sumsq" (and "<v>_bin<i>" counts), per match "<m>_hits".
+    """
+    bins = bins or {}
+    valid = np.ones(len(df), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    columns = {"Trials": np.ones(len(df), dtype=np.int64)}
+    for value in values:
+        x = df[value].to_numpy(dtype=np.float64)
+        counted = valid & ~np.isnan(x)
+        x = np.where(counted, x, 0.0)
+        columns[f"{value}_n"] = counted.astype(np.int64)
+        columns[f"{value}_sum"] = x
+        columns[f"{value}_sumsq"] = x * x
+        if value in bins:
+            edges = np.asarray(bins[value], dtype=np.float64)
+            which = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, len(edges) - 2)
+            for i in range(len(edges) - 1):
+                columns[f"{value}_bin{i}"] = (counted & (which == i)).astype(np.int64)
+    for match in matches:
+        columns[f"{match}_hits"] = df[match].to_numpy(dtype=np.int64)
+
+    stats = pd.DataFrame(columns, index=df.index)
+    keys = ["Participant"] + list(by)
+    return pd.concat([df[keys], stats], axis=1).groupby(keys, sort=True).sum().reset_index()
+
+def merge_summaries(summaries, by, participants=None):
+    """
+    Adds up the records of the chosen participants per condition.
+
+    Args:
+        summaries (pd.DataFrame): From summarize_trials or load_summaries.
+        by (list of str): Condition columns to keep, any subset of the summarized ones.
+        participants (list of int): Participants to pool, all by default.
+
+    Returns:
+        pd.DataFrame: One row per condition, the same statistics columns, counts
+        and histogram bins added up.
+    """
+    if participants is not None:
+        summaries = summaries[summaries["Participant"].isin(participants)]
+    # Statistics follow the condition columns, starting at Trials
+    stats = list(summaries.columns[summaries.columns.get_loc("Trials"):])
+    return summaries.groupby(list(by), sort=True)[stats].sum().reset_index()
+
+def summary_table(merged, by, values=(), matches=(), drop_empty=True, bins=()):
+    """
+    Descriptive statistics of merged records.
+
+    Args:
+        merged (pd.DataFrame): From merge_summaries.
+        by (list of str): Condition columns of the records.
+        values (list of str): Value columns to describe with "<v>_mean" and "<v>_sem"
+            (standard error with ddof=1, 0 for a single trial).
+        matches (list of str): Match columns to describe with "<m>_rate" over all trials.
+        drop_empty (bool): Leave out conditions without a valid trial of the values.
+        bins (list of str): Binned values (see summarize_trials) to describe with
+            "<v>_bin<i>_rate", the share of the value's valid trials in each bin.
+
+    Returns:
+        pd.DataFrame: by, "Trials", then per value "<v>_n", "<v>_mean", "<v>_sem",
+        per match "<m>_rate" and per binned value its bin rates.
+    """
+    table = merged[list(by) + ["Trials"]].copy()
+    for value in values:
+        n = merged[f"{value}_n"].to_numpy(dtype=np.float64)
+        total = merged[f"{value}_sum"].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / n
+            variance = np.maximum(merged[f"{value}_sumsq"].to_numpy() - total * mean, 0) / (n - 1)
+            sem = np.where(n > 1, np.sqrt(variance / n), 0.0)
+        table[f"{value}_n"] = merged[f"{value}_n"]
+        table[f"{value}_mean"] = mean
+        table[f"{value}_sem"] = sem
+    for match in matches:
+        table[f"{match}_rate"] = merged[f"{match}_hits"] / merged["Trials"]
+    for value in bins:
+        n = merged[f"{value}_n"].to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for i, count in enumerate(summary_histogram(merged, value).T):
+                table[f"{value}_bin{i}_rate"] = count / n
+
+    if drop_empty and values:
+        table = table[(table[[f"{value}_n" for value in values]] > 0).any(axis=1)]
+    return table.reset_index(drop=True)
+
+def summary_histogram(merged, value):
+    """
+    (conditions, bins) counts of a binned value in merged records.
+    """
+    columns = [c for c in merged.columns if c.startswith(f"{value}_bin")]
+    columns.sort(key=lambda c: int(c.rsplit("bin", 1)[1]))
+    return merged[columns].to_numpy()
+
+def leave_one_out(summaries, by, values=(), matches=()):
+    """
+    Statistics of every condition with each participant left out, in one pass.
+
+    The records of the left-out participant are subtracted from the condition
+    totals, so no trials are re-read or re-aggregated per participant.
+
+    Args:
+        summaries (pd.DataFrame): From summarize_trials or load_summaries.
+        by (list of str): Condition columns to keep, as in merge_summaries.
+        values (list of str): Value columns, as in summary_table.
+        matches (list of str): Match columns, as in summary_table.
+
+    Returns:
+        pd.DataFrame: One row per (Participant left out, *by) with the
+        summary_table columns plus "<v>_mean_shift" and "<m>_rate_shift",
+        the change from the estimate over every participant.
+    """
+    by = list(by)
+    merged = merge_summaries(summaries, by)
+    stats = list(merged.columns[len(by):])
+    participants = np.sort(summaries["Participant"].unique())
+    n_conditions = len(merged)
+
+    # Every participant's own records, aligned to the (participant, condition) grid
+    left_out = merged[by].iloc[np.tile(np.arange(n_conditions), len(participants))].reset_index(drop=True)
+    left_out.insert(0, "Participant", np.repeat(participants, n_conditions))
+    own = left_out.merge(summaries.groupby(["Participant"] + by)[stats].sum().reset_index(),
+                         on=["Participant"] + by, how="left")[stats].fillna(0)
+
+    totals = np.tile(merged[stats].to_numpy(dtype=np.float64), (len(participants), 1))
+    downdated = pd.concat([left_out, pd.DataFrame(totals - own.to_numpy(dtype=np.float64), columns=stats)], axis=1)
+
+    table = summary_table(downdated, ["Participant"] + by, values, matches, drop_empty=False)
+    full = summary_table(merged, by, values, matches, drop_empty=False)
+    for column in [f"{value}_mean" for value in values] + [f"{match}_rate" for match in matches]:
+        table[f"{column}_shift"] = table[column].to_numpy() - np.tile(full[column].to_numpy(), len(participants))
+    return table
+
+def jackknife_influence(loo, by, values=(), matches=(), threshold=2.0):
+    """
+    Influence score per participant from the leave_one_out table.
+
+    In each condition the left-out estimates are z-scored across participants,
+    so z tells how far leaving this participant out moves the estimate compared
+    with leaving out anyone else. A participant's influence on a measure is the
+    root mean square of z over the conditions, about 1 for a typical participant.
+
+    Args:
+        loo (pd.DataFrame): From leave_one_out.
+        by (list of str): Condition columns of the table.
+        values, matches (list of str): Measures to score, their means and rates.
+        threshold (float): Influence above which a participant is flagged.
+
+    Returns:
+        pd.DataFrame: Participant, per measure "<m>_influence" and "<m>_max_z",
+        "Influence" (the largest over the measures) and "is_influential",
+        most influential first.
+    """
+    measures = {**{value: f"{value}_mean" for value in values}, **{match: f"{match}_rate" for match in matches}}
+    estimates = loo[list(measures.values())]
+    conditions = [loo[column] for column in by]
+
+    centered = estimates - estimates.groupby(conditions).transform("mean")
+    spread = np.sqrt((centered ** 2).groupby(conditions).transform("mean"))
+    # Conditions where leaving anyone out changes nothing do not count against anyone
+    moves = spread > 1e-12
+    z = (centered / spread.where(moves)).mask(~moves, 0.0).where(estimates.notna())
+
+    participant = loo["Participant"]
+    scores = pd.DataFrame({"Participant": np.sort(participant.unique())})
+    rms = np.sqrt((z ** 2).groupby(participant).mean())
+    largest = z.abs().groupby(participant).max()
+    for measure, column in measures.items():
+        scores[f"{measure}_influence"] = rms[column].to_numpy()
+        scores[f"{measure}_max_z"] = largest[column].to_numpy()
+
+    scores["Influence"] = scores[[f"{measure}_influence" for measure in measures]].max(axis=1)
+    scores["is_influential"] = scores["Influence"] > threshold
+    return scores.sort_values("Influence", ascending=False, kind="stable").reset_index(drop=True)
+
+def jackknife_report(summaries, by, values, matches, output_folder, threshold=2.0):
+    """
+    Saves the leave-one-participant-out tables as 'jackknife_conditions.csv'
+    and 'jackknife_influence.csv' and prints the flagged participants.
+
+    Returns:
+        pd.DataFrame: The influence scores, see jackknife_influence.
+    """
+    loo = leave_one_out(summaries, by, values, matches)
+    scores = jackknife_influence(loo, by, values, matches, threshold)
+
+    os.makedirs(output_folder, exist_ok=True)
+    loo.to_csv(os.path.join(output_folder, "jackknife_conditions.csv"), index=False)
+    scores.to_csv(os.path.join(output_folder, "jackknife_influence.csv"), index=False)
+    print(f"Saved leave-one-out tables to {output_folder}")
+
+    flagged = scores.loc[scores["is_influential"], "Participant"].tolist()
+    print(f"Influential participants (influence > {threshold}): {flagged if flagged else 'none'}")
+    return scores
+
+def update_summaries(folder, summaries):
+    """
+    Stores the records of the summarized participants, replacing their older records.
+
+    Returns:
+        pd.DataFrame: Every stored record.
+    """
+    path = os.path.join(folder, summary_filename)
+    if os.path.exists(path):
+        stored = pd.read_parquet(path)
+        if list(stored.columns) != list(summaries.columns):
+            print(f"Warning: Summary columns changed, dropping the stored records of {path}")
+        else:
+            stored = stored[~stored["Participant"].isin(summaries["Participant"].unique())]
+            summaries = pd.concat([stored, summaries], ignore_index=True)
+    summaries = summaries.sort_values(["Participant"], kind="stable").reset_index(drop=True)
+
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = path + ".tmp"
+    summaries.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return summaries
+
+def load_summaries(folder, participants=None):
+    """
+    Reads stored records, of the given participants only if any.
+    """
+    summaries = pd.read_parquet(os.path.join(folder, summary_filename))
+    if participants is not None:
+        missing = sorted(set(participants) - set(summaries["Participant"]))
+        if missing:
+            print(f"Warning: No condition summaries of participants {missing}, run analyze_data with them first")
+        summaries = summaries[summaries["Participant"].isin(participants)].reset_index(drop=True)
+    return summaries
@@ -0,0 +1,244 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+import numpy as np
+
+from drawing_cache import load_drawing_masks, preprocess_drawing, drawing_pattern, default_red_fill
+
+# File layout: header (magic, index offset, index length), then one zlib
+# compressed np.packbits blob per drawing and plane, then the JSON index.
+archive_magic = b"DRWARC01"
+archive_header = struct.Struct("<8sQQ")
+archive_planes = ["heat", "red"]
+
+# Opened archives by path, {path: ((mtime, size), (data, index))}, reused until the file changes
+opened_archives = {}
+
+def pack_drawings(drawings_folder, archive_path, red_fill=None, participants=None):
+    """
+    Packs the drawings of a study into one archive of bit-packed masks.
+
+    Every drawing is stored as its preprocessed heat and red masks (see
+    preprocess_drawing), indexed by (participant, trial). The records of a
+    participant are contiguous, so one read returns all of them. Participants
+    whose drawing files are unchanged since the last pack are copied over
+    without decoding, and the archive is replaced atomically.
+
+    Args:
+        drawings_folder (str): Study folder with one 'p#' subfolder of drawings per participant.
+        archive_path (str): Archive file to write.
+        red_fill (dict): Red circle fill settings of the heat masks.
+        participants (list of int): Participants to pack, every 'p#' subfolder by default.
+
+    Returns:
+        list of int: Participants that were decoded again.
+    """
+    red_fill = red_fill or default_red_fill
+    if participants is None:
+        participants = folder_participants(drawings_folder)
+
+    old_data, old_index = None, None
+    if os.path.exists(archive_path):
+        old_data, old_index = open_drawing_archive(archive_path)
+        if old_index["red_fill"] != red_fill:
+            old_data, old_index = None, None
+
+    shape = old_index["shape"] if old_index else None
+    index = {"shape": shape, "planes": archive_planes, "red_fill": red_fill, "participants": {}, "records": []}
+    repacked = []
+
+    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+    tmp_path = archive_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(archive_header.pack(archive_magic, 0, 0))
+
+        for par in participants:
+            participant_folder = os.path.join(drawings_folder, f"p{par}")
+            fingerprint = folder_fingerprint(participant_folder, par)
+            old_entry = old_index["participants"].get(str(par)) if old_index else None
+            first = len(index["records"])
+
+            if old_entry is not None and old_entry["fingerprint"] == fingerprint:
+                # Unchanged, copy the compressed blobs as they are
+                for trial, *spans in participant_records(old_index, par):
+                    blobs = [bytes(old_data[offset:offset + length]) for offset, length in spans]
+                    index["records"].append(write_record(f, par, trial, blobs))
+            else:
+                for trial, path in participant_drawings(participant_folder, par):
+                    heat, red = preprocess_drawing(path, red_fill)
+                    if shape is None:
+                        shape = list(heat.shape)
+                        index["shape"] = shape
+                    blobs = [zlib.compress(np.packbits(mask).tobytes()) for mask in (heat, red)]
+                    index["records"].append(write_record(f, par, trial, blobs))
+                repacked.append(par)
+
+            index["participants"][str(par)] = {
+                "fingerprint": fingerprint, "first": first, "count": len(index["records"]) - first,
+            }
+
+        index_offset = f.tell()
+        index_bytes = json.dumps(index).encode()
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(archive_header.pack(archive_magic, index_offset, len(index_bytes)))
+
+    # Release the old mapping, also the cached one, before replacing the file
+    del old_data
+    opened_archives.pop(archive_path, None)
+    os.replace(tmp_path, archive_path)
+
+    if repacked:
+        print(f"Packed {archive_path}: participants {repacked} decoded, {len(participants) - len(repacked)} copied")
+    return repacked
+
+def write_record(f, participant, trial, blobs):
+    record = [participant, trial]
+    for blob in blobs:
+        record.append([f.tell(), len(blob)])
+        f.write(blob)
+    return record
+
+def open_drawing_archive(archive_path):
+    """
+    Memory-maps a drawing archive read-only.
+
+    The index is parsed once per archive file and reused while the file's
+    mtime and size stay the same, treat it as read-only.
+
+    Returns:
+        (np.memmap, dict): The archive bytes and its index, with "rows" added
+        as a {(participant, trial): record} lookup.
+    """
+    stat = os.stat(archive_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = opened_archives.get(archive_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(archive_path, "rb") as f:
+        magic, index_offset, index_length = archive_header.unpack(f.read(archive_header.size))
+        if magic != archive_magic:
+            raise ValueError(f"{archive_path} is not a drawing archive")
+        f.seek(index_offset)
+        index = json.loads(f.read(index_length))
+
+    index["rows"] = {(record[0], record[1]): i for i, record in enumerate(index["records"])}
+    data = np.memmap(archive_path, dtype=np.uint8, mode="r")
+    opened_archives[archive_path] = (version, (data, index))
+    return data, index
+
+def participant_records(index, participant):
+    """
+    The [trial, [offset, length] per plane] records of a participant, in trial order.
+    """
+    entry = index["participants"].get(str(participant))
+    if entry is None:
+        return []
+    return [record[1:] for record in index["records"][entry["first"]:entry["first"] + entry["count"]]]
+
+def archive_mask(data, index, participant, trial, plane="heat"):
+    """
+    Reads the mask of one drawing, None if the archive does not have it.
+    """
+    row = index["rows"].get((participant, trial))
+    if row is None:
+        return None
+    offset, length = index["records"][row][2 + index["planes"].index(plane)]
+    return unpack_mask(data[offset:offset + length], index["shape"])
+
+def archive_masks(data, index, participant, plane="heat"):
+    """
+    Reads every mask of a participant in one sequential read.
+
+    Returns:
+        dict: {trial: 2D bool array}
+    """
+    records = participant_records(index, participant)
+    if not records:
+        return {}
+
+    p = 1 + index["planes"].index(plane)
+    start = records[0][1][0]
+    end = records[-1][-1][0] + records[-1][-1][1]
+    block = bytes(data[start:end])
+
+    return {
+        record[0]: unpack_mask(block[record[p][0] - start:record[p][0] - start + record[p][1]], index["shape"])
+        for record in records
+    }
+
+def unpack_mask(blob, shape):
+    bits = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+def is_drawing_archive(drawings):
+    return os.path.isfile(drawings)
+
+def load_study_masks(drawings, participant, cache_folder, red_fill=None, plane="heat"):
+    """
+    Returns the masks of a participant from a drawing archive or from the drawings folder.
+
+    Args:
+        drawings (str): Archive file from pack_drawings, or the study drawings folder.
+        participant (int): Participant number.
+        cache_folder (str): Mask cache folder, only used for a drawings folder.
+        red_fill (dict): Red circle fill settings of the heat masks.
+        plane (str): "heat" or "red", see load_drawing_masks.
+
+    Returns:
+        dict: {trial: 2D bool array}
+    """
+    red_fill = red_fill or default_red_fill
+    if not is_drawing_archive(drawings):
+        return load_drawing_masks(os.path.join(drawings, f"p{participant}"), participant, cache_folder, red_fill, plane)
+
+    data, index = open_drawing_archive(drawings)
+    if plane == "heat" and index["red_fill"] != red_fill:
+        raise ValueError(f"{drawings} was packed with other red fill settings, pack it again")
+    return archive_masks(data, index, participant, plane)
+
+def drawings_fingerprint(drawings, participant):
+    """
+    Fingerprint of the drawing files of a participant, read from the archive index
+    when `drawings` is an archive.
+    """
+    if not is_drawing_archive(drawings):
+        return folder_fingerprint(os.path.join(drawings, f"p{participant}"), participant)
+
+    _, index = open_drawing_archive(drawings)
+    entry = index["participants"].get(str(participant))
+    return entry["fingerprint"] if entry else None
+
+def folder_fingerprint(participant_folder, participant):
+    """
+    Hashes the drawing files (name, mtime, size) of a participant folder.
+    """
+    drawings = []
+    for trial, path in participant_drawings(participant_folder, participant):
+        stat = os.stat(path)
+        drawings.append([os.path.basename(path), stat.st_mtime, stat.st_size])
+    return hashlib.sha1(json.dumps(drawings).encode()).hexdigest()
+
+def folder_participants(drawings_folder):
+    """
+    Participants with a 'p#' subfolder in a study drawings folder, sorted.
+    """
+    return sorted(
+        int(name[1:]) for name in os.listdir(drawings_folder)
+        if name.startswith("p") and name[1:].isdigit() and os.path.isdir(os.path.join(drawings_folder, name))
+    )
+
+def participant_drawings(participant_folder, participant):
+    """
+    Lists the (trial, path) of a participant's drawings, sorted by trial.
+    """
+    drawings = []
+    if os.path.isdir(participant_folder):
+        for fname in os.listdir(participant_folder):
+            match = drawing_pattern.match(fname)
+            if match and int(match.group(1)) == participant:
+                drawings.append((int(match.group(2)), os.path.join(participant_folder, fname)))
+    return sorted(drawings)
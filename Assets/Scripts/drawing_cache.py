@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import hashlib
+import cv2
+import numpy as np
+from PIL import Image
+
+drawing_pattern = re.compile(r"p(\d+)_trial(\d+)_drawing\.png$")
+
+# HSV ranges and closing passes used to fill in red circles before thresholding
+default_red_fill = {
+    "lower_red1": [0, 70, 50],
+    "upper_red1": [10, 255, 255],
+    "lower_red2": [170, 70, 50],
+    "upper_red2": [180, 255, 255],
+    "close_passes": 2,
+}
+
+def load_drawing_masks(drawings_folder, participant, cache_folder, red_fill=None, plane="heat"):
+    """
+    Returns the preprocessed binary masks of every drawing of a participant.
+
+    Masks are kept in '<cache_folder>/p#_masks_<settings>.npz', one bit per pixel.
+    A drawing is only decoded again when its file changed (mtime, then SHA-1),
+    and the source PNGs are never written to.
+
+    Args:
+        drawings_folder (str): Folder holding 'p#_trial#_drawing.png' files.
+        participant (int): Participant number.
+        cache_folder (str): Folder to keep the mask cache in.
+        red_fill (dict): HSV ranges / closing passes for fill_red_circles.
+        plane (str): "heat" for the filled drawing thresholded like the heatmaps,
+            "red" for the raw pure-red stroke pixels.
+
+    Returns:
+        dict: {trial: 2D bool array}
+    """
+    red_fill = red_fill or default_red_fill
+    cache = update_drawing_cache(drawings_folder, participant, cache_folder, red_fill)
+
+    shape = tuple(cache["shape"])
+    bits = cache[f"{plane}_bits"]
+    return {
+        int(trial): np.unpackbits(bits[i], count=shape[0] * shape[1]).reshape(shape).astype(bool)
+        for i, trial in enumerate(cache["trials"])
+    }
+
+def update_drawing_cache(drawings_folder, participant, cache_folder, red_fill):
+    """
+    Brings the mask cache of one participant up to date and returns its arrays.
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    settings = json.dumps(red_fill, sort_keys=True)
+    settings_key = hashlib.sha1(settings.encode()).hexdigest()[:8]
+    cache_path = os.path.join(cache_folder, f"p{participant}_masks_{settings_key}.npz")
+
+    cached = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            cached = {key: data[key] for key in data.files}
+    cached_index = {int(trial): i for i, trial in enumerate(cached.get("trials", []))}
+
+    drawings = []
+    if os.path.isdir(drawings_folder):
+        for fname in os.listdir(drawings_folder):
+            match = drawing_pattern.match(fname)
+            if match and int(match.group(1)) == participant:
+                drawings.append((int(match.group(2)), os.path.join(drawings_folder, fname)))
+    drawings.sort()
+
+    trials, mtimes, hashes, heat_bits, red_bits = [], [], [], [], []
+    # A cache written before the participant had any drawing stores (0, 0), the first drawing sets the shape
+    shape = tuple(int(side) for side in cached["shape"]) if "shape" in cached else None
+    if not shape or 0 in shape:
+        shape = None
+    rebuilt = 0
+
+    for trial, path in drawings:
+        mtime = os.path.getmtime(path)
+        i = cached_index.get(trial)
+        file_hash = None
+
+        if i is not None and cached["mtimes"][i] != mtime:
+            file_hash = file_sha1(path)
+
+        if i is not None and (cached["mtimes"][i] == mtime or cached["hashes"][i] == file_hash):
+            file_hash = cached["hashes"][i]
+            heat, red = cached["heat_bits"][i], cached["red_bits"][i]
+        else:
+            file_hash = file_hash or file_sha1(path)
+            heat_mask, red_mask = preprocess_drawing(path, red_fill)
+            if shape is None:
+                shape = heat_mask.shape
+            heat, red = np.packbits(heat_mask), np.packbits(red_mask)
+            rebuilt += 1
+
+        trials.append(trial)
+        mtimes.append(mtime)
+        hashes.append(file_hash)
+        heat_bits.append(heat)
+        red_bits.append(red)
+
+    cache = {
+        "trials": np.array(trials, dtype=np.int32),
+        "mtimes": np.array(mtimes, dtype=np.float64),
+        "hashes": np.array(hashes, dtype="S40"),
+        "shape": np.array(shape if shape else (0, 0), dtype=np.int32),
+        "heat_bits": stack_bits(heat_bits),
+        "red_bits": stack_bits(red_bits),
+        "settings": np.array(settings),
+    }
+
+    unchanged = (
+        np.array_equal(cache["trials"], cached.get("trials")) and
+        np.array_equal(cache["mtimes"], cached.get("mtimes"))
+    )
+    if rebuilt or not unchanged:
+        # Written aside and swapped in, so a reader never sees a half-written cache
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **cache)
+        os.replace(tmp_path, cache_path)
+        print(f"Cached p{participant}: {rebuilt} drawing(s) preprocessed, {len(trials) - rebuilt} reused")
+
+    return cache
+
+def preprocess_drawing(image_path, red_fill):
+    """
+    Decodes a drawing once and returns its (heat, red) boolean masks.
+
+    heat: circles filled in, then grayscale > 50 (what the heatmaps accumulate).
+    red:  raw pixels with r > 200, g < 50, b < 50 (what drawing_analysis tests).
+    """
+    img = cv2.imread(image_path)
+
+    rgb = img[:, :, ::-1]
+    red = (rgb[:, :, 0] > 200) & (rgb[:, :, 1] < 50) & (rgb[:, :, 2] < 50)
+
+    filled = fill_red_circles(img, **red_fill)
+    gray = np.array(Image.fromarray(np.ascontiguousarray(filled[:, :, ::-1])).convert("L"))
+    heat = gray > 50
+
+    return heat, red
+
+def fill_red_circles(img, lower_red1, upper_red1, lower_red2, upper_red2, close_passes):
+    """
+    Fills every closed red contour of a BGR image in place and returns it.
+    """
+    # Convert to HSV color space for better red detection
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    # Create masks for red regions (two ranges for red wrap-around)
+    mask1 = cv2.inRange(hsv, np.array(lower_red1), np.array(upper_red1))
+    mask2 = cv2.inRange(hsv, np.array(lower_red2), np.array(upper_red2))
+    mask = mask1 | mask2
+
+    # Clean noise
+    kernel = np.ones((3, 3), np.uint8)
+    for _ in range(close_passes):
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    # Find contours in red mask
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Fill each red contour on original image
+    for cnt in contours:
+        cv2.drawContours(img, [cnt], -1, (0, 0, 255), thickness=cv2.FILLED)  # Red in BGR
+
+    return img
+
+def stack_bits(rows):
+    if not rows:
+        return np.zeros((0, 0), dtype=np.uint8)
+    return np.stack(rows).astype(np.uint8)
+
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest().encode()
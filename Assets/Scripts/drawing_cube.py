@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from drawing_archive import load_study_masks, drawings_fingerprint
+from file_manifest import load_manifest, save_manifest
+from heatmap_core import HeatmapAccumulator
+from drawing_registration import warp_counts
+
+cube_filename = "drawing_cube.u16"
+index_filename = "drawing_cube.json"
+cube_dtype = np.dtype("<u2")
+
+def update_drawing_cube(cube_folder, participants, conditions, condition_trials, drawings, mask_cache_folder, red_fill, shape, transforms=None):
+    """
+    Brings the drawing cube up to date for the given participants and opens it.
+
+    The cube is a uint16 array of shape (participant, condition, H, W) where each
+    cell counts how many of the participant's valid trials of that condition
+    marked the pixel. It is stored as one raw C-order file, so the slice of a
+    new participant is appended at the end and the slice of a participant whose
+    drawings or valid trials changed is rewritten in place. Everything else is
+    left untouched.
+
+    Args:
+        cube_folder (str): Folder holding the cube file and its JSON index.
+        participants (list of int): Participants that must be in the cube.
+        conditions (list of tuple): Condition keys, e.g. (temperature, location, duration).
+        condition_trials (dict): {condition: {participant: [trial, ...]}} from trials_by_condition.
+        drawings (str): Study folder with one 'p#' subfolder of drawings per participant,
+            or a drawing archive of the study (see pack_drawings).
+        mask_cache_folder (str): Folder of the preprocessed mask cache (see load_drawing_masks).
+        red_fill (dict): Red circle fill settings of the masks.
+        shape (tuple): (H, W) of the drawings.
+        transforms (dict): {participant: 2x3 matrix} registration applied to the
+            participant's counts (see drawing_registration), none by default.
+
+    Returns:
+        (np.memmap, dict): The read-only cube and its index.
+    """
+    os.makedirs(cube_folder, exist_ok=True)
+    cube_path = os.path.join(cube_folder, cube_filename)
+    index_path = os.path.join(cube_folder, index_filename)
+
+    conditions = [list(condition) for condition in conditions]
+    layout = {"conditions": conditions, "shape": list(shape), "red_fill": red_fill}
+
+    index = load_manifest(index_path)
+    if not os.path.exists(cube_path) or any(index.get(key) != value for key, value in layout.items()):
+        # New cube, or one built for other conditions / settings
+        index = dict(layout, participants=[], fingerprints={})
+        open(cube_path, "wb").close()
+
+    slice_shape = (len(conditions),) + tuple(shape)
+    slice_bytes = int(np.prod(slice_shape)) * cube_dtype.itemsize
+    updated = []
+
+    for par in participants:
+        trials = [
+            [int(t) for t in condition_trials.get(tuple(condition), {}).get(par, [])]
+            for condition in conditions
+        ]
+        transform = (transforms or {}).get(par)
+        fingerprint = slice_fingerprint(trials, drawings, par, transform)
+        if index["fingerprints"].get(str(par)) == fingerprint:
+            continue
+
+        counts = participant_counts(trials, drawings, par, mask_cache_folder, red_fill, slice_shape)
+        if transform is not None:
+            counts = warp_counts(counts, transform)
+        if par in index["participants"]:
+            row = index["participants"].index(par)
+            cube = np.memmap(cube_path, dtype=cube_dtype, mode="r+",
+                             shape=(len(index["participants"]),) + slice_shape)
+            cube[row] = counts
+            cube.flush()
+            del cube
+        else:
+            # Written right after the indexed slices, bytes of a slice an interrupted run
+            # appended without saving the index are cut off first
+            with open(cube_path, "r+b") as f:
+                f.truncate(len(index["participants"]) * slice_bytes)
+                f.seek(len(index["participants"]) * slice_bytes)
+                f.write(counts.astype(cube_dtype).tobytes())
+            index["participants"].append(par)
+
+        index["fingerprints"][str(par)] = fingerprint
+        # Saved after every slice, an interrupted run keeps the finished ones
+        save_manifest(index, index_path)
+        updated.append(par)
+
+    if updated:
+        print(f"Drawing cube: updated participants {updated}")
+
+    return open_drawing_cube(cube_folder)
+
+def open_drawing_cube(cube_folder):
+    """
+    Memory-maps the drawing cube read-only.
+
+    Returns:
+        (np.memmap, dict): The (participant, condition, H, W) cube and its index.
+    """
+    index = load_manifest(os.path.join(cube_folder, index_filename))
+    shape = (len(index["participants"]), len(index["conditions"])) + tuple(index["shape"])
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=cube_dtype), index
+    cube = np.memmap(os.path.join(cube_folder, cube_filename), dtype=cube_dtype, mode="r", shape=shape)
+    return cube, index
+
+def cube_heatmap(cube, index, participants, conditions, accumulator=None):
+    """
+    Sums the drawing counts of any participant subset over any pooled conditions.
+
+    Args:
+        cube (np.ndarray): Cube from update_drawing_cube / open_drawing_cube.
+        index (dict): Its index.
+        participants (list of int): Participants to include, ones not in the cube are skipped.
+        conditions (list of tuple): Conditions to pool, ones not in the cube are skipped.
+        accumulator (HeatmapAccumulator): Accumulator to reset and sum into, a new one by default.
+
+    Returns:
+        HeatmapAccumulator: Holding the (H, W) uint32 counts.
+    """
+    rows = {par: i for i, par in enumerate(index["participants"])}
+    columns = {tuple(condition): i for i, condition in enumerate(index["conditions"])}
+
+    if accumulator is None:
+        accumulator = HeatmapAccumulator(index["shape"])
+    accumulator.reset()
+    for par in participants:
+        for condition in conditions:
+            if par in rows and tuple(condition) in columns:
+                accumulator.add_mask(cube[rows[par], columns[tuple(condition)]])
+    return accumulator
+
+def participant_counts(trials, drawings, participant, mask_cache_folder, red_fill, slice_shape):
+    """
+    Sums the heat masks of one participant per condition.
+
+    Returns:
+        np.ndarray: (conditions, H, W) uint16 counts.
+    """
+    masks = load_study_masks(drawings, participant, mask_cache_folder, red_fill)
+
+    counts = np.zeros(slice_shape, dtype=np.uint16)
+    for c, condition_trials in enumerate(trials):
+        for trial in condition_trials:
+            mask = masks.get(trial)
+            if mask is not None:
+                counts[c] += mask
+    return counts
+
+def slice_fingerprint(trials, drawings, participant, transform=None):
+    """
+    Hashes the valid trials, the drawing files (name, mtime, size) and the registration of a participant.
+    """
+    content = {"trials": trials, "drawings": drawings_fingerprint(drawings, participant)}
+    if transform is not None:
+        content["transform"] = np.asarray(transform, dtype=np.float64).round(6).tolist()
+    content = json.dumps(content)
+    return hashlib.sha1(content.encode()).hexdigest()
@@ -0,0 +1,84 @@
+import numpy as np
+from scipy import ndimage
+
+from arm_coordinates import arm_grid, warp_to_arm, axis_length_cm, location_from_elbow
+
+def stack_drawings(masks, trials, shape=None):
+    """
+    Stacks the masks of the given trials into one (n, H, W) bool array.
+
+    Args:
+        masks (dict): {trial: 2D bool array}, e.g. from load_drawing_masks.
+        trials (list of int): Trials in the order wanted.
+        shape (tuple): Mask shape, only needed when none of the trials has a drawing.
+
+    Returns:
+        (np.ndarray, np.ndarray): The stack, and a bool array telling which
+        trials had a drawing (missing ones are left empty in the stack).
+    """
+    if shape is None:
+        shape = next(iter(masks.values())).shape if masks else (0, 0)
+
+    stack = np.zeros((len(trials),) + tuple(shape), dtype=bool)
+    found = np.zeros(len(trials), dtype=bool)
+    for i, trial in enumerate(trials):
+        mask = masks.get(trial)
+        if mask is not None:
+            stack[i] = mask
+            found[i] = True
+
+    return stack, found
+
+def drawing_geometry(stack, chunk=32):
+    """
+    Computes the geometry of every drawing of a stack in one batched pass.
+
+    The drawings are warped into the canonical arm frame first (see
+    arm_coordinates.arm_grid), so columns run along the arm axis whatever its
+    position on the canvas. Positions are 0 at the wrist and 1 at the elbow
+    like Location, and are NaN for an empty drawing.
+
+    Args:
+        stack (np.ndarray): (n, H, W) bool drawings on the canvas.
+        chunk (int): Drawings labelled at once when counting blobs, bounds the label array.
+
+    Returns:
+        dict: (n,) arrays DrawnLocation (centroid), DrawnMin and DrawnMax (extent),
+        DrawnArea (marked pixels) and DrawnBlobs (8-connected regions).
+    """
+    grid = arm_grid(stack.shape[1:])
+    stack = warp_to_arm(stack, grid)
+    n, _, width = stack.shape
+    position = location_from_elbow(grid["along"] / axis_length_cm)
+
+    # First moments from the per-column pixel counts
+    column_counts = stack.sum(axis=1, dtype=np.int64)
+    area = column_counts.sum(axis=1)
+    drawn = area > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = np.where(drawn, column_counts @ position / area, np.nan)
+
+    # Extent from the first and last marked columns, positions decrease along the frame's columns
+    marked = column_counts > 0
+    first = marked.argmax(axis=1)
+    last = width - 1 - marked[:, ::-1].argmax(axis=1)
+    drawn_min = np.where(drawn, position[last], np.nan)
+    drawn_max = np.where(drawn, position[first], np.nan)
+
+    # Label whole chunks at once, the structure does not connect neighbouring drawings
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    blobs = np.zeros(n, dtype=np.int64)
+    for start in range(0, n, chunk):
+        labels, _ = ndimage.label(stack[start:start + chunk], structure)
+        # Labels run in raster order, so each drawing's labels follow the previous drawing's
+        highest = np.maximum.accumulate(labels.reshape(len(labels), -1).max(axis=1))
+        blobs[start:start + chunk] = np.diff(highest, prepend=0)
+
+    return {
+        "DrawnLocation": centroid,
+        "DrawnMin": drawn_min,
+        "DrawnMax": drawn_max,
+        "DrawnArea": area,
+        "DrawnBlobs": blobs,
+    }
@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from drawing_archive import load_study_masks, drawings_fingerprint
+from drawing_cache import default_red_fill
+
+index_filename = "drawing_index.npz"
+index_planes = ["heat", "red"]
+# Side in pixels of the square tiles indexed for region queries
+tile_size = 10
+
+def update_drawing_index(index_folder, participants, drawings, mask_cache_folder, red_fill=None, tile=tile_size):
+    """
+    Brings the inverted pixel -> trial index of a study up to date and returns it.
+
+    For every pixel column, and every tile x tile block, of the drawing canvas
+    the index keeps the set of (participant, trial) drawings that marked it, as
+    a bitset over the drawings (np.packbits, one bit per drawing). Queries are
+    then bitwise AND / OR / NOT of those sets, with no image decoding. The
+    index is rebuilt from the mask cache when a participant's drawings change.
+
+    Args:
+        index_folder (str): Folder to keep the index in.
+        participants (list of int): Participants to index.
+        drawings (str): Study drawings folder, or a drawing archive (see pack_drawings).
+        mask_cache_folder (str): Folder of the preprocessed mask cache (see load_drawing_masks).
+        red_fill (dict): Red circle fill settings of the heat masks.
+        tile (int): Tile side in pixels.
+
+    Returns:
+        dict: The index (see load_drawing_index).
+    """
+    red_fill = red_fill or default_red_fill
+    index_path = os.path.join(index_folder, index_filename)
+
+    fingerprints = {str(par): drawings_fingerprint(drawings, par) for par in participants}
+    settings = json.dumps({"fingerprints": fingerprints, "red_fill": red_fill, "tile": tile}, sort_keys=True)
+    key = hashlib.sha1(settings.encode()).hexdigest()
+
+    if os.path.exists(index_path):
+        # Only the key is read, an index of other settings may lack newer arrays
+        with np.load(index_path) as data:
+            if str(data["key"]) == key:
+                return load_drawing_index(index_folder)
+
+    records, column_sets, tile_sets = [], {plane: [] for plane in index_planes}, {plane: [] for plane in index_planes}
+    shape = None
+    for par in participants:
+        for plane in index_planes:
+            masks = load_study_masks(drawings, par, mask_cache_folder, red_fill, plane)
+            if not masks:
+                continue
+            trials = sorted(masks)
+            stack = np.stack([masks[trial] for trial in trials])
+            shape = stack.shape[1:]
+            if plane == index_planes[0]:
+                records.extend((par, trial) for trial in trials)
+            column_sets[plane].append(stack.any(axis=1))
+            tile_sets[plane].append(tile_any(stack, tile))
+
+    index = {
+        "key": np.array(key),
+        "records": np.array(records, dtype=np.int32).reshape(-1, 2),
+        "shape": np.array(shape if shape else (0, 0), dtype=np.int32),
+        "tile": np.array(tile, dtype=np.int32),
+    }
+    for plane in index_planes:
+        # (drawings, columns) -> (columns, bitset over drawings)
+        columns = np.concatenate(column_sets[plane]) if column_sets[plane] else np.zeros((0, 0), dtype=bool)
+        tiles = np.concatenate(tile_sets[plane]) if tile_sets[plane] else np.zeros((0, 0, 0), dtype=bool)
+        index[f"{plane}_columns"] = np.packbits(columns.T, axis=1)
+        index[f"{plane}_tiles"] = np.packbits(tiles.transpose(1, 2, 0), axis=2)
+
+    os.makedirs(index_folder, exist_ok=True)
+    tmp_path = index_path + ".tmp.npz"
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, index_path)
+    print(f"Drawing index: {len(records)} drawings of {len(participants)} participants indexed")
+
+    return load_drawing_index(index_folder)
+
+def load_drawing_index(index_folder):
+    """
+    Reads a drawing index.
+
+    Returns:
+        dict: "records" (n, 2) (participant, trial) per bit, "rows" {(participant, trial): bit},
+        "<plane>_columns" (W, bytes) and "<plane>_tiles" (rows, columns, bytes) bitsets,
+        "shape", "tile" and "key".
+    """
+    with np.load(os.path.join(index_folder, index_filename)) as data:
+        index = {key: data[key] for key in data.files}
+    index["key"] = str(index["key"])
+    index["tile"] = int(index["tile"])
+    index["rows"] = {(int(par), int(trial)): i for i, (par, trial) in enumerate(index["records"])}
+    return index
+
+def tile_any(stack, tile):
+    """
+    Tells which tile x tile blocks of each drawing have a marked pixel.
+    """
+    n, height, width = stack.shape
+    rows, columns = -(-height // tile), -(-width // tile)
+    padded = np.zeros((n, rows * tile, columns * tile), dtype=bool)
+    padded[:, :height, :width] = stack
+    return padded.reshape(n, rows, tile, columns, tile).any(axis=(2, 4))
+
+def column_set(index, left, right, plane="heat"):
+    """
+    Drawings with a marked pixel in the columns left..right (inclusive).
+
+    Returns:
+        np.ndarray: Packed bitset over index["records"].
+    """
+    bits = index[f"{plane}_columns"]
+    left, right = max(left, 0), min(right, len(bits) - 1)
+    if left > right:
+        return np.zeros(bits.shape[1], dtype=np.uint8)
+    return np.bitwise_or.reduce(bits[left:right + 1], axis=0)
+
+def region_set(index, left, right, top, bottom, plane="heat"):
+    """
+    Drawings with a marked pixel in a tile overlapping the pixel region
+    [left, right] x [top, bottom] (inclusive), so exact for tile-aligned regions.
+
+    Returns:
+        np.ndarray: Packed bitset over index["records"].
+    """
+    tile = index["tile"]
+    tiles = index[f"{plane}_tiles"][top // tile:bottom // tile + 1, left // tile:right // tile + 1]
+    if tiles.size == 0:
+        return np.zeros(index[f"{plane}_tiles"].shape[2], dtype=np.uint8)
+    return np.bitwise_or.reduce(tiles.reshape(-1, tiles.shape[2]), axis=0)
+
+def record_set(index, records):
+    """
+    Bitset of the given (participant, trial) drawings, e.g. the trials of a
+    condition to intersect a spatial query with. Drawings not indexed are left out.
+    """
+    members = np.zeros(len(index["records"]), dtype=bool)
+    bits = [index["rows"].get((int(par), int(trial))) for par, trial in records]
+    members[[bit for bit in bits if bit is not None]] = True
+    return np.packbits(members)
+
+def set_union(*sets):
+    """
+    Drawings in any of the bitsets.
+    """
+    return np.bitwise_or.reduce(np.stack(sets), axis=0)
+
+def set_intersection(*sets):
+    """
+    Drawings in every one of the bitsets.
+    """
+    return np.bitwise_and.reduce(np.stack(sets), axis=0)
+
+def set_records(index, bits):
+    """
+    Lists the (participant, trial) drawings of a bitset, combine bitsets with
+    set_union, set_intersection or & | ~ first.
+    """
+    members = np.unpackbits(bits, count=len(index["records"])).astype(bool)
+    return [tuple(int(v) for v in record) for record in index["records"][members]]
+
+def band_hits(index, participants, trials, columns, band=0, plane="red"):
+    """
+    Tests each drawing for marked pixels within `band` columns of its own target column.
+
+    One column_set query per distinct target column, each drawing is then
+    looked up in the set of its own column, without decoding any drawing.
+
+    Args:
+        index (dict): From update_drawing_index.
+        participants, trials (array-like): The drawing of each test.
+        columns (array-like): Target pixel column of each test.
+        band (int): Half width of the tested band, 0 tests the column only.
+
+    Returns:
+        (np.ndarray, np.ndarray): (n,) int hits, and a bool array telling which drawings are indexed.
+    """
+    bits = [index["rows"].get((int(par), int(trial))) for par, trial in zip(participants, trials)]
+    found = np.array([bit is not None for bit in bits], dtype=bool)
+    bits = np.array([bit if bit is not None else 0 for bit in bits], dtype=int)
+
+    width = len(index[f"{plane}_columns"])
+    columns = np.clip(np.asarray(columns, dtype=int), 0, width - 1)
+    hits = np.zeros(len(bits), dtype=bool)
+    for column in np.unique(columns):
+        tested = columns == column
+        members = np.unpackbits(column_set(index, column - band, column + band, plane), count=len(index["records"]))
+        hits[tested] = members[bits[tested]].astype(bool)
+    return (hits & found).astype(int), found
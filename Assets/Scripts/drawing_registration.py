@@ -0,0 +1,140 @@
+import json
+import numpy as np
+import cv2
+from PIL import Image
+
+from file_manifest import save_manifest
+
+arm_outline_path = "Assets/arm_outline.png"
+
+def load_arm_silhouette(path=arm_outline_path):
+    """
+    Arm silhouette of the outline image, True where the arm is drawn.
+    """
+    return np.array(Image.open(path).convert("RGBA"))[:, :, 3] > 0
+
+def estimate_registration(stacks, silhouette=None, flips=(False, True), scales=(1.0,), min_gain=0.15):
+    """
+    Estimates a flip / scale / shift per participant that aligns their drawings with the others'.
+
+    Each participant's drawings are compared with a template made of every
+    other participant's mean drawing, restricted to the arm silhouette. For
+    every candidate flip and scale (about the canvas center) the cross
+    correlation with the template is computed by FFT; the summed stack is
+    correlated once, which equals summing the correlations of all drawings.
+    Shifting to a correlation peak is only kept when it beats the best
+    unshifted candidate by `min_gain`, and a flip or scale only when it beats
+    the untransformed drawings by `min_gain`, otherwise the participant keeps
+    the identity.
+
+    Args:
+        stacks (dict): {participant: (n, H, W) bool drawings}.
+        silhouette (np.ndarray): (H, W) bool arm region, from arm_outline.png by default.
+        flips (tuple of bool): Left-right flips to try.
+        scales (tuple of float): Scales to try, the drawing is scaled by the inverse.
+        min_gain (float): Correlation gain needed to accept a transform.
+
+    Returns:
+        dict: {participant: {"flip", "scale", "dx", "dy", "score", "identity_score", "matrix"}},
+        where matrix is the 2x3 affine (cv2.warpAffine) mapping the drawings into the common frame.
+    """
+    if silhouette is None:
+        silhouette = load_arm_silhouette()
+    shape = silhouette.shape
+    means = {par: stack.mean(axis=0, dtype=np.float64) for par, stack in stacks.items() if len(stack)}
+    total = sum(means.values())
+
+    registration = {}
+    for par, mean in means.items():
+        template = (total - mean) * silhouette
+        template_fft = np.conj(np.fft.rfft2(template))
+        template_norm = np.linalg.norm(template)
+
+        identity = {"flip": False, "scale": 1.0, "dx": 0, "dy": 0, "score": surface_score(mean, template, template_norm)}
+        unshifted, shifted = identity, identity
+
+        for flip in flips:
+            for scale in scales:
+                matrix = transform_matrix(flip, 1 / scale, 0, 0, shape)
+                candidate = cv2.warpAffine(mean.astype(np.float32), matrix, shape[::-1], flags=cv2.INTER_LINEAR)
+                surface = np.fft.irfft2(np.fft.rfft2(candidate) * template_fft, s=shape)
+                surface /= np.linalg.norm(candidate) * template_norm + 1e-12
+
+                if surface[0, 0] > unshifted["score"]:
+                    unshifted = {"flip": flip, "scale": scale, "dx": 0, "dy": 0, "score": surface[0, 0]}
+
+                dy, dx = np.unravel_index(surface.argmax(), shape)
+                score = surface[dy, dx]
+                if score > shifted["score"]:
+                    # Peak offset d means candidate(x + d) matches the template(x)
+                    dy = dy - shape[0] if dy > shape[0] // 2 else dy
+                    dx = dx - shape[1] if dx > shape[1] // 2 else dx
+                    shifted = {"flip": flip, "scale": scale, "dx": -int(dx), "dy": -int(dy), "score": score}
+
+        # Every step away from the identity has to pay off, as drawings
+        # legitimately differ in where they sit on the arm
+        best = shifted if shifted["score"] - unshifted["score"] >= min_gain else unshifted
+        if best["score"] - identity["score"] < min_gain:
+            best = identity
+
+        best["score"] = round(float(best["score"]), 4)
+        best["identity_score"] = round(float(identity["score"]), 4)
+        best["matrix"] = transform_matrix(best["flip"], 1 / best["scale"], best["dx"], best["dy"], shape).tolist()
+        registration[par] = best
+
+    return registration
+
+def transform_matrix(flip, scale, dx, dy, shape):
+    """
+    2x3 affine that flips left-right and scales about the canvas center, then shifts by (dx, dy).
+    """
+    height, width = shape
+    matrix = np.array([
+        [scale, 0, (1 - scale) * width / 2],
+        [0, scale, (1 - scale) * height / 2],
+    ], dtype=np.float64)
+    if flip:
+        matrix[0] *= -1
+        matrix[0, 2] += width - 1
+    matrix[0, 2] += dx
+    matrix[1, 2] += dy
+    return matrix.astype(np.float32)
+
+def surface_score(image, template, template_norm):
+    """
+    Normalized correlation of an image with the template, without shifting.
+    """
+    return float(np.sum(image * template)) / (np.linalg.norm(image) * template_norm + 1e-12)
+
+def is_identity(matrix):
+    return np.allclose(np.asarray(matrix, dtype=np.float64), [[1, 0, 0], [0, 1, 0]])
+
+def warp_counts(counts, matrix):
+    """
+    Applies a registration transform to (..., H, W) masks or counts.
+
+    Nearest-neighbour sampling moves whole pixels, so warping counts summed
+    over drawings equals summing the warped drawings.
+    """
+    if is_identity(matrix):
+        return counts
+    matrix = np.asarray(matrix, dtype=np.float32)
+    height, width = counts.shape[-2:]
+    flat = counts.reshape(-1, height, width)
+    warped = np.empty_like(flat)
+    for i, plane in enumerate(flat):
+        warped[i] = cv2.warpAffine(plane, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=0)
+    return warped.reshape(counts.shape)
+
+def save_registration(registration, path):
+    save_manifest({f"p{par}": entry for par, entry in registration.items()}, path)
+
+def load_registration(path):
+    """
+    Reads saved transforms.
+
+    Returns:
+        dict: {participant: 2x3 matrix as nested lists}
+    """
+    with open(path) as f:
+        return {int(key[1:]): entry["matrix"] for key, entry in json.load(f).items()}
@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+
+def load_manifest(manifest_path):
+    """
+    Reads a JSON manifest, an empty one if it is missing or unreadable.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+def save_manifest(manifest, manifest_path):
+    """
+    Writes a JSON manifest atomically, so an interrupted run never leaves half a file.
+    """
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def file_fingerprints(paths, previous=None):
+    """
+    Records mtime, size and SHA-1 of each file.
+
+    The hash of a file whose mtime and size match `previous` is reused instead of
+    reading the file again, so fingerprinting unchanged files only costs a stat.
+
+    Args:
+        paths (list of str): Files to fingerprint, missing ones are left out.
+        previous (dict): Earlier result of file_fingerprints.
+
+    Returns:
+        dict: {path: {"mtime": float, "size": int, "sha1": str}}
+    """
+    previous = previous or {}
+    fingerprints = {}
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        old = previous.get(path, {})
+        if old.get("mtime") == stat.st_mtime and old.get("size") == stat.st_size:
+            sha1 = old["sha1"]
+        else:
+            sha1 = file_sha1(path)
+        fingerprints[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": sha1}
+
+    return fingerprints
+
+def files_unchanged(paths, previous):
+    """
+    Checks that every file exists with the content recorded in `previous`.
+
+    A touched file whose content is the same still counts as unchanged.
+
+    Returns:
+        (bool, dict): Whether nothing changed, and the current fingerprints.
+    """
+    current = file_fingerprints(paths, previous)
+    unchanged = all(
+        path in current and path in previous and current[path]["sha1"] == previous[path]["sha1"]
+        for path in paths
+    )
+    return unchanged, current
@@ -0,0 +1,71 @@
+import io
+import time
+import numpy as np
+from PIL import Image
+
+from heatmap_core import make_border_white_transparent
+
+def main():
+    img = sample_heatmap_image()
+
+    legacy_time, legacy_png = time_transparency(legacy_make_border_white_transparent, img)
+    vectorized_time, vectorized_png = time_transparency(make_border_white_transparent, img)
+
+    print(f"Image size: {img.size}")
+    print(f"Per-pixel loop: {legacy_time * 1000:.1f} ms")
+    print(f"Vectorized:     {vectorized_time * 1000:.1f} ms")
+    print(f"Speedup:        {legacy_time / vectorized_time:.0f}x")
+    print(f"Byte-identical PNG output: {legacy_png == vectorized_png}")
+
+def time_transparency(func, img, repeats=3):
+    """
+    Returns the best run time of `func` on `img` and the PNG bytes it produces.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(img)
+        best = min(best, time.perf_counter() - start)
+
+    buffer = io.BytesIO()
+    result.save(buffer, format="PNG")
+    return best, buffer.getvalue()
+
+def sample_heatmap_image(width=1000, height=500, seed=0):
+    """
+    Builds a cropped-heatmap-like RGB image: white background, a noisy arm band
+    in the middle and a few near-white pixels just below the threshold.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.full((height, width, 3), 255, dtype=np.uint8)
+    data[120:380, 80:920] = rng.integers(0, 256, size=(260, 840, 3), dtype=np.uint8)
+    data[rng.integers(0, height, 2000), rng.integers(0, width, 2000)] = 250
+    return Image.fromarray(data, "RGB")
+
+def legacy_make_border_white_transparent(img, margin=150, white_thresh=250):
+    """
+    Original per-pixel implementation, kept as the reference for the benchmark.
+    """
+    img = img.convert("RGBA")
+    width, height = img.size
+    datas = img.getdata()
+
+    new_data = []
+    for i, item in enumerate(datas):
+        x = i % width
+        y = i // width
+
+        # Check if pixel is near the border
+        near_border = (x < margin or x >= width - margin or
+                       y < margin or y >= height - margin)
+
+        if near_border and item[0] > white_thresh and item[1] > white_thresh and item[2] > white_thresh:
+            new_data.append((255, 255, 255, 0))  # transparent
+        else:
+            new_data.append(item)
+
+    img.putdata(new_data)
+    return img
+
+if __name__ == "__main__":
+    main()
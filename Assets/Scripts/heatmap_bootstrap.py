@@ -0,0 +1,206 @@
+import os
+from functools import lru_cache
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.ndimage import gaussian_filter
+
+from heatmap_core import arm_mask_path, load_arm_mask, arm_alpha, render_heatmap, save_heatmap
+from drawing_archive import load_study_masks
+from drawing_registration import warp_counts
+
+# Fraction of a resampled heatmap's maximum above which a pixel counts as hot for the stability map
+hot_fraction = 0.5
+# Colormap of the confidence interval and stability maps, both on a 0-1 scale
+uncertainty_cmap = plt.cm.viridis
+
+@lru_cache(maxsize=None)
+def arm_window(sigma=1, arm_mask_file=arm_mask_path):
+    """
+    Part of the canvas that decides the smoothed heat on the arm.
+
+    The bounding box of the arm mask grown by the Gaussian radius, so smoothing
+    a crop gives the same values on the arm as smoothing the whole canvas.
+
+    Returns:
+        (slice, slice): Rows and columns of the window.
+    """
+    mask = load_arm_mask(arm_mask_file)
+    radius = int(4.0 * sigma + 0.5)  # gaussian_filter's default truncate
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    return (slice(max(rows[0] - radius, 0), min(rows[-1] + radius + 1, mask.shape[0])),
+            slice(max(cols[0] - radius, 0), min(cols[-1] + radius + 1, mask.shape[1])))
+
+def trial_stacks(drawings, participants, conditions, condition_trials, mask_cache_folder, red_fill, transforms=None, sigma=1):
+    """
+    Heat masks of every valid trial, per condition and participant, cropped to the arm window.
+
+    Each participant's masks are loaded once for all conditions.
+
+    Args:
+        drawings (str): Study drawings folder or drawing archive, see load_study_masks.
+        participants (list of int): Participants to include.
+        conditions (list of tuple): Condition keys.
+        condition_trials (dict): {condition: {participant: [trial, ...]}} from trials_by_condition.
+        mask_cache_folder (str): Folder of the preprocessed mask cache.
+        red_fill (dict): Red circle fill settings of the masks.
+        transforms (dict): {participant: 2x3 matrix} registration applied to the masks.
+        sigma (float): Smoothing the window is grown for.
+
+    Returns:
+        dict: {condition: [(n, h, w) bool masks per participant]}, in participant order.
+    """
+    rows, cols = arm_window(sigma)
+    shape = load_arm_mask().shape
+    stacks = {tuple(condition): [] for condition in conditions}
+    for par in participants:
+        masks = load_study_masks(drawings, par, mask_cache_folder, red_fill)
+        transform = (transforms or {}).get(par)
+        for condition in stacks:
+            trials = [trial for trial in condition_trials.get(condition, {}).get(par, []) if trial in masks]
+            stack = np.zeros((len(trials),) + shape, dtype=np.uint8)
+            for i, trial in enumerate(trials):
+                stack[i] = masks[trial]
+            if transform is not None and len(trials):
+                stack = warp_counts(stack, transform)
+            stacks[condition].append(stack[:, rows, cols].astype(bool))
+    return stacks
+
+def cube_stacks(cube, index, participants, conditions, sigma=1):
+    """
+    Each participant's drawing counts per condition from the drawing cube, as
+    one-drawing stacks cropped to the arm window, so only participants are resampled.
+
+    Returns:
+        dict: {condition: [(1, h, w) uint16 counts per participant]}, participants not in the cube are left out.
+    """
+    rows, cols = arm_window(sigma)
+    cube_rows = {par: i for i, par in enumerate(index["participants"])}
+    columns = {tuple(condition): i for i, condition in enumerate(index["conditions"])}
+    return {
+        tuple(condition): [
+            np.asarray(cube[cube_rows[par], columns[tuple(condition)], rows, cols])[None]
+            for par in participants if par in cube_rows
+        ]
+        for condition in conditions if tuple(condition) in columns
+    }
+
+def bootstrap_weights(sizes, n_boot, rng):
+    """
+    How often each drawing is drawn in every resample, participants first, then
+    trials within each drawn participant.
+
+    A participant drawn k times contributes k * n draws spread uniformly over
+    their n trials, one multinomial per participant for all resamples at once.
+
+    Args:
+        sizes (list of int): Number of drawings of each participant.
+        n_boot (int): Number of resamples.
+        rng (np.random.Generator): Random source.
+
+    Returns:
+        np.ndarray: (n_boot, sum(sizes)) float32 weights.
+    """
+    n_participants = len(sizes)
+    drawn = rng.multinomial(n_participants, np.full(n_participants, 1 / n_participants), size=n_boot)
+    weights = np.zeros((n_boot, sum(sizes)), dtype=np.float32)
+    start = 0
+    for p, size in enumerate(sizes):
+        if size == 1:
+            weights[:, start] = drawn[:, p]
+        elif size > 1:
+            weights[:, start:start + size] = rng.multinomial(drawn[:, p] * size, np.full(size, 1 / size))
+        start += size
+    return weights
+
+def bootstrap_heatmap(stacks, n_boot=1000, sigma=1, confidence=0.95, seed=0, block_size=4096, arm_mask_file=arm_mask_path):
+    """
+    Percentile bootstrap of a condition heatmap over participants and the trials within them.
+
+    The drawings are smoothed once; since smoothing is linear every resampled
+    heatmap is a weighted sum of them, so all resamples are one matrix product
+    of the (resample, drawing) weights with the smoothed drawings, done over
+    blocks of arm pixels to bound memory.
+
+    Args:
+        stacks (list of np.ndarray): Per participant, (n, h, w) drawings cropped to
+            arm_window, from trial_stacks or cube_stacks.
+        n_boot (int): Number of resamples.
+        sigma (float): Gaussian smoothing of the heatmap.
+        confidence (float): Coverage of the interval.
+        seed: Seed of the random source, anything np.random.default_rng takes.
+        block_size (int): Arm pixels per matrix product.
+        arm_mask_file (str): Arm mask the heatmap is cut to.
+
+    Returns:
+        dict: (H, W) float64 maps, 0 off the arm: "heat" (the heatmap),
+        "low" and "high" (interval bounds) and "stability" (share of resamples
+        in which the pixel is above hot_fraction of that resample's maximum).
+    """
+    mask = load_arm_mask(arm_mask_file)
+    rows, cols = arm_window(sigma, arm_mask_file)
+    on_arm = np.flatnonzero(mask[rows, cols])
+    maps = {name: np.zeros(mask.shape) for name in ("heat", "low", "high", "stability")}
+
+    sizes = [len(stack) for stack in stacks]
+    if sum(sizes) == 0:
+        return maps
+
+    drawings = np.concatenate([stack for stack in stacks if len(stack)]).astype(np.float32)
+    gaussian_filter(drawings, sigma=(0, sigma, sigma), output=drawings)
+    drawings = drawings.reshape(len(drawings), -1)[:, on_arm]
+    heat = drawings.sum(axis=0)
+    # Pixels no drawing reaches stay 0 in every resample, only the rest are resampled
+    reached = np.flatnonzero(drawings.max(axis=0) > 0)
+    drawings_t = np.ascontiguousarray(drawings[:, reached].T)
+    weights_t = np.ascontiguousarray(bootstrap_weights(sizes, n_boot, np.random.default_rng(seed)).T)
+
+    # (pixel, resample) blocks, so each pixel's resamples are contiguous for partitioning
+    blocks = [slice(start, start + block_size) for start in range(0, len(reached), block_size)]
+    # Each resample's maximum first, as the stability threshold
+    peak = np.zeros(n_boot, dtype=np.float32)
+    for block in blocks:
+        np.maximum(peak, (drawings_t[block] @ weights_t).max(axis=0), out=peak)
+    threshold = np.where(peak > 0, hot_fraction * peak, np.inf)
+
+    # Interval bounds are the order statistics nearest to the tail quantiles
+    tail = (1 - confidence) / 2
+    ranks = [int(round(tail * (n_boot - 1))), int(round((1 - tail) * (n_boot - 1)))]
+    low, high, stability = (np.zeros(len(on_arm)) for _ in range(3))
+    for block in blocks:
+        resampled = drawings_t[block] @ weights_t
+        stability[reached[block]] = (resampled >= threshold).mean(axis=1)
+        resampled.partition(ranks, axis=1)
+        low[reached[block]], high[reached[block]] = resampled[:, ranks[0]], resampled[:, ranks[1]]
+
+    for name, values in (("heat", heat), ("low", low), ("high", high), ("stability", stability)):
+        # The window is a view, filled in place
+        maps[name][rows, cols].flat[on_arm] = values
+    return maps
+
+def save_bootstrap_maps(maps, file_path, patches, arm_mask_file=arm_mask_path):
+    """
+    Saves the interval and stability maps of a heatmap next to it, as
+    '<name>_ci.png' and '<name>_stability.png'.
+
+    The interval map shows the width of the interval relative to the
+    heatmap's maximum, both maps on a fixed 0-1 color scale.
+
+    Args:
+        maps (dict): From bootstrap_heatmap.
+        file_path (str): Path of the heatmap.
+        patches (callable): Returns new marker patches, called once per map.
+
+    Returns:
+        list of str: Paths of the saved maps.
+    """
+    stem, ext = os.path.splitext(file_path)
+    peak = maps["heat"].max()
+    width = (maps["high"] - maps["low"]) / peak if peak > 0 else np.zeros(maps["heat"].shape)
+
+    saved = []
+    for suffix, data in (("ci", np.clip(width, 0, 1)), ("stability", maps["stability"])):
+        rgba = render_heatmap(data, uncertainty_cmap, arm_alpha(arm_mask_file), patches(), vmin=0, vmax=1)
+        path = f"{stem}_{suffix}{ext}"
+        save_heatmap(rgba, path)
+        saved.append(path)
+    return saved
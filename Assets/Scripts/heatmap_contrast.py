@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy import ndimage, stats
+
+from heatmap_core import arm_mask_path, load_arm_mask, arm_alpha, render_heatmap, save_heatmap
+from heatmap_bootstrap import arm_window
+
+# Diverging colormap of the contrast maps, red where the hot condition was drawn more
+contrast_cmap = plt.cm.coolwarm
+# Alpha of the contrast outside significant clusters
+nonsignificant_alpha = 0.35
+
+def paired_differences(cube, index, participants, hot, cold, condition_trials, sigma=1):
+    """
+    Per participant, how much more often a pixel was marked in the hot than in the cold condition.
+
+    Each condition's drawing counts are divided by the participant's number of
+    valid trials in it, so participants weigh the same however many trials
+    they kept, and smoothed like the heatmaps.
+
+    Args:
+        cube (np.ndarray): Drawing cube, see open_drawing_cube.
+        index (dict): Its index.
+        participants (list of int): Participants to include, ones without valid
+            trials in both conditions are left out.
+        hot, cold (tuple): Condition keys of the cube.
+        condition_trials (dict): {condition: {participant: [trial, ...]}} from trials_by_condition.
+        sigma (float): Gaussian smoothing.
+
+    Returns:
+        (list of int, np.ndarray): Participants kept and their (n, h, w) float32
+        differences, cropped to arm_window.
+    """
+    rows, cols = arm_window(sigma)
+    cube_rows = {par: i for i, par in enumerate(index["participants"])}
+    columns = {tuple(condition): i for i, condition in enumerate(index["conditions"])}
+
+    kept, differences = [], []
+    for par in participants:
+        n_hot = len(condition_trials.get(tuple(hot), {}).get(par, []))
+        n_cold = len(condition_trials.get(tuple(cold), {}).get(par, []))
+        if par not in cube_rows or not n_hot or not n_cold:
+            continue
+        row = cube[cube_rows[par]]
+        kept.append(par)
+        differences.append(row[columns[tuple(hot)]] / np.float32(n_hot) - row[columns[tuple(cold)]] / np.float32(n_cold))
+
+    differences = np.array(differences, dtype=np.float32).reshape((len(kept),) + load_arm_mask().shape)
+    ndimage.gaussian_filter(differences, sigma=(0, sigma, sigma), output=differences)
+    return kept, differences[:, rows, cols]
+
+def cluster_permutation_test(differences, n_perm=1000, alpha=0.05, seed=0, batch_size=100, sigma=1, arm_mask_file=arm_mask_path):
+    """
+    Cluster-based permutation test of paired difference maps against zero.
+
+    Swapping a participant's hot and cold labels flips the sign of their
+    difference, so each permutation is a sign vector. The t maps of a batch of
+    permutations are one matrix product (the sum of squares does not change
+    with the signs), and the clusters of the whole batch are labelled in one
+    pass per sign, the maps stacked without connections between them. Clusters
+    are pixels of the arm with |t| above the two-sided `alpha` threshold, each
+    scored by its summed t and compared with the largest cluster of every
+    permutation. The first permutation is the observed labelling.
+
+    Args:
+        differences (np.ndarray): (n, h, w) per-participant differences in arm_window,
+            from paired_differences.
+        n_perm (int): Number of permutations, including the observed one.
+        alpha (float): Level of the pixel threshold and of significant clusters.
+        seed: Seed of the random source, anything np.random.default_rng takes.
+        batch_size (int): Permutations labelled at once.
+        sigma (float): Smoothing the window was cropped for.
+        arm_mask_file (str): Arm mask the test is restricted to.
+
+    Returns:
+        dict: (H, W) maps "mean" (mean difference), "t" and "significant"
+        (pixels of significant clusters), and "clusters", the observed clusters
+        as dicts with "sign", "mass", "pixels" and "p_value", largest first.
+    """
+    mask = load_arm_mask(arm_mask_file)
+    rows, cols = arm_window(sigma, arm_mask_file)
+    on_arm = np.flatnonzero(mask[rows, cols])
+    n, height, width = differences.shape
+    result = {"mean": np.zeros(mask.shape), "t": np.zeros(mask.shape),
+              "significant": np.zeros(mask.shape, dtype=bool), "clusters": []}
+    if n == 0:
+        return result
+
+    values = differences.reshape(n, -1)[:, on_arm]
+    result["mean"][rows, cols].flat[on_arm] = values.mean(axis=0)
+    if n < 2:
+        return result
+
+    sum_squares = np.square(values, dtype=np.float64).sum(axis=0)
+    threshold = stats.t.ppf(1 - alpha / 2, n - 1)
+    signs = np.random.default_rng(seed).choice(np.array([-1, 1], dtype=np.float32), size=(n_perm, n))
+    signs[0] = 1
+
+    largest = np.zeros(n_perm)
+    for start in range(0, n_perm, batch_size):
+        batch = signs[start:start + batch_size]
+        t = t_values(batch @ values, sum_squares, n)
+        planes = np.zeros((len(batch), height * width), dtype=np.float32)
+        planes[:, on_arm] = t
+        planes = planes.reshape(len(batch), height, width)
+
+        for sign in (1, -1):
+            labels, masses, plane_of = stack_clusters(sign * planes, threshold)
+            np.maximum.at(largest[start:start + len(batch)], plane_of, masses)
+            if start == 0:
+                observed = labels[0]
+                for label in np.flatnonzero(plane_of == 0) + 1:
+                    result["clusters"].append({"sign": sign, "mass": sign * masses[label - 1],
+                                               "pixels": observed == label})
+
+        if start == 0:
+            result["t"][rows, cols].flat[on_arm] = t[0]
+
+    for cluster in result["clusters"]:
+        cluster["p_value"] = np.mean(largest >= abs(cluster["mass"]))
+        if cluster["p_value"] < alpha:
+            result["significant"][rows, cols] |= cluster["pixels"]
+        cluster["pixels"] = int(cluster["pixels"].sum())
+    result["clusters"].sort(key=lambda cluster: -abs(cluster["mass"]))
+    return result
+
+def t_values(sums, sum_squares, n):
+    """
+    One-sample t of every permutation from the summed signed differences.
+    """
+    mean = sums / np.float32(n)
+    # Squared standard error, in float64 as the difference can cancel
+    variance = sum_squares - n * np.square(mean, dtype=np.float64)
+    variance *= 1 / ((n - 1) * n)
+    spread = np.sqrt(variance, out=variance, where=variance > 0).astype(np.float32)
+    return np.divide(mean, spread, out=np.zeros_like(mean), where=variance > 0)
+
+def stack_clusters(planes, threshold):
+    """
+    Labels the clusters above `threshold` of every map of a stack in one pass.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): (b, h, w) labels, summed value of
+        each label (label i at i - 1) and the map each label is in.
+    """
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1)
+    labels, count = ndimage.label(planes > threshold, structure)
+    if count == 0:
+        return labels, np.zeros(0), np.zeros(0, dtype=np.intp)
+
+    inside = labels > 0
+    masses = np.bincount(labels[inside] - 1, weights=planes[inside], minlength=count)
+    # Labels are numbered in scan order, so every map holds a run of them
+    last_label = np.maximum.accumulate(labels.reshape(len(planes), -1).max(axis=1))
+    plane_of = np.searchsorted(last_label, np.arange(1, count + 1))
+    return labels, masses, plane_of
+
+def save_contrast_map(result, file_path, patches, arm_mask_file=arm_mask_path):
+    """
+    Saves the mean hot - cold difference on a symmetric diverging scale,
+    faded outside significant clusters.
+
+    Args:
+        result (dict): From cluster_permutation_test.
+        file_path (str): PNG to write.
+        patches (callable): Returns new marker patches.
+    """
+    limit = np.abs(result["mean"]).max() or 1
+    alpha = arm_alpha(arm_mask_file) * np.where(result["significant"], 1.0, nonsignificant_alpha)
+    rgba = render_heatmap(result["mean"], contrast_cmap, alpha, patches(), vmin=-limit, vmax=limit)
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    save_heatmap(rgba, file_path)
@@ -0,0 +1,191 @@
+import numpy as np
+from functools import lru_cache
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.transforms import Affine2D
+
+from arm_coordinates import arm_grid, warp_to_arm, canvas_to_arm, canvas_to_arm_matrix
+
+# Width of the saved heatmaps in pixels, the height follows the shown window
+heatmap_width = 1000
+heatmap_dpi = 300
+# Drawing pixels shown around the arm mask's bounding box
+extent_margin = 10
+
+arm_mask_path = "Assets/arm_mask.png"
+# Grayscale level above which a drawing pixel counts as marked
+drawing_threshold = 50
+
+@lru_cache(maxsize=None)
+def load_arm_mask(path=arm_mask_path):
+    """
+    Binary arm mask, True where a heatmap is shown.
+
+    Decoded once per process, the returned array is read-only and shared.
+    """
+    mask = np.array(Image.open(path).convert("L")) > 128
+    mask.setflags(write=False)
+    return mask
+
+@lru_cache(maxsize=None)
+def arm_alpha(path=arm_mask_path):
+    """
+    Per-pixel heatmap alpha, 1 on the arm and 0 elsewhere (read-only, shared).
+    """
+    alpha = np.where(load_arm_mask(path), 1.0, 0.0)
+    alpha.setflags(write=False)
+    return alpha
+
+@lru_cache(maxsize=None)
+def heatmap_extent(path=arm_mask_path, margin=extent_margin):
+    """
+    Part of the drawing canvas shown in a heatmap: the bounding box of the arm
+    mask plus `margin` drawing pixels on every side.
+
+    Returns:
+        tuple: (left, right, bottom, top) in drawing pixel coordinates, for render_heatmap.
+    """
+    rows, columns = np.nonzero(load_arm_mask(path))
+    return (columns.min() - 0.5 - margin, columns.max() + 0.5 + margin,
+            rows.max() + 0.5 + margin, rows.min() - 0.5 - margin)
+
+class HeatmapAccumulator:
+    """
+    Sums drawings into one preallocated uint32 count buffer.
+
+    Each drawing is thresholded into a reused uint8 buffer and added in place,
+    so memory stays the same however many drawings are added. Reuse one
+    accumulator for several heatmaps by calling reset() in between.
+
+    Args:
+        shape (tuple): (H, W) of the drawings, the arm mask's by default.
+        threshold (int): Grayscale level above which a pixel counts as marked.
+    """
+
+    def __init__(self, shape=None, threshold=drawing_threshold):
+        self.shape = tuple(shape) if shape is not None else load_arm_mask().shape
+        self.threshold = threshold
+        self.counts = np.zeros(self.shape, dtype=np.uint32)
+        self._marked = np.empty(self.shape, dtype=np.uint8)
+        self._heat = np.empty(self.shape, dtype=np.float64)
+
+    def reset(self):
+        self.counts.fill(0)
+
+    def add_gray(self, gray):
+        """
+        Adds a grayscale (H, W) drawing, pixels above the threshold count once.
+        """
+        np.greater(gray, self.threshold, out=self._marked)
+        np.add(self.counts, self._marked, out=self.counts)
+
+    def add_drawing(self, path):
+        """
+        Adds a drawing PNG. The file is only read.
+        """
+        with Image.open(path) as img:
+            self.add_gray(np.asarray(img.convert("L")))
+
+    def add_mask(self, mask):
+        """
+        Adds a binary mask, or counts already summed over several drawings.
+        """
+        np.add(self.counts, mask, out=self.counts)
+
+    def masked_heatmap(self, sigma=1, arm_mask_file=arm_mask_path):
+        """
+        Smooths the counts and cuts them to the arm.
+
+        The heat values are written to a buffer owned by the accumulator, so they
+        are only valid until the next call.
+
+        Returns:
+            (np.ndarray, np.ndarray): float64 heat values and their alpha, for render_heatmap.
+        """
+        gaussian_filter(self.counts, sigma=sigma, output=self._heat)
+        np.multiply(self._heat, load_arm_mask(arm_mask_file), out=self._heat)
+        return self._heat, arm_alpha(arm_mask_file)
+
+def render_heatmap(data, cmap, alpha, patches, extent=None, size=None, dpi=heatmap_dpi, vmin=None, vmax=None):
+    """
+    Rasterizes a heatmap and its marker patches in memory with the Agg canvas.
+
+    The heat values and alpha are warped into the canonical arm frame (see
+    arm_coordinates.arm_grid) and drawn in arm centimetres, the patches and the
+    visible window are mapped there with the same transform.
+
+    Args:
+        data (np.ndarray): 2D heat values in drawing pixel coordinates.
+        cmap: Matplotlib colormap.
+        alpha (np.ndarray): Per-pixel alpha of the heat values.
+        patches (list): Matplotlib patches (circles, rectangles) in drawing pixel
+            coordinates, drawn on top.
+        extent (tuple): Visible window (left, right, bottom, top) in drawing pixels,
+            heatmap_extent() by default.
+        size (tuple): Output (width, height) in pixels, heatmap_width wide with
+            the aspect of the extent by default.
+        dpi (int): Resolution used for line widths.
+        vmin, vmax (float): Color scale limits, the range of the data by default.
+
+    Returns:
+        np.ndarray: (height, width, 4) uint8 RGBA image on a white background.
+    """
+    extent = heatmap_extent() if extent is None else extent
+    if size is None:
+        size = (heatmap_width, round(heatmap_width * abs(extent[2] - extent[3]) / abs(extent[1] - extent[0])))
+    grid = arm_grid(data.shape)
+    data, alpha = warp_to_arm(np.stack([data, alpha]), grid, "linear")
+
+    fig = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(data, cmap=cmap, interpolation='antialiased', alpha=alpha, vmin=vmin, vmax=vmax, extent=grid["extent"])
+    to_arm = Affine2D(np.vstack([canvas_to_arm_matrix(), [0, 0, 1]])) + ax.transData
+    for patch in patches:
+        patch.set_transform(to_arm)
+        ax.add_patch(patch)
+
+    (left, right), (bottom, top) = canvas_to_arm(extent[:2], extent[2:])
+    ax.set_xlim(left, right)
+    ax.set_ylim(bottom, top)
+    ax.axis('off')
+
+    canvas.draw()
+    return np.array(canvas.buffer_rgba())
+
+def save_heatmap(rgba, file_path, margin=150, white_thresh=250):
+    """
+    Makes the white border of a rendered heatmap transparent and saves it as PNG.
+    """
+    Image.fromarray(border_white_transparent(rgba, margin, white_thresh), "RGBA").save(file_path)
+
+def make_border_white_transparent(img, margin=150, white_thresh=250):
+    """
+    Turns white pixels transparent only within `margin` pixels from the border.
+    """
+    img = img.convert("RGBA")
+    data = border_white_transparent(np.array(img), margin, white_thresh)
+    img.frombytes(data.tobytes())
+    return img
+
+def border_white_transparent(data, margin=150, white_thresh=250):
+    """
+    Array version of make_border_white_transparent, edits an RGBA uint8 array in place.
+    """
+    height, width = data.shape[:2]
+
+    # Pixels near the border
+    ys, xs = np.ogrid[:height, :width]
+    near_border = (xs < margin) | (xs >= width - margin) | (ys < margin) | (ys >= height - margin)
+
+    # Pixels whose RGB channels are all above the white threshold
+    white = (data[:, :, 0] > white_thresh) & (data[:, :, 1] > white_thresh) & (data[:, :, 2] > white_thresh)
+
+    # One little-endian uint32 per RGBA pixel, (255, 255, 255, 0) is transparent white
+    pixels = data.view("<u4")[:, :, 0]
+    np.putmask(pixels, near_border & white, 0x00FFFFFF)
+
+    return data
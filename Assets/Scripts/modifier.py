@@ -1,5 +1,8 @@
 import os
 import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from PIL import Image
 import cv2
 
@@ -31,25 +34,8 @@ def shift_images_left(folder_path, shift_pixels):
     Args:
         folder_path (str): Path to the folder containing PNGs.
         shift_pixels (int): Number of pixels to shift left.
-        save_suffix (str): Suffix to add to new filenames (default "_shifted").
     """
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(".png"):
-            img_path = os.path.join(folder_path, filename)
-            img = Image.open(img_path)
-
-            # Create a new blank (transparent) image
-            shifted = Image.new("RGBA", img.size, (0, 0, 0, 0))
-
-            # Paste original image shifted left
-            shifted.paste(img, (-shift_pixels, 0))
-
-            # Save new file
-            name, ext = os.path.splitext(filename)
-            save_path = os.path.join(folder_path, f"{name}{ext}")
-            shifted.save(save_path)
-
-            print(f"Saved shifted image: {save_path}")
+    return transform_folders([folder_path], [shift(-shift_pixels)])
 
 def delete_shifted_files(folder_path, keyword="shifted"):
     """
@@ -68,125 +54,253 @@ def delete_shifted_files(folder_path, keyword="shifted"):
                 
 def horizontal_flip_pngs_in_folder(input_folder, output_folder=None):
     # If no output folder specified, overwrite in place
-    if output_folder is None:
-        output_folder = input_folder
-    else:
-        os.makedirs(output_folder, exist_ok=True)
+    return transform_folders([input_folder], [flip_horizontal()], [output_folder])
+            
+def vertical_flip_pngs_in_folder(input_folder, output_folder=None):
+    # If no output folder specified, overwrite in place
+    return transform_folders([input_folder], [flip_vertical()], [output_folder])
 
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(".png"):
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
+def scale_and_translate_pngs_in_folder(input_folder, output_folder=None, scale=1.0, translate=(0, 0)):
+    """
+    Scales PNGs but keeps original canvas size.
+    Content is anchored at center, with optional translation.
+    Empty areas are transparent.
+    """
+    return transform_folders([input_folder], [scale_translate(scale, translate)], [output_folder])
 
-            # Open image
-            img = Image.open(input_path)
+def expand_canvas(input_folder, output_folder=None, new_size=None, fill=(255, 255, 255, 0)):
+    """
+    Expands the canvas of the images while keeping them centered.
 
-            # Flip along vertical axis (left-right flip)
-            flipped_img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    Args:
+        new_size (tuple): (width, height) of new canvas.
+        fill (tuple): RGBA background color (default: transparent).
+    """
+    return transform_folders([input_folder], [expand(new_size, fill)], [output_folder])
 
-            # Save flipped image
-            flipped_img.save(output_path)
-            print(f"Flipped: {filename}")
-            
-def vertical_flip_pngs_in_folder(input_folder, output_folder=None):
-    # If no output folder specified, overwrite in place
-    if output_folder is None:
-        output_folder = input_folder
-    else:
-        os.makedirs(output_folder, exist_ok=True)
+# --- Transform operations, composed into one warp per image by transform_folders ---
+def shift(dx, dy=0):
+    """
+    Moves the content by (dx, dy) pixels, a negative dx moves it left.
+    """
+    return {"op": "shift", "dx": dx, "dy": dy}
 
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(".png"):
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
+def flip_horizontal():
+    return {"op": "flip_horizontal"}
 
-            # Open image
-            img = Image.open(input_path)
+def flip_vertical():
+    return {"op": "flip_vertical"}
 
-            # Flip along vertical axis (left-right flip)
-            flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
+def scale_translate(scale, translate=(0, 0)):
+    """
+    Scales the content about the canvas center, then moves it by `translate`, keeping the canvas size.
+    """
+    return {"op": "scale_translate", "scale": scale, "translate": list(translate)}
 
-            # Save flipped image
-            flipped_img.save(output_path)
-            print(f"Flipped: {filename}")
+def expand(new_size, fill=(255, 255, 255, 0)):
+    """
+    Grows the canvas to `new_size` (width, height), keeping the content centered.
+    """
+    return {"op": "expand", "size": list(new_size), "fill": list(fill)}
 
-def scale_and_translate_pngs_in_folder(input_folder, output_folder=None, scale=1.0, translate=(0, 0)):
+def operation_matrix(operation, size):
     """
-    Scales PNGs but keeps original canvas size.
-    Content is anchored at center, with optional translation.
-    Empty areas are transparent.
+    3x3 matrix mapping input to output pixel coordinates of one operation,
+    and the output (width, height), for an input image of `size`.
     """
-    if output_folder is None:
-        output_folder = input_folder
+    width, height = size
+    matrix = np.eye(3)
+    kind = operation["op"]
+
+    if kind == "shift":
+        matrix[0, 2], matrix[1, 2] = operation["dx"], operation["dy"]
+    elif kind == "flip_horizontal":
+        matrix[0, 0], matrix[0, 2] = -1, width - 1
+    elif kind == "flip_vertical":
+        matrix[1, 1], matrix[1, 2] = -1, height - 1
+    elif kind == "scale_translate":
+        # Same placement as resizing to int(size * scale) and pasting centered:
+        # pixel centers map as x' + 0.5 = (x + 0.5) * scale
+        for axis, length in enumerate((width, height)):
+            scaled = int(length * operation["scale"])
+            factor = scaled / length
+            matrix[axis, axis] = factor
+            matrix[axis, 2] = (length - scaled) // 2 + operation["translate"][axis] + 0.5 * factor - 0.5
+    elif kind == "expand":
+        new_width, new_height = operation["size"]
+        if new_width < width or new_height < height:
+            raise ValueError("New size must be larger than the original image size")
+        matrix[0, 2], matrix[1, 2] = (new_width - width) // 2, (new_height - height) // 2
+        size = (new_width, new_height)
     else:
-        os.makedirs(output_folder, exist_ok=True)
-
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(".png"):
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
+        raise ValueError(f"Unknown transform operation: {kind}")
 
-            # Open with alpha channel
-            img = Image.open(input_path).convert("RGBA")
+    return matrix, tuple(size)
 
-            # Scale image content
-            new_size = (int(img.width * scale), int(img.height * scale))
-            img_scaled = img.resize(new_size, Image.LANCZOS)
+def compose_operations(operations, size):
+    """
+    Folds a list of operations into one matrix and the final canvas size.
 
-            # Create background with same size as original
-            canvas = Image.new("RGBA", (img.width, img.height), (0, 0, 0, 0))
+    Returns:
+        (np.ndarray, tuple): 3x3 matrix from input to output pixels, output (width, height).
+    """
+    matrix = np.eye(3)
+    for operation in operations:
+        step, size = operation_matrix(operation, size)
+        matrix = step @ matrix
+    return matrix, tuple(size)
 
-            # Compute offsets: center + translation
-            x_offset = (img.width - img_scaled.width) // 2 + translate[0]
-            y_offset = (img.height - img_scaled.height) // 2 + translate[1]
+def moves_whole_pixels(matrix):
+    """
+    True for shifts and flips by whole pixels, which are copied without resampling.
+    """
+    return np.all(np.isin(matrix[:2, :2], (-1, 0, 1))) and np.allclose(matrix[:2, 2], np.round(matrix[:2, 2]))
 
-            # Paste scaled image centered
-            canvas.paste(img_scaled, (x_offset, y_offset), img_scaled)
+def warp_image(img, matrix, size, fill=None):
+    """
+    Applies a composed transform to an image in one resampling step.
 
-            # Save output
-            canvas.save(output_path, "PNG")
-            print(f"Saved transformed PNG: {output_path}")
+    Shifts and flips copy pixels exactly, anything else is bicubic resampled
+    on premultiplied alpha. With a `fill` the warped image is pasted onto a
+    canvas of that color with its own alpha as the mask, like expand_canvas
+    always did, so partly transparent pixels blend with the fill.
+    An image without alpha keeps its mode if it stays fully covered.
+    """
+    rgba = np.asarray(img.convert("RGBA"))
+    affine_matrix = matrix[:2]
 
-def expand_canvas(input_folder, output_folder=None, new_size=None, fill=(255, 255, 255, 0)):
-    # If no output folder specified, overwrite in place
-    if output_folder is None:
-        output_folder = input_folder
+    if moves_whole_pixels(matrix):
+        warped = cv2.warpAffine(rgba, affine_matrix, size, flags=cv2.INTER_NEAREST,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
     else:
-        os.makedirs(output_folder, exist_ok=True)
+        premultiplied = cv2.cvtColor(rgba, cv2.COLOR_RGBA2mRGBA)
+        warped = cv2.warpAffine(premultiplied, affine_matrix, size, flags=cv2.INTER_CUBIC,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+        warped = cv2.cvtColor(warped, cv2.COLOR_mRGBA2RGBA)
+        if fill is None:
+            # No color under fully transparent pixels
+            warped[warped[:, :, 3] == 0] = 0
+
+    result = Image.fromarray(warped, "RGBA")
+    if fill is not None:
+        canvas = Image.new("RGBA", size, tuple(fill))
+        canvas.paste(result, (0, 0), result)
+        result = canvas
+        warped = np.asarray(result)
+    if img.mode != "RGBA" and warped[:, :, 3].min() == 255:
+        result = result.convert(img.mode)
+    return result
+
+def transform_file(job):
+    """
+    Transforms one PNG and writes it when its pixels change.
 
-    for filename in os.listdir(input_folder):
-         if filename.lower().endswith(".png"):
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
-            """
-            Expands the canvas of an image while keeping it centered.
+    Args:
+        job (tuple): (input_path, output_path, operations, dry_run).
 
-            Args:
-                input_path (str): Path to input image.
-                output_path (str): Path to save expanded image.
-                new_size (tuple): (width, height) of new canvas.
-                fill (tuple): RGBA background color (default: transparent).
-            """
-            img = Image.open(input_path).convert("RGBA")
-            old_w, old_h = img.size
-            new_w, new_h = new_size
+    Returns:
+        dict: "input", "output", "size" (before, after) and "changed".
+    """
+    input_path, output_path, operations, dry_run = job
+    with Image.open(input_path) as img:
+        img.load()
+
+    matrix, size = compose_operations(operations, img.size)
+    fills = [operation["fill"] for operation in operations if operation["op"] == "expand"]
+    if size == img.size and np.allclose(matrix, np.eye(3)):
+        result = img
+    else:
+        result = warp_image(img, matrix, size, fills[-1] if fills else None)
 
-            if new_w < old_w or new_h < old_h:
-                raise ValueError("New size must be larger than the original image size")
+    if os.path.abspath(output_path) == os.path.abspath(input_path):
+        current = img
+    elif os.path.exists(output_path):
+        current = Image.open(output_path)
+    else:
+        current = None
+    changed = current is None or not same_pixels(current, result)
 
-            # Create new canvas
-            canvas = Image.new("RGBA", (new_w, new_h), fill)
+    if changed and not dry_run:
+        save_png_atomic(result, output_path)
+    return {"input": input_path, "output": output_path, "size": (img.size, size), "changed": changed}
 
-            # Calculate offset to center original image
-            offset_x = (new_w - old_w) // 2
-            offset_y = (new_h - old_h) // 2
+def same_pixels(a, b):
+    return a.mode == b.mode and a.size == b.size and np.array_equal(np.asarray(a), np.asarray(b))
 
-            # Paste image onto canvas
-            canvas.paste(img, (offset_x, offset_y), img)
-            canvas.save(output_path, "PNG")
-            print(f"Saved expanded image: {output_path}")
+def save_png_atomic(img, path):
+    """
+    Writes next to the target then renames, so a file is never left half written.
+    """
+    tmp_path = f"{path}.tmp"
+    img.save(tmp_path, "PNG")
+    os.replace(tmp_path, path)
+
+def transform_folders(folders, operations, output_folders=None, workers=1, dry_run=False):
+    """
+    Applies a list of operations to every PNG of several folders.
 
+    The operations are composed into one transform per image, so each file is
+    decoded, resampled and encoded once however many operations are chained.
+    Files are spread over a process pool and written atomically, only when
+    their pixels change.
 
+    Args:
+        folders (list of str): Folders of PNGs.
+        operations (list of dict): From shift, flip_horizontal, flip_vertical,
+            scale_translate and expand, applied in order.
+        output_folders (list of str): Output folder per input folder, None (or a None entry) overwrites in place.
+        workers (int): Number of processes.
+        dry_run (bool): Only report which files would change.
+
+    Returns:
+        list of dict: One result per file, see transform_file.
+    """
+    if output_folders is None:
+        output_folders = [None] * len(folders)
+
+    jobs = []
+    for input_folder, output_folder in zip(folders, output_folders):
+        output_folder = output_folder or input_folder
+        if not dry_run:
+            os.makedirs(output_folder, exist_ok=True)
+        for filename in sorted(os.listdir(input_folder)):
+            if filename.lower().endswith(".png"):
+                jobs.append((os.path.join(input_folder, filename), os.path.join(output_folder, filename), operations, dry_run))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(transform_file, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [transform_file(job) for job in jobs]
+
+    action = "Would change" if dry_run else "Saved"
+    for result in results:
+        if result["changed"]:
+            (old_w, old_h), (new_w, new_h) = result["size"]
+            resized = f" ({old_w}x{old_h} -> {new_w}x{new_h})" if (old_w, old_h) != (new_w, new_h) else ""
+            print(f"{action}: {result['output']}{resized}")
+    changed = sum(result["changed"] for result in results)
+    print(f"{changed} of {len(results)} PNGs {'would change' if dry_run else 'changed'} in {len(folders)} folders")
+    return results
+
+def main():
+    args = parse_args()
+
+    folders = [
+        f"D:\\UnityProjects\\TestingSuite\\Assets\\Studies\\CHI26_Study3_Motion\\drawings\\p{i}"
+        for i in range(1, 12)
+    ]
+    #operations = [scale_translate(.8, translate=(45, 0))]
+    operations = [flip_horizontal()]
+    transform_folders(folders, operations, workers=args.workers, dry_run=args.dry_run)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply a chain of image transforms to folders of drawings.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to spread the files over (default: 1)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report which files would change")
+    return parser.parse_args()
 
 #rename_files_in_folder("Assets\Studies\CHI26_Study1_Funneling\drawings\p20", 20, 1)
 #shift_images_left("Assets\Studies\CHI26_Study1_Funneling\drawings\p1", shift_pixels=50)
@@ -194,7 +308,5 @@ def expand_canvas(input_folder, output_folder=None, new_size=None, fill=(255, 25
 #flip_pngs_in_folder("Assets\Studies\CHI26_Study1_Funneling\drawings\p4")
 #shift_images_left("Assets\Studies\CHI26_Study1_Funneling\drawings\p4", shift_pixels=10)
 
-for i in range(1, 12):
-    path = f"D:\\UnityProjects\\TestingSuite\\Assets\\Studies\\CHI26_Study3_Motion\\drawings\\p{i}"
-    #scale_and_translate_pngs_in_folder(path, scale=.8, translate=(45,0))
-    horizontal_flip_pngs_in_folder(path)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import itertools
+import warnings
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from assumption_checks import adjust_p_values
+
+# Mauchly p value below which sphericity is rejected and the Greenhouse-Geisser p value is the one to report
+sphericity_alpha = 0.05
+
+def subject_means(df, measures, factors, subject="Participant"):
+    """
+    Every subject's mean of each measure in every cell of the full factorial design.
+
+    Returns:
+        (list, list of list, np.ndarray): Subjects, the levels of each factor and
+        the (measure, subject, cell) means, cells in row-major order of the levels
+        and NaN where a subject has no trial.
+    """
+    subjects = sorted(df[subject].unique())
+    levels = [sorted(df[factor].unique()) for factor in factors]
+    grid = pd.MultiIndex.from_product([subjects] + levels, names=[subject] + list(factors))
+    means = df.groupby([subject] + list(factors))[list(measures)].mean().reindex(grid)
+    values = means.to_numpy(dtype=np.float64).reshape(len(subjects), -1, len(measures))
+    return subjects, levels, values.transpose(2, 0, 1)
+
+def helmert_contrasts(k):
+    """
+    (k, k - 1) orthonormal contrasts, each orthogonal to the mean.
+    """
+    contrasts = np.zeros((k, k - 1))
+    for j in range(1, k):
+        contrasts[:j, j - 1] = 1
+        contrasts[j, j - 1] = -j
+        contrasts[:, j - 1] /= np.sqrt(j * (j + 1))
+    return contrasts
+
+def effect_contrasts(levels, factors):
+    """
+    Contrast matrix of every main effect and interaction.
+
+    The contrasts of an effect are the Kronecker product of orthonormal contrasts
+    of its factors and normalized means over the others, so projecting the cell
+    means on them leaves exactly that effect.
+
+    Returns:
+        dict: {source name: (cells, df) matrix}, main effects first.
+    """
+    contrasts = {}
+    for order in range(1, len(factors) + 1):
+        for effect in itertools.combinations(range(len(factors)), order):
+            matrix = np.ones((1, 1))
+            for i, factor_levels in enumerate(levels):
+                k = len(factor_levels)
+                part = helmert_contrasts(k) if i in effect else np.full((k, 1), 1 / np.sqrt(k))
+                matrix = np.kron(matrix, part)
+            contrasts[" * ".join(factors[i] for i in effect)] = matrix
+    return contrasts
+
+def rm_anova(means, levels, factors):
+    """
+    Repeated-measures ANOVA of every measure at once, with Mauchly's test and
+    the Greenhouse-Geisser correction.
+
+    Per effect, the (measure, subject, cell) means are projected on its
+    contrasts in one batched product. The effect's sum of squares is then n
+    times the squared mean projection, the error's the squared deviations from
+    it, and the projections' covariance gives sphericity. Subjects missing a
+    cell are left out of that measure; measures missing the same subjects are
+    computed together.
+
+    Args:
+        means (np.ndarray): (measure, subject, cell) means from subject_means.
+        levels (list of list): Levels of each factor.
+        factors (list of str): Factor names.
+
+    Returns:
+        list of dict: Per measure index and source, "Source", "n", "ddof1", "ddof2",
+        "SS", "SS_error", "F", "p_unc", "np2", "W_mauchly", "p_mauchly", "eps_gg" and "p_gg".
+    """
+    contrasts = effect_contrasts(levels, factors)
+    complete = ~np.isnan(means).any(axis=2)
+
+    rows = []
+    for mask in np.unique(complete, axis=0):
+        batch = np.flatnonzero((complete == mask).all(axis=1))
+        values = means[batch][:, mask]
+        n = int(mask.sum())
+        for source, matrix in contrasts.items():
+            p = matrix.shape[1]
+            projected = values @ matrix  # (measure, subject, df)
+            center = projected.mean(axis=1, keepdims=True)
+            residual = projected - center
+            ss_effect = n * np.square(center).sum(axis=(1, 2))
+            ss_error = np.square(residual).sum(axis=(1, 2))
+            ddof2 = p * (n - 1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                f = (ss_effect / p) / (ss_error / ddof2)
+                covariance = np.einsum("bni,bnj->bij", residual, residual) / (n - 1)
+                trace = np.trace(covariance, axis1=1, axis2=2)
+                eps = np.clip(trace ** 2 / (p * np.einsum("bij,bji->b", covariance, covariance)), 1 / p, 1)
+                w, p_mauchly = mauchly(covariance, n)
+            p_unc = stats.f.sf(f, p, ddof2)
+            p_gg = stats.f.sf(f, p * eps, ddof2 * eps)
+            for i, measure in enumerate(batch):
+                rows.append({"measure": measure, "Source": source, "n": n, "ddof1": p, "ddof2": ddof2,
+                             "SS": ss_effect[i], "SS_error": ss_error[i], "F": f[i], "p_unc": p_unc[i],
+                             "np2": ss_effect[i] / (ss_effect[i] + ss_error[i]) if ss_effect[i] + ss_error[i] > 0 else np.nan,
+                             "W_mauchly": w[i], "p_mauchly": p_mauchly[i], "eps_gg": eps[i], "p_gg": p_gg[i]})
+    return rows
+
+def mauchly(covariance, n):
+    """
+    Mauchly's test of sphericity of a batch of (p, p) contrast covariances.
+
+    Returns:
+        (np.ndarray, np.ndarray): W and its chi-square p value, 1 for one contrast
+        and NaN with too few subjects.
+    """
+    p = covariance.shape[1]
+    if p == 1:
+        return np.ones(len(covariance)), np.ones(len(covariance))
+    if n <= p:
+        return np.full(len(covariance), np.nan), np.full(len(covariance), np.nan)
+    trace = np.trace(covariance, axis1=1, axis2=2)
+    w = np.linalg.det(covariance) / (trace / p) ** p
+    correction = 1 - (2 * p ** 2 + p + 2) / (6 * p * (n - 1))
+    chi2 = -(n - 1) * correction * np.log(w)
+    return w, stats.chi2.sf(chi2, p * (p + 1) / 2 - 1)
+
+def nonparametric_tests(means, levels, factors):
+    """
+    Friedman test of every factor with more than two levels and Wilcoxon
+    signed-rank test of two-level ones, on each subject's means over the other
+    factors, for every measure at once.
+
+    Returns:
+        list of dict: Per measure index and factor, "Source", "Test", "n",
+        "statistic", "p_unc" and "kendall_w" (Friedman only).
+    """
+    shaped = means.reshape(means.shape[:2] + tuple(len(factor_levels) for factor_levels in levels))
+    rows = []
+    for i, factor in enumerate(factors):
+        others = tuple(axis + 2 for axis in range(len(factors)) if axis != i)
+        with warnings.catch_warnings():
+            # Subjects missing a whole level are left out, which numpy warns about
+            warnings.simplefilter("ignore", RuntimeWarning)
+            collapsed = np.nanmean(shaped, axis=others)  # (measure, subject, level)
+        n = (~np.isnan(collapsed).any(axis=2)).sum(axis=1)
+        k = collapsed.shape[2]
+        if k < 2:
+            continue
+        if k == 2:
+            test = "Wilcoxon"
+            statistic, p = stats.wilcoxon(collapsed[..., 0], collapsed[..., 1], axis=1, nan_policy="omit")
+            kendall = np.full(len(collapsed), np.nan)
+        else:
+            test = "Friedman"
+            statistic, p = stats.friedmanchisquare(*collapsed.transpose(2, 0, 1), axis=1, nan_policy="omit")
+            kendall = statistic / (n * (k - 1))
+        for measure in range(len(collapsed)):
+            rows.append({"measure": measure, "Source": factor, "Test": test, "n": int(n[measure]),
+                         "statistic": np.asarray(statistic)[measure], "p_unc": np.asarray(p)[measure],
+                         "kendall_w": kendall[measure]})
+    return rows
+
+def repeated_measures_analysis(df, measures, factors, subject="Participant", nonnormal=None):
+    """
+    Repeated-measures ANOVA of every measure over the full factorial within-subject
+    design, with nonparametric tests of the measures that are not normal.
+
+    Args:
+        df (pd.DataFrame): Trials.
+        measures (list of str): Dependent variables.
+        factors (list of str): Within-subject factors.
+        subject (str): Subject column, trials are averaged per subject and cell.
+        nonnormal (list of str): Measures to also test nonparametrically, all by default.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): The ANOVA table, with "p_report" (the
+        Greenhouse-Geisser p value unless Mauchly's test keeps sphericity) and
+        its Holm correction over the table, and the nonparametric table.
+    """
+    measures = list(measures)
+    _, levels, means = subject_means(df, measures, factors, subject)
+
+    anova = pd.DataFrame(rm_anova(means, levels, list(factors)))
+    anova.insert(0, "Measure", [measures[i] for i in anova.pop("measure")])
+    # Without enough subjects for Mauchly's test the correction is kept
+    anova["sphericity"] = anova["p_mauchly"] >= sphericity_alpha
+    anova["p_report"] = np.where(anova["sphericity"], anova["p_unc"], anova["p_gg"])
+    anova["p_corrected"] = adjust_p_values(anova["p_report"])
+    order = {measure: i for i, measure in enumerate(measures)}
+    anova = anova.sort_values("Measure", key=lambda column: column.map(order), kind="stable").reset_index(drop=True)
+
+    tested = [i for i, measure in enumerate(measures) if nonnormal is None or measure in nonnormal]
+    nonparametric = pd.DataFrame(nonparametric_tests(means[tested], levels, list(factors)),
+                                 columns=["measure", "Source", "Test", "n", "statistic", "p_unc", "kendall_w"])
+    nonparametric.insert(0, "Measure", [measures[tested[i]] for i in nonparametric.pop("measure")])
+    nonparametric["p_corrected"] = adjust_p_values(nonparametric["p_unc"])
+    nonparametric = nonparametric.sort_values("Measure", key=lambda column: column.map(order), kind="stable").reset_index(drop=True)
+    return anova, nonparametric
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+def long_table(df, measures, by):
+    """
+    Trials of the measures in long format, one row per trial and measure.
+
+    Args:
+        df (pd.DataFrame): Trials.
+        measures (list of str): Columns to export.
+        by (list of str): Columns identifying a cell, trials with a missing key are left out.
+
+    Returns:
+        pd.DataFrame: by, "Measure" (categorical in the order given), "Row"
+        (int32 position of the trial within its cell) and "Value".
+    """
+    df = df.dropna(subset=list(by))
+    row = df.groupby(list(by), sort=False).cumcount().to_numpy(dtype=np.int32)
+    long = df[list(by) + list(measures)].assign(Row=row).melt(
+        id_vars=list(by) + ["Row"], value_vars=list(measures), var_name="Measure", value_name="Value")
+    long["Measure"] = pd.Categorical(long["Measure"], categories=list(measures))
+    return long[list(by) + ["Measure", "Row", "Value"]]
+
+def wide_table(long, by, template):
+    """
+    One column per measure and cell, the cell's trials top down and padded with NaN.
+
+    The (row, column) of every value are known from the long table, so the
+    whole table is one scatter into a NaN-filled array.
+
+    Args:
+        long (pd.DataFrame): From long_table, or read back from its Parquet file.
+        by (list of str): Cell columns of the table.
+        template (str): Column name, formatted with the cell's levels in the
+            order of `by` and `measure`, e.g. "{measure}_T{0}_D{1}".
+
+    Returns:
+        pd.DataFrame: Columns in measure order, then sorted cells. Columns
+        without padding keep the dtype of the values.
+    """
+    keys = ["Measure"] + list(by)
+    grouped = long.groupby(keys, sort=True, observed=True)
+    column = grouped.ngroup().to_numpy()
+    row = long["Row"].to_numpy()
+
+    values = np.full((row.max() + 1 if len(row) else 0, grouped.ngroups), np.nan)
+    values[row, column] = long["Value"].to_numpy(dtype=np.float64)
+    names = [template.format(*key[1:], measure=key[0]) for key in grouped.groups.keys()]
+    wide = pd.DataFrame(values, columns=names)
+
+    full = [name for name, count in zip(names, np.bincount(column, minlength=len(names))) if count == len(wide)]
+    return wide.astype({name: long["Value"].dtype for name in full})
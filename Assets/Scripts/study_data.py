@@ -0,0 +1,240 @@
+import os
+import json
+import pandas as pd
+
+try:
+    import pyarrow  # Parquet engine for the dataset cache
+    parquet_available = True
+except ImportError:
+    parquet_available = False
+
+cache_filename = "study_data_cache.parquet"
+manifest_filename = "study_data_cache.json"
+
+# Study-level dataset written by combine_data, one Participant=N partition each
+dataset_folder = "study_data"
+
+# Per-participant formats combine_data can write, fastest to read first
+data_formats = ["parquet", "feather", "csv", "xlsx"]
+
+def participant_source(folder_path, participant):
+    """
+    Finds the newest data file of a participant.
+
+    A file left in another format by an earlier combine_data run must not
+    shadow a newer one, so the most recently written of the study dataset
+    partition and the per-participant files wins. Files written at the same
+    time go in speed order, the partition first and then data_formats order.
+
+    Returns:
+        str: Path of the file to read, or None if there is none.
+    """
+    candidates = [dataset_partition_path(folder_path, participant)] if parquet_available else []
+    candidates += [participant_data_path(folder_path, f"p{participant}", fmt) for fmt in data_formats]
+
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        return None
+    # max() keeps the first of equal mtimes, the fastest to read
+    return max(existing, key=os.path.getmtime)
+
+def participant_data_path(folder_path, key, fmt):
+    return os.path.join(folder_path, f"{key}_data.{fmt}")
+
+def dataset_partition_path(folder_path, participant):
+    return os.path.join(folder_path, dataset_folder, f"Participant={participant}", "part-0.parquet")
+
+def combined_data_patterns(folder_path, fmt, dataset=False):
+    """
+    Glob patterns of the files combine_data writes with the given options.
+
+    Args:
+        folder_path (str): Folder of the combined data files.
+        fmt (str): Format of the per-participant files (see data_formats), or "none".
+        dataset (bool): Whether the study-level Parquet dataset is written too.
+    """
+    patterns = [] if fmt == "none" else [participant_data_path(folder_path, "p*", fmt)]
+    if dataset:
+        patterns.append(dataset_partition_path(folder_path, "*"))
+    return patterns
+
+def read_data_file(path):
+    """
+    Reads a participant data file of any of the data_formats.
+    """
+    fmt = os.path.splitext(path)[1][1:]
+    if fmt == "parquet":
+        return pd.read_parquet(path)
+    if fmt == "feather":
+        return pd.read_feather(path)
+    if fmt == "csv":
+        return pd.read_csv(path)
+    return pd.read_excel(path, sheet_name=0)
+
+def write_participant_data(df, output_folder, key, fmt):
+    """
+    Saves one combined participant table as '{key}_data.{fmt}'.
+
+    Returns:
+        str: Path of the written file.
+    """
+    out_path = participant_data_path(output_folder, key, fmt)
+    if fmt == "parquet":
+        df.to_parquet(out_path, index=False)
+    elif fmt == "feather":
+        df.to_feather(out_path)
+    elif fmt == "csv":
+        df.to_csv(out_path, index=False)
+    else:
+        df.to_excel(out_path, index=False)
+    return out_path
+
+def write_dataset_partition(df, output_folder, participant):
+    """
+    Saves one participant as a partition of the study-level Parquet dataset.
+
+    The folder follows the Participant=N layout, so the whole dataset can also be
+    read at once with pd.read_parquet(os.path.join(output_folder, dataset_folder)).
+
+    Returns:
+        str: Path of the written partition file.
+    """
+    out_path = dataset_partition_path(output_folder, participant)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    df.drop(columns="Participant", errors="ignore").to_parquet(out_path, index=False)
+    return out_path
+
+def load_participant_data(folder_path, participants, use_cache=True):
+    """
+    Reads the data of each participant and stacks them into one table.
+
+    Each participant is read from the newest source participant_source finds
+    (study dataset or p#_data.parquet/.feather/.csv/.xlsx). The combined table
+    is cached as Parquet next to the files, and a participant is only read again
+    when their source file or its mtime changed, so repeated loads skip openpyxl
+    entirely.
+
+    Args:
+        folder_path (str): Path to folder containing the combined data files.
+        participants (list of int): Participant numbers to include.
+        use_cache (bool): Read and update the Parquet cache (needs pyarrow).
+
+    Returns:
+        pd.DataFrame: All trials of all participants, with a Participant column.
+    """
+    use_cache = use_cache and parquet_available
+    cache_path = os.path.join(folder_path, cache_filename)
+    manifest_path = os.path.join(folder_path, manifest_filename)
+
+    cached, manifest = None, {}
+    if use_cache and os.path.exists(cache_path) and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            # The manifest names the cache file it was written with, another
+            # process may have replaced the cache in between
+            if manifest.get("cache") == cache_version(cache_path):
+                cached = pd.read_parquet(cache_path)
+            else:
+                manifest = {}
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache {cache_path}: {e}")
+            cached, manifest = None, {}
+
+    all_data = []
+    updated = {}
+
+    for p in participants:
+        filename = participant_source(folder_path, p)
+        if filename is None:
+            print(f"Warning: File not found for participant {p}")
+            continue
+
+        source = [os.path.relpath(filename, folder_path), os.path.getmtime(filename)]
+        if cached is not None and manifest.get(str(p)) == source:
+            all_data.append(cached[cached["Participant"] == p])
+            continue
+
+        try:
+            df = read_data_file(filename)
+            if "Participant" in df.columns:
+                df["Participant"] = p
+            else:
+                # Dataset partitions store the participant in the folder name
+                df.insert(0, "Participant", p)
+            all_data.append(df)
+            updated[p] = (df, source)
+        except Exception as e:
+            print(f"❌ Failed to process {filename}: {e}")
+
+    if use_cache and updated:
+        update_cache(cache_path, manifest_path, cached, manifest, updated)
+
+    if not all_data:
+        print("No data loaded.")
+        return pd.DataFrame()
+
+    return pd.concat(all_data, ignore_index=True)
+
+def cache_version(cache_path):
+    """
+    (mtime, size) of the cache file, recorded in the manifest written with it.
+    """
+    stat = os.stat(cache_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def update_cache(cache_path, manifest_path, cached, manifest, updated):
+    """
+    Replaces the cached rows of the updated participants and rewrites the cache.
+
+    Both files are written to temp files of this process and moved into place
+    with os.replace, the cache first, so concurrent loads never read half a
+    file. The manifest records the version of its cache, and a cache replaced
+    by another process is not paired with this manifest.
+    """
+    frames = []
+    if cached is not None:
+        frames.append(cached[~cached["Participant"].isin(list(updated))])
+    frames.extend(df for df, _ in updated.values())
+
+    for p, (_, source) in updated.items():
+        manifest[str(p)] = source
+
+    tmp_cache = f"{cache_path}.{os.getpid()}.tmp"
+    tmp_manifest = f"{manifest_path}.{os.getpid()}.tmp"
+    try:
+        pd.concat(frames, ignore_index=True).to_parquet(tmp_cache, index=False)
+        manifest["cache"] = cache_version(tmp_cache)
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_cache, cache_path)
+        os.replace(tmp_manifest, manifest_path)
+        print(f"Updated data cache for participants {sorted(updated)}")
+    except Exception as e:
+        print(f"Warning: Could not write cache {cache_path}: {e}")
+        for path in (tmp_cache, tmp_manifest):
+            if os.path.exists(path):
+                os.remove(path)
+
+def trials_by_condition(df, condition_columns):
+    """
+    Groups trial numbers by condition and participant in a single pass.
+
+    Args:
+        df (pd.DataFrame): Trials to group (already filtered to valid trials).
+        condition_columns (list of str): Columns identifying a condition,
+            e.g. ["Temperature", "Location", "Duration"].
+
+    Returns:
+        dict: {condition tuple: {participant: [trial, ...]}}
+    """
+    grouped = {}
+    if df.empty:
+        return grouped
+
+    for keys, trials in df.groupby(condition_columns + ["Participant"], sort=False)["Trial"]:
+        *condition, participant = keys
+        grouped.setdefault(tuple(condition), {})[participant] = trials.tolist()
+
+    return grouped
@@ -0,0 +1,163 @@
+import os
+import glob
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from file_manifest import load_manifest, save_manifest, file_fingerprints
+
+def stage(name, run, after=(), inputs=(), outputs=()):
+    """
+    Declares one step of a study pipeline.
+
+    Args:
+        name (str): Unique stage name.
+        run (callable): Top-level function called with the results of the `after`
+            stages, in that order. Its return value is handed to later stages in
+            memory, so it has to be picklable when the pipeline runs with workers.
+        after (list of str): Stages whose results `run` needs.
+        inputs (list of str): Files or glob patterns the stage reads from disk,
+            including its own scripts.
+        outputs (list of str): Files or glob patterns the stage writes. A stage
+            whose outputs are missing is always run.
+
+    Returns:
+        dict: The stage definition.
+    """
+    return {"name": name, "run": run, "after": list(after), "inputs": list(inputs), "outputs": list(outputs)}
+
+def run_pipeline(stages, manifest_path, workers=1, force=False, params=None):
+    """
+    Runs the stages of a pipeline in dependency order, skipping unchanged ones.
+
+    Every stage gets a key from the content of its input files, its parameters
+    and the keys of the stages it runs after. A stage is skipped when its key
+    matches the one of its last successful run and its outputs exist. Stages
+    that are skipped but whose results a rerun stage needs are run again to get
+    their in-memory results.
+
+    Args:
+        stages (list of dict): Stages made with stage().
+        manifest_path (str): JSON file remembering the key of every stage.
+        workers (int): Processes to run independent stages in at the same time,
+            1 runs everything in this process.
+        force (bool): Run every stage, whatever the manifest says.
+        params: JSON-serializable settings that all stages depend on (e.g. the
+            participant list).
+
+    Returns:
+        dict: {stage name: result} of the stages that ran.
+    """
+    by_name = {s["name"]: s for s in stages}
+    order = topological_order(stages)
+    manifest = load_manifest(manifest_path)
+
+    # Plan: which stages changed, and which unchanged ones they need results from
+    keys = {}
+    dirty = set()
+    for name in order:
+        s = by_name[name]
+        keys[name], _ = stage_key(s, keys, params, manifest.get(name, {}).get("files"))
+        missing = any(not glob.glob(pattern) for pattern in s["outputs"])
+        if force or missing or manifest.get(name, {}).get("key") != keys[name]:
+            dirty.add(name)
+
+    needed = set(dirty)
+    for name in reversed(order):
+        if name in needed:
+            needed.update(by_name[name]["after"])
+
+    for name in order:
+        if name not in needed:
+            print(f"[{name}] unchanged, skipped")
+
+    results = {}
+    pending = [name for name in order if name in needed]
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    running = {}
+
+    try:
+        while pending or running:
+            # Start every stage whose upstream results are all in
+            for name in [n for n in pending if all(dep in results for dep in by_name[n]["after"])]:
+                pending.remove(name)
+                s = by_name[name]
+                args = [results[dep] for dep in s["after"]]
+                # Key again now that upstream stages may have rewritten the inputs, later
+                # stages are keyed on this key, the one saved in the manifest
+                key, files = stage_key(s, keys, params, manifest.get(name, {}).get("files"))
+                keys[name] = key
+                print(f"[{name}] running")
+                if executor is None:
+                    start = time.time()
+                    results[name] = s["run"](*args)
+                    finish_stage(manifest, manifest_path, name, key, files, start)
+                else:
+                    running[executor.submit(s["run"], *args)] = (name, key, files, time.time())
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key, files, start = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    print(f"[{name}] failed")
+                    raise
+                finish_stage(manifest, manifest_path, name, key, files, start)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return results
+
+def finish_stage(manifest, manifest_path, name, key, files, start):
+    manifest[name] = {"key": key, "files": files}
+    save_manifest(manifest, manifest_path)
+    print(f"[{name}] done in {time.time() - start:.1f} s")
+
+def stage_key(s, keys, params, previous_files=None):
+    """
+    Hashes the input file contents, parameters and upstream keys of a stage.
+
+    Returns:
+        (str, dict): The key, and the fingerprints of the input files.
+    """
+    paths = sorted({path for pattern in s["inputs"] for path in glob.glob(pattern)})
+    files = file_fingerprints(paths, previous_files)
+
+    content = {
+        "name": s["name"],
+        "files": {path: fp["sha1"] for path, fp in files.items()},
+        "after": [keys[dep] for dep in s["after"]],
+        "params": params,
+    }
+    key = hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    return key, files
+
+def topological_order(stages):
+    """
+    Orders the stages so that each comes after the stages it depends on.
+    """
+    by_name = {s["name"]: s for s in stages}
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+        if name not in by_name:
+            raise ValueError(f"Unknown pipeline stage '{name}'")
+        visiting.add(name)
+        for dep in by_name[name]["after"]:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for s in stages:
+        visit(s["name"])
+    return order
@@ -2,16 +2,50 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 import numpy as np
+import sys
+import argparse
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from arm_coordinates import location_from_elbow, fraction_to_cm
+from condition_stats import summarize_trials, merge_summaries, summary_table, update_summaries, load_summaries, jackknife_report
+
+# Conditions and measures kept as mergeable per-participant statistics (see condition_stats)
+summary_by = ["Location", "Temperature", "Duration"]
+summary_values = ["FeltLocation", "LocationError"]
+summary_matches = ["ThermalMatch"]
+summary_bins = {"FeltLocation": np.linspace(0, 1, 11)}
 
 def main():
-    participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
+    args = parse_args()
+    participants = args.participants or [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
     parent_folder = 'Assets/Studies/CHI26_Study1_Funneling'
     input_folder = f'{parent_folder}/data_processing/data'
     output_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
 
+    if args.jackknife:
+        report_influence(load_summaries(input_folder, participants), output_folder)
+        return
+
+    if args.from_summaries:
+        # Merges the stored per-participant statistics, no trial data is read
+        os.makedirs(output_folder, exist_ok=True)
+        plot_locations(load_summaries(input_folder, participants), output_folder)
+        return
+
     combined_data, excel_file = process_participant_data(input_folder, participants, output_folder)
     generate_graph(combined_data, excel_file, output_folder)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze the trials of the participants and plot the perceived locations.")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to include instead of the configured list")
+    parser.add_argument("--from-summaries", action="store_true",
+                        help="Only plot, from the condition summaries stored by an earlier run")
+    parser.add_argument("--jackknife", action="store_true",
+                        help="Only score each participant's influence on the condition estimates, from the stored summaries")
+    return parser.parse_args()
+
 def process_participant_data(folder_path, participants, output_folder):
     """
     Reads Excel files named 'p#_responses.xlsx' for given participants,
@@ -26,37 +60,41 @@ def process_participant_data(folder_path, participants, output_folder):
     Returns:
         pd.DataFrame: Combined processed DataFrame.
     """
-    filtered_data = []
-    all_data = []
+    df = load_participant_data(folder_path, participants)
+    if df.empty:
+        return pd.DataFrame()
 
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
+    return analyze_participant_data(df, participants, output_folder, folder_path)
 
-            df["Participant"] = p
-            df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
+def analyze_participant_data(df, participants, output_folder, summary_folder=None):
+    """
+    Adds the derived columns to the combined trials of all participants, keeps
+    the valid trials and saves them as 'p#-p#_analysis.xlsx' and '.csv'.
 
-            # Location correction to flip wrist - elbow
-            df["Location"] = 1 - df["Location"]
-            df["FeltLocation"] = 1 - df["FeltLocation"]
+    Args:
+        df (pd.DataFrame): Trials from load_participant_data, modified in place.
+        participants (list of int): Participant numbers, used for the file name.
+        output_folder (str): Path to save the combined analysis file.
+        summary_folder (str): Folder to store the participants' condition summaries in.
 
-            df["LocationError"] = df["Location"] - df["FeltLocation"]
+    Returns:
+        (pd.DataFrame, str): Valid trials and the path of the saved xlsx.
+    """
+    df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
 
-            include_mask = df["ThermalMatch"] == 1 #& (df["LocationError"] <= 0.45)
-            df_filtered = df[include_mask].copy()
+    # Location correction to flip wrist - elbow
+    df["Location"] = location_from_elbow(df["Location"])
+    df["FeltLocation"] = location_from_elbow(df["FeltLocation"])
 
-            all_data.append(df)
-            filtered_data.append(df_filtered)
-        else:
-            print(f"Warning: File not found for participant {p}")
+    df["LocationError"] = df["Location"] - df["FeltLocation"]
 
-    if not all_data:
-        print("No data loaded.")
-        return pd.DataFrame()
+    include_mask = df["ThermalMatch"] == 1 #& (df["LocationError"] <= 0.45)
 
-    all_combined = pd.concat(all_data, ignore_index=True)
-    filtered_combined = pd.concat(filtered_data, ignore_index=True)
+    if summary_folder:
+        update_summaries(summary_folder, summarize_conditions(df, include_mask))
+
+    all_combined = df
+    filtered_combined = df[include_mask].reset_index(drop=True)
     os.makedirs(output_folder, exist_ok=True)
 
     print(f'Thermal Match: {all_combined["ThermalMatch"].sum()} / {all_combined["ThermalMatch"].count()}, {all_combined["ThermalMatch"].sum() / all_combined["ThermalMatch"].count()}')
@@ -74,6 +112,18 @@ def process_participant_data(folder_path, participants, output_folder):
     print(f"Saved combined data to {output_path}")
     return filtered_combined, output_path
 
+def summarize_conditions(df, valid):
+    """
+    Per-participant statistics of each condition, locations over the valid trials.
+    """
+    return summarize_trials(df, summary_by, summary_values, summary_matches, valid, summary_bins)
+
+def report_influence(summaries, output_folder):
+    """
+    Leave-one-participant-out estimates of every condition and the influence of each participant on them.
+    """
+    return jackknife_report(summaries, summary_by, summary_values, summary_matches, output_folder)
+
 def generate_graph(df, excel_file, output_folder):
     """
     Creates scatterplots of Intended Location vs. average FeltLocation,
@@ -82,27 +132,15 @@ def generate_graph(df, excel_file, output_folder):
     Saves both individual plots and one combined subplot figure.
     """
     # ✅ Keep only trials where ThermalMatch == 1
-    df = df[df["ThermalMatch"] == 1]
-
-    df["Location"] *= 10
-    df["FeltLocation"] *= 10
+    plot_locations(summarize_conditions(df, df["ThermalMatch"] == 1), output_folder)
 
+def plot_locations(summaries, output_folder):
+    """
+    Draws the plots of generate_graph from condition summaries, of any participants.
+    """
     # Compute mean + SEM (safe SEM to avoid NaN)
-    grouped = (
-        df.groupby(["Location", "Temperature", "Duration"])
-          .agg(FeltLocation_mean=("FeltLocation", "mean"),
-               FeltLocation_sem=("FeltLocation",
-                                 lambda x: 0 if len(x) <= 1 else x.std(ddof=1) / np.sqrt(len(x))))
-          .reset_index()
-    )
-
-    grouped_all = (
-        df.groupby(["Location", "Temperature"])
-          .agg(FeltLocation_mean=("FeltLocation", "mean"),
-               FeltLocation_sem=("FeltLocation",
-                                 lambda x: 0 if len(x) <= 1 else x.std(ddof=1) / np.sqrt(len(x))))
-          .reset_index()
-    )
+    grouped = location_table(summaries, ["Location", "Temperature", "Duration"])
+    grouped_all = location_table(summaries, ["Location", "Temperature"])
 
     # Define colors/markers per Temperature
     temp_styles = {
@@ -119,7 +157,7 @@ def generate_graph(df, excel_file, output_folder):
     }
 
     # Durations to plot (unique + "all")
-    durations = sorted(df["Duration"].unique())
+    durations = sorted(grouped["Duration"].unique())
     #durations.append("all")
 
     tables_to_save = {}
@@ -236,6 +274,16 @@ def generate_graph(df, excel_file, output_folder):
     plt.close()
     print(f"Saved combined plot: {combined_path}")
 
+def location_table(summaries, by):
+    """
+    FeltLocation mean and SEM per condition in cm, and the share of trials in
+    each FeltLocation bin, pooled over the summarized participants.
+    """
+    table = summary_table(merge_summaries(summaries, by), by, ["FeltLocation"], bins=list(summary_bins))
+    for column in ["Location", "FeltLocation_mean", "FeltLocation_sem"]:
+        table[column] = fraction_to_cm(table[column])
+    return table
+
 def participant_string(participants):
     """
     Convert list of participant numbers into compact string.
@@ -263,4 +311,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
+import sys
+import argparse
 import pandas as pd
-from scipy.stats import shapiro, levene
 import itertools
 import os
 
+sys.path.append('Assets/Scripts')
+from assumption_checks import run_assumption_checks
+
+# Dependent variables checked, each in every Temperature × Duration × Location cell
+check_measures = ["LocationError", "FeltLocation"]
+check_by = ["Temperature", "Duration", "Location"]
+# Levene's test compares the temperatures within each Duration × Location
+check_group = "Temperature"
+
 def main():
+    args = parse_args()
     participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
     parent_folder = 'Assets/Studies/CHI26_Study1_Funneling'
     input_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
@@ -12,8 +23,25 @@ def main():
     # Load your dataframe
     df = pd.read_excel(os.path.join(input_folder, f"{participant_string(participants)}_analysis.xlsx"))
 
+    check_analysis_data(df, output_folder, args.workers)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the normality and homogeneity of the valid trials.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to spread the checked measures over (default: 1)")
+    return parser.parse_args()
+
+def check_analysis_data(df, output_folder, workers=1):
+    """
+    Runs the normality and homogeneity checks on the valid trials and saves them as csv.
+
+    Args:
+        df (pd.DataFrame): Valid trials, as saved by analyze_data.
+        output_folder (str): Folder for the result csv files.
+        workers (int): Number of processes to spread the checked measures over.
+    """
     # === Run checks ===
-    normality_results, homogeneity_results = run_checks(df)
+    normality_results, homogeneity_results = run_checks(df, workers)
 
     # Save to CSVs
     normality_results.to_csv(os.path.join(output_folder, "normality_results.csv"), index=False)
@@ -22,41 +50,15 @@ def main():
     print(f"Normality results saved to {os.path.join(output_folder, 'normality_results.csv')}")
     print(f"Homogeneity results saved to {os.path.join(output_folder, 'homogeneity_results.csv')}")
 
-def run_checks(df):
-    results_normality = []
-    results_homogeneity = []
-
-    # === Normality check (Shapiro–Wilk per condition) ===
-    for (temp, dur, loc), subset in df.groupby(["Temperature", "Duration", "Location"]):
-        stat, p = shapiro(subset["LocationError"])
-        results_normality.append({
-            "Temperature": temp,
-            "Duration": dur,
-            "Location": loc,
-            "Shapiro_W": stat,
-            "p_value": p,
-            "Normality_OK": 1 if p > 0.005 else 0
-        })
-
-    df_normality = pd.DataFrame(results_normality)
-
-    # === Homogeneity of variances (Levene’s test across temperatures) ===
-    # Here we check variance across Temperature levels for each Duration × Location
-    for (dur, loc), subset in df.groupby(["Duration", "Location"]):
-        groups = [g["LocationError"].values for _, g in subset.groupby("Temperature")]
-        if len(groups) > 1:  # Need at least 2 groups
-            stat, p = levene(*groups)
-            results_homogeneity.append({
-                "Duration": dur,
-                "Location": loc,
-                "Levene_W": stat,
-                "p_value": p,
-                "Homoscedasticity_OK": 1 if p > 0.005 else 0
-            })
-
-    df_homogeneity = pd.DataFrame(results_homogeneity)
-
-    return df_normality, df_homogeneity
+def run_checks(df, workers=1):
+    """
+    Shapiro-Wilk per cell and Levene across temperatures of every checked
+    measure, with Holm corrected p values and Q-Q summary stats.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Normality and homogeneity results, see run_assumption_checks.
+    """
+    return run_assumption_checks(df, check_measures, check_by, check_group, workers=workers)
 
 def participant_string(participants):
     """
@@ -85,4 +87,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,79 +2,57 @@ import pandas as pd
 import pingouin as pg
 import numpy as np
 import os
-from PIL import Image
+import sys
+import argparse
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from drawing_index import update_drawing_index, band_hits
+from arm_coordinates import location_to_column
 
 def main():
+    args = parse_args()
     participants = [1,2,3,4,5,6,7,8,9,10,11,12]
     parent_folder = 'Assets/Studies/CHI26_Study1_Funneling'
     input_folder = f'{parent_folder}/data_processing/data'
     drawings_folder = f'{parent_folder}/drawings'
+    if args.archive:
+        # Drawings packed by pack_drawings.py
+        drawings_folder = f'{parent_folder}/data_processing/data/drawing_archive.bin'
+    cache_folder = f'{parent_folder}/data_processing/cache/drawings'
+    index_folder = f'{parent_folder}/data_processing/cache/drawing_index'
     output_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
+    band = args.band  # Extra pixel columns tested on each side of the target column
 
-    combined_data = process_participant_data(input_folder, drawings_folder, participants, output_folder)
+    combined_data = process_participant_data(input_folder, drawings_folder, cache_folder, index_folder, participants, output_folder, band)
     results = perform_stat_analysis(combined_data, participants, output_folder)
     print(results.head())
 
-def process_participant_data(folder_path, drawings_folder, participants, output_folder):
-    all_data = []
-
-    # Fixed mapping from Location → pixel column
-    location_to_column = {
-        0.00: 330,
-        0.25: 295,
-        0.50: 260,
-        0.75: 225,
-        1.00: 190
-    }
-
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
-
-            # Add Participant column (if not already there)
-            df["Participant"] = p
-
-            contains_red_list = []
-
-            for _, row in df.iterrows():
-                trial = int(row["Trial"])
-                location = row["Location"]
-                col_index = location_to_column.get(location, None)
-
-                # Build path to PNG
-                img_path = os.path.join(drawings_folder, f"p{p}", f"p{p}_trial{trial}_drawing.png")
-
-                if os.path.exists(img_path):
-                    img = Image.open(img_path).convert("RGB")
-                    width, height = img.size
-
-                    # Map Location (0–1 scale) to pixel column
-                    col_index = min(max(col_index, 0), width - 1)
-
-                    # Extract the column of pixels
-                    pixels = [img.getpixel((col_index, y)) for y in range(height)]
-
-                    # Check if any pixel is "red"
-                    contains_red = 1 if any(r > 200 and g < 50 and b < 50 for (r, g, b) in pixels) else 0
-                else:
-                    print(f"Warning: Image not found for {img_path}, defaulting as 0")
-                    contains_red = 0
+def parse_args():
+    parser = argparse.ArgumentParser(description="Test whether each drawing marks the stimulated location.")
+    parser.add_argument("--archive", action="store_true",
+                        help="Read the drawings from the archive packed by pack_drawings.py instead of the drawings folder")
+    parser.add_argument("--band", type=int, default=0,
+                        help="Extra pixel columns tested on each side of the target column (default: 0)")
+    return parser.parse_args()
+
+def process_participant_data(folder_path, drawings_folder, cache_folder, index_folder, participants, output_folder, band=0):
+    combined = load_participant_data(folder_path, participants)
+    if combined.empty:
+        return pd.DataFrame()
 
-                contains_red_list.append(contains_red)
+    # Pixel column -> drawings index of the pure-red strokes, built once per study
+    index = update_drawing_index(index_folder, participants, drawings_folder, cache_folder)
 
-            # Add results column
-            df["ThermalAtLocation"] = contains_red_list
-            all_data.append(df)
-        else:
-            print(f"Warning: File not found for participant {p}")
+    # Map Location (0–1 scale) to pixel column, then test every trial at once
+    columns = location_to_column(combined["Location"].to_numpy())
+    contains_red, found = band_hits(index, combined["Participant"], combined["Trial"], columns, band, plane="red")
 
-    if not all_data:
-        print("No data loaded.")
-        return pd.DataFrame()
+    for p, trial in combined.loc[~found, ["Participant", "Trial"]].itertuples(index=False):
+        print(f"Warning: Drawing of p{p} trial {trial} not found in {drawings_folder}, defaulting as 0")
 
-    # Combine across participants
-    combined = pd.concat(all_data, ignore_index=True)
+    # Add results column
+    combined["ThermalAtLocation"] = contains_red
 
     """ filename_out = f"drawingstat_{participant_string(participants)}.csv"
     output_path = os.path.join(output_folder, filename_out)
@@ -143,4 +121,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
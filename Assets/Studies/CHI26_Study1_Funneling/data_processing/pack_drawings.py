@@ -0,0 +1,21 @@
+import sys
+import argparse
+
+sys.path.append('Assets/Scripts')
+from drawing_archive import pack_drawings
+from heatmap_generator import parent_folder, red_fill, drawing_archive_path
+
+def main():
+    args = parse_args()
+    pack_drawings(f'{parent_folder}/drawings', args.output, red_fill, args.participants)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pack the drawings of the study into one archive of bit-packed masks.")
+    parser.add_argument("--output", default=drawing_archive_path,
+                        help=f"Archive file to write (default: {drawing_archive_path})")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to pack instead of every drawing folder")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
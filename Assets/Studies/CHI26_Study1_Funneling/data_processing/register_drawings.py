@@ -0,0 +1,45 @@
+import sys
+import argparse
+import numpy as np
+
+sys.path.append('Assets/Scripts')
+from drawing_archive import load_study_masks, folder_participants
+from drawing_registration import estimate_registration, save_registration
+from heatmap_generator import parent_folder, red_fill, registration_path
+
+def main():
+    args = parse_args()
+    drawings = f'{parent_folder}/drawings'
+    cache_folder = f'{parent_folder}/data_processing/cache/drawings'
+
+    stacks = {}
+    for par in args.participants or folder_participants(drawings):
+        masks = load_study_masks(drawings, par, cache_folder, red_fill)
+        if masks:
+            stacks[par] = np.stack([masks[trial] for trial in sorted(masks)])
+
+    flips = (False, True) if args.flip else (False,)
+    registration = estimate_registration(stacks, flips=flips, scales=tuple(args.scales), min_gain=args.min_gain)
+
+    for par, entry in registration.items():
+        print(f"p{par}: flip={entry['flip']} scale={entry['scale']} dx={entry['dx']} dy={entry['dy']} "
+              f"score={entry['score']} (identity {entry['identity_score']})")
+    save_registration(registration, args.output)
+    print(f"Saved to {args.output}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Estimate a flip / scale / shift per participant that aligns their drawings with the rest of the study.")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to register instead of every drawing folder")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0],
+                        help="Scales to try, e.g. 0.8 1 1.25 (default: 1)")
+    parser.add_argument("--no-flip", dest="flip", action="store_false",
+                        help="Do not try left-right flips")
+    parser.add_argument("--min-gain", type=float, default=0.15,
+                        help="Correlation gain over the untransformed drawings needed to accept a transform (default: 0.15)")
+    parser.add_argument("--output", default=registration_path,
+                        help=f"Transforms file to write (default: {registration_path})")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
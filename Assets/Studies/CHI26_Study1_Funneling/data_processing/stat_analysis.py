@@ -2,6 +2,23 @@ import pandas as pd
 import pingouin as pg
 import numpy as np
 import os
+import sys
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from assumption_checks import run_assumption_checks
+from rm_anova import repeated_measures_analysis
+from stat_export import long_table, wide_table
+
+# Exported measures, one column per measure and cell named by stat_template
+stat_measures = ["FeltLocation"]
+stat_by = ["Temperature", "Duration", "Location"]
+stat_template = "T{0}_D{1}_L{2}"
+
+# Dependent variables of the repeated-measures analysis, all analyzed at once
+rm_measures = ["FeltLocation", "LocationError"]
+# Within-subject factors, crossed
+rm_factors = ["Temperature", "Duration", "Location"]
 
 def main():
     participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
@@ -14,26 +31,7 @@ def main():
     print(results.head())
 
 def process_participant_data(folder_path, participants):
-    all_data = []
-
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
-
-            df["Participant"] = p
-
-            all_data.append(df)
-        else:
-            print(f"Warning: File not found for participant {p}")
-
-    if not all_data:
-        print("No data loaded.")
-        return pd.DataFrame()
-
-    combined = pd.concat(all_data, ignore_index=True)
-
-    return combined
+    return load_participant_data(folder_path, participants)
 
 def perform_stat_analysis(df, participants, output_folder):
 
@@ -48,25 +46,40 @@ def perform_stat_analysis(df, participants, output_folder):
     df_filtered["LocationError"] = df_filtered["FeltLocation"] - df_filtered["Location"]
     print(f'Valid Trials: {df_filtered["LocationError"].count()} / {df["Location"].count()}, {df_filtered["LocationError"].count() / df["Location"].count()}')
 
-    # Group values by Temperature, Duration, Location
-    grouped = df_filtered.groupby(["Temperature", "Duration", "Location"])["FeltLocation"].apply(list)
-
-    # Find the longest list length
-    max_len = grouped.map(len).max()
-
-    # Build dataframe where each column is a combo, padded with NaN to equal length
-    df_expanded = pd.DataFrame({
-        f"T{temp}_D{dur}_L{loc}": values + [None] * (max_len - len(values))
-        for (temp, dur, loc), values in grouped.items()
-    })
+    # One padded column per measure and cell, from the long table
+    long = long_table(df_filtered, stat_measures, stat_by)
+    df_expanded = wide_table(long, stat_by, stat_template)
 
     filename_out = f"stat_{participant_string(participants)}.csv"
     output_path = os.path.join(output_folder, filename_out)
     print(f"Saved to {output_path}")
     df_expanded.to_csv(output_path, index=False)
+    # Compact long format, without the padding and object columns of the wide one
+    long.to_parquet(os.path.splitext(output_path)[0] + ".parquet", index=False)
+
+    analyze_repeated_measures(df_filtered, participants, output_folder)
 
     return df_expanded
 
+def analyze_repeated_measures(df_filtered, participants, output_folder):
+    """
+    Repeated-measures ANOVA of the valid trials, with Friedman/Wilcoxon tests of
+    the measures check_data's Shapiro-Wilk test finds not normal in some cell.
+    Saves 'rm_anova_<ps>.csv' and 'rm_nonparametric_<ps>.csv'.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): The ANOVA and nonparametric tables, see repeated_measures_analysis.
+    """
+    normality, _ = run_assumption_checks(df_filtered, rm_measures, rm_factors, "Temperature")
+    nonnormal = normality.loc[normality["Normality_OK"] == 0, "Measure"].unique().tolist()
+    anova, nonparametric = repeated_measures_analysis(df_filtered, rm_measures, rm_factors, nonnormal=nonnormal)
+
+    ps = participant_string(participants)
+    anova.to_csv(os.path.join(output_folder, f"rm_anova_{ps}.csv"), index=False)
+    nonparametric.to_csv(os.path.join(output_folder, f"rm_nonparametric_{ps}.csv"), index=False)
+    print(f"Repeated-measures results saved to {output_folder}, not normal: {nonnormal if nonnormal else 'none'}")
+    return anova, nonparametric
+
 def participant_string(participants):
     """
     Convert list of participant numbers into compact string.
@@ -94,4 +107,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,22 @@ import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter
 import random
 import os
+import sys
+
+sys.path.append('Assets/Scripts')
+from heatmap_core import HeatmapAccumulator
+from drawing_cache import load_drawing_masks
+
+# Preprocessed drawing masks, the drawing PNGs themselves are only read
+mask_cache_folder = 'Assets/Studies/CHI26_Study1_Funneling/data_processing/cache/drawings'
+# The pilot's red circle fill: stricter HSV ranges and one closing pass
+red_fill = {
+    "lower_red1": [0, 100, 100],
+    "upper_red1": [10, 255, 255],
+    "lower_red2": [160, 100, 100],
+    "upper_red2": [180, 255, 255],
+    "close_passes": 1,
+}
 
 participants = [17, 18, 19 , 20]
 feltIllusions = [1, 0]
@@ -145,32 +161,26 @@ def process_all_locations_data(input_folder, sheet_name, participants, feltIllus
     generate_heatmap(valid_trials, "Assets/Studies/CHI26_Study1_Funneling/drawings", participants, feltIllusion, temperature, "all")
 
 def generate_heatmap(trials_to_process, drawings_folder, participants, feltIllusion, temperature, location):
-    mask_filepath = f"Assets/arm_mask.png"
-    mask_img = Image.open(mask_filepath).convert("L")
-    mask_array = np.array(mask_img)
-    # Convert to binary mask
-    binary_mask = (mask_array > 128).astype(int)  # 1s where heatmap is allowed
-
-    # Get heat map data
-    heat_map = np.zeros(mask_array.shape)
+    # Get heat map data, summed in place into one count buffer
+    accumulator = HeatmapAccumulator()
 
     for par in trials_to_process:
         par_folder = os.path.join(drawings_folder, f"p{par}")
+        # Circles filled in and thresholded (> 50), one mask per drawing
+        masks = load_drawing_masks(par_folder, par, mask_cache_folder, red_fill)
         for trial in trials_to_process[par]:
-            filepath = os.path.join(par_folder, f"p{par}_trial{trial}_drawing.png")
-            heat_map = process_drawing(filepath, heat_map)
+            if trial in masks:
+                accumulator.add_mask(masks[trial])
 
     # Shift
     n_pixels = 50
-    heat_map = np.roll(heat_map, shift=-n_pixels, axis=1)
+    heat_map = accumulator.counts
+    heat_map[:, :-n_pixels] = heat_map[:, n_pixels:]
     heat_map[:, -n_pixels:] = 0
     
+    # Smoothed and cut to the arm, transparent around it
     sigma = 1
-    heat_map = gaussian_filter(heat_map, sigma=sigma)
-    masked_data = heat_map * binary_mask           # Apply mask
-
-    # Transparent background
-    masked_alpha = np.where(binary_mask, 1.0, 0.0)
+    masked_data, masked_alpha = accumulator.masked_heatmap(sigma)
 
     # Heat map
     plt.figure(figsize=(10, 10))
@@ -214,57 +224,6 @@ def generate_heatmap(trials_to_process, drawings_folder, participants, feltIllus
     print(f"Saved to {new_filepath}")
 
 
-def process_drawing(filepath, heat_map):
-    if os.path.isfile(filepath):
-        print(f"Processing {filepath}")
-    #if os.path.isfile(filepath) and "Am19_thermal" in filename:
-        # Convert png to array
-        fill_red_circles(filepath, filepath)
-        drawing = Image.open(filepath).convert("L")
-        mask_array = np.array(drawing)
-        binary_drawing = (mask_array > 50).astype(int)
-        # Need to binary drawing to match heatmap
-        heat_map += binary_drawing
-        #heat_map[0:550, 300:620] += binary_drawing[0:550, 300:620]
-        #heat_map[0:540, 1810:2075] += binary_drawing[0:540, 1810:2075]
-    return heat_map  
-
-def fill_red_circles(image_path, save_path=None):
-    # Read the image
-    img = cv2.imread(image_path)
-
-    # Convert to HSV color space for better red detection
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-    # Define red color range in HSV (two ranges for red wrap-around)
-    lower_red1 = np.array([0, 100, 100])
-    upper_red1 = np.array([10, 255, 255])
-
-    lower_red2 = np.array([160, 100, 100])
-    upper_red2 = np.array([180, 255, 255])
-
-    # Create masks for red regions
-    mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-    mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-    mask = mask1 | mask2
-
-    # Optional: clean noise
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-
-    # Find contours in red mask
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    # Fill each red contour on original image
-    for cnt in contours:
-        cv2.drawContours(img, [cnt], -1, (0, 0, 255), thickness=cv2.FILLED)  # Red in BGR
-
-    # Save or return result
-    if save_path:
-        print(f"Saving to {save_path}")
-        cv2.imwrite(save_path, img)
-    return img
-
 def sign(number):
         if number > 0:
             return 1
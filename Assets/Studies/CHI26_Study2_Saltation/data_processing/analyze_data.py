@@ -2,72 +2,110 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 import numpy as np
+import sys
+import argparse
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from arm_coordinates import location_from_elbow, fraction_to_cm
+from condition_stats import summarize_trials, merge_summaries, summary_table, update_summaries, load_summaries, jackknife_report
+
+# Conditions and measures kept as mergeable per-participant statistics (see condition_stats)
+summary_by = ["Direction", "Duration", "Temperature"]
+summary_values = ["location1", "location2", "location3", "Displacement1", "Displacement2", "Displacement3"]
+summary_matches = ["ThermalMatch", "NumMatch", "DirectionMatch"]
+summary_bins = {f"location{i}": np.linspace(0, 1, 11) for i in (1, 2, 3)}
 
 def main():
-    participants = [1,2,3,4,5,7,8,9,10,11,12,13,14,15,16]
+    args = parse_args()
+    participants = args.participants or [1,2,3,4,5,7,8,9,10,11,12,13,14,15,16]
     parent_folder = 'Assets/Studies/CHI26_Study2_Saltation'
     input_folder = f'{parent_folder}/data_processing/data'
     output_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
 
+    if args.jackknife:
+        report_influence(load_summaries(input_folder, participants), output_folder)
+        return
+
+    if args.from_summaries:
+        # Merges the stored per-participant statistics, no trial data is read
+        os.makedirs(output_folder, exist_ok=True)
+        plot_locations(load_summaries(input_folder, participants), output_folder)
+        return
+
     combined_data, excel_file = process_participant_data(input_folder, participants, output_folder)
     generate_graph(combined_data, excel_file, output_folder)
 
-def process_participant_data(folder_path, participants, output_folder):
-    filtered_data = []
-    all_data = []
-
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
-
-            # Location correction to flip wrist - elbow
-            df["location1"] = 1 - df["location1"]
-            df["location2"] = 1 - df["location2"]
-            df["location3"] = 1 - df["location3"]
-
-            df["Participant"] = p
-            df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
-            df["NumMatch"] = (df["numLocation"] == 3).astype(int)
-            df["DirectionMatch"] = np.where(
-                (df["Direction"] == 1) & (df["location1"] >= df["location2"]) & (df["location2"] >= df["location3"]),
-                1,
-                np.where(
-                    (df["Direction"] == 0) & (df["location1"] <= df["location2"]) & (df["location2"] <= df["location3"]),
-                    1,
-                    0
-                )
-            )
-            df["Displacement1"] = np.where(
-                (df["Direction"] == 1),
-                abs(1 - df["location1"]),
-                abs(0 - df["location1"])
-            )
-            df["Displacement2"] = np.where(
-                (df["Direction"] == 1),
-                abs(1 - df["location2"]),
-                abs(0 - df["location2"])
-            )
-            df["Displacement3"] = np.where(
-                (df["Direction"] == 0),
-                abs(1 - df["location3"]),
-                abs(0 - df["location3"])
-            )
-            
-            include_mask = (df["ThermalMatch"] == 1) & (df["NumMatch"] == 1) #& df["DirectionMatch"] == 1
-            df_filtered = df[include_mask].copy()
-
-            all_data.append(df)
-            filtered_data.append(df_filtered)
-        else:
-            print(f"Warning: File not found for participant {p}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze the trials of the participants and plot the perceived pulse locations.")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to include instead of the configured list")
+    parser.add_argument("--from-summaries", action="store_true",
+                        help="Only plot, from the condition summaries stored by an earlier run")
+    parser.add_argument("--jackknife", action="store_true",
+                        help="Only score each participant's influence on the condition estimates, from the stored summaries")
+    return parser.parse_args()
 
-    if not all_data:
-        print("No data loaded.")
+def process_participant_data(folder_path, participants, output_folder):
+    df = load_participant_data(folder_path, participants)
+    if df.empty:
         return pd.DataFrame()
 
-    all_combined = pd.concat(all_data, ignore_index=True)
-    filtered_combined = pd.concat(filtered_data, ignore_index=True)
+    return analyze_participant_data(df, participants, output_folder, folder_path)
+
+def analyze_participant_data(df, participants, output_folder, summary_folder=None):
+    """
+    Adds the derived columns to the combined trials of all participants, keeps
+    the valid trials and saves them as 'p#-p#_analysis.xlsx' and '.csv'.
+
+    Args:
+        df (pd.DataFrame): Trials from load_participant_data, modified in place.
+        participants (list of int): Participant numbers, used for the file name.
+        output_folder (str): Path to save the combined analysis file.
+        summary_folder (str): Folder to store the participants' condition summaries in.
+
+    Returns:
+        (pd.DataFrame, str): Valid trials and the path of the saved xlsx.
+    """
+    # Location correction to flip wrist - elbow
+    df["location1"] = location_from_elbow(df["location1"])
+    df["location2"] = location_from_elbow(df["location2"])
+    df["location3"] = location_from_elbow(df["location3"])
+
+    df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
+    df["NumMatch"] = (df["numLocation"] == 3).astype(int)
+    df["DirectionMatch"] = np.where(
+        (df["Direction"] == 1) & (df["location1"] >= df["location2"]) & (df["location2"] >= df["location3"]),
+        1,
+        np.where(
+            (df["Direction"] == 0) & (df["location1"] <= df["location2"]) & (df["location2"] <= df["location3"]),
+            1,
+            0
+        )
+    )
+    df["Displacement1"] = np.where(
+        (df["Direction"] == 1),
+        abs(1 - df["location1"]),
+        abs(0 - df["location1"])
+    )
+    df["Displacement2"] = np.where(
+        (df["Direction"] == 1),
+        abs(1 - df["location2"]),
+        abs(0 - df["location2"])
+    )
+    df["Displacement3"] = np.where(
+        (df["Direction"] == 0),
+        abs(1 - df["location3"]),
+        abs(0 - df["location3"])
+    )
+
+    include_mask = (df["ThermalMatch"] == 1) & (df["NumMatch"] == 1) #& df["DirectionMatch"] == 1
+
+    if summary_folder:
+        update_summaries(summary_folder, summarize_conditions(df, include_mask))
+
+    all_combined = df
+    filtered_combined = df[include_mask].reset_index(drop=True)
     os.makedirs(output_folder, exist_ok=True)
 
     print(f'Thermal Match: {all_combined["ThermalMatch"].sum()} / {all_combined["ThermalMatch"].count()}, {all_combined["ThermalMatch"].sum() / all_combined["ThermalMatch"].count()}')
@@ -76,7 +114,57 @@ def process_participant_data(folder_path, participants, output_folder):
     print(f'Valid Trials: {filtered_combined["Participant"].count()} / {all_combined["Participant"].count()}, {filtered_combined["Participant"].count() / all_combined["Participant"].count()}')
 
     # Melt the location columns into long format
-    reformatted_df = pd.wide_to_long(
+    reformatted_df = long_format(filtered_combined)
+
+    filename_out = f"{participant_string(participants)}_analysis.xlsx"
+    output_path = os.path.join(output_folder, filename_out)
+    reformatted_df.to_excel(output_path, index=False)
+    filename_out_csv = f"{participant_string(participants)}_analysis.csv"
+    output_path_csv = os.path.join(output_folder, filename_out_csv)
+    reformatted_df.to_csv(output_path_csv, index=False)
+
+    print(f"Saved combined data to {output_path}")
+    return filtered_combined, output_path
+
+def summarize_conditions(df, valid):
+    """
+    Per-participant statistics of each condition, locations over the valid trials.
+    """
+    return summarize_trials(df, summary_by, summary_values, summary_matches, valid, summary_bins)
+
+def report_influence(summaries, output_folder):
+    """
+    Leave-one-participant-out estimates of every condition and the influence of each participant on them.
+    """
+    return jackknife_report(summaries, summary_by, summary_values, summary_matches, output_folder)
+
+def pulse_table(summaries, by, stub, type_column, prefix):
+    """
+    Mean and SEM in cm of the three pulses of `stub` per condition, and the share
+    of trials in each bin of binned pulses, one row per pulse like grouping the
+    melted trials, pooled over the summarized participants.
+    """
+    columns = [f"{stub}{i}" for i in (1, 2, 3)]
+    binned = [column for column in columns if column in summary_bins]
+    table = summary_table(merge_summaries(summaries, by), by, columns, drop_empty=False, bins=binned)
+    rows = []
+    for column in columns:
+        pulse = table.loc[table[f"{column}_n"] > 0, list(by)].copy()
+        pulse[type_column] = column
+        pulse[f"{prefix}_mean"] = fraction_to_cm(table.loc[pulse.index, f"{column}_mean"])
+        pulse[f"{prefix}_sem"] = fraction_to_cm(table.loc[pulse.index, f"{column}_sem"])
+        for rate in table.columns:
+            if column in binned and rate.startswith(f"{column}_bin"):
+                pulse[prefix + rate[len(column):]] = table.loc[pulse.index, rate]
+        rows.append(pulse)
+    return pd.concat(rows).sort_values(list(by) + [type_column]).reset_index(drop=True)
+
+def long_format(filtered_combined):
+    """
+    Melts location1-3 and Displacement1-3 into one row per felt location, the
+    layout of the saved analysis file.
+    """
+    return pd.wide_to_long(
         filtered_combined,
         stubnames=["location", "Displacement"],
         i=[
@@ -89,16 +177,6 @@ def process_participant_data(folder_path, participants, output_folder):
         suffix="\\d+"
     ).reset_index().rename(columns={"location": "FeltLocation"})
 
-    filename_out = f"{participant_string(participants)}_analysis.xlsx"
-    output_path = os.path.join(output_folder, filename_out)
-    reformatted_df.to_excel(output_path, index=False)
-    filename_out_csv = f"{participant_string(participants)}_analysis.csv"
-    output_path_csv = os.path.join(output_folder, filename_out_csv)
-    reformatted_df.to_csv(output_path_csv, index=False)
-
-    print(f"Saved combined data to {output_path}")
-    return filtered_combined, output_path
-
 
 import os
 import numpy as np
@@ -111,29 +189,15 @@ def generate_graph(df, excel_file, output_folder):
     grouped by Temperature, split by Direction × Duration,
     plus combined-direction graphs (with Direction=0 flipped).
     """
-    df = df[(df["ThermalMatch"] == 1) & (df["NumMatch"] == 1)]
-    df['location1'] *= 10
-    df['location2'] *= 10
-    df['location3'] *= 10
-    df['Displacement1'] *= 10
-    df['Displacement2'] *= 10
-    df['Displacement3'] *= 10
+    valid = (df["ThermalMatch"] == 1) & (df["NumMatch"] == 1)
+    plot_locations(summarize_conditions(df, valid), output_folder)
 
+def plot_locations(summaries, output_folder):
+    """
+    Draws the plots of generate_graph from condition summaries, of any participants.
+    """
     # ---------- Per-direction graphs ----------
-    long_df = df.melt(
-        id_vars=["Direction", "Duration", "Temperature"],
-        value_vars=["location1", "location2", "location3"],
-        var_name="LocationType",
-        value_name="LocationValue"
-    )
-
-    grouped = (
-        long_df.groupby(["Direction", "Duration", "Temperature", "LocationType"])
-               .agg(Location_mean=("LocationValue", "mean"),
-                    Location_sem=("LocationValue",
-                                  lambda x: 0 if len(x) <= 1 else x.std(ddof=1)/np.sqrt(len(x))))
-               .reset_index()
-    )
+    grouped = pulse_table(summaries, ["Direction", "Duration", "Temperature"], "location", "LocationType", "Location")
 
     temp_styles = {
         -15: {"color": "#4A5EEB", "marker": "o", "label": "Cold"},
@@ -264,20 +328,7 @@ def generate_graph(df, excel_file, output_folder):
 
     # ---------- Master figure: combined-direction only (Displacement) ----------
     # Prepare displacement data separately
-    disp_long_df = df.melt(
-        id_vars=["Direction", "Duration", "Temperature"],
-        value_vars=["Displacement1", "Displacement2", "Displacement3"],
-        var_name="DisplacementType",
-        value_name="DisplacementValue"
-    )
-
-    disp_grouped = (
-        disp_long_df.groupby(["Duration", "Temperature", "DisplacementType"])
-                    .agg(Disp_mean=("DisplacementValue", "mean"),
-                         Disp_sem=("DisplacementValue",
-                                   lambda x: 0 if len(x) <= 1 else x.std(ddof=1)/np.sqrt(len(x))))
-                    .reset_index()
-    )
+    disp_grouped = pulse_table(summaries, ["Duration", "Temperature"], "Displacement", "DisplacementType", "Disp")
 
     # Filter to only durations available
     durations_in_comb = sorted(disp_grouped["Duration"].unique())
@@ -363,4 +414,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
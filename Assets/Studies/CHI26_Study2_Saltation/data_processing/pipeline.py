@@ -0,0 +1,107 @@
+import sys
+import argparse
+from functools import partial
+
+sys.path.append('Assets/Scripts')
+from study_pipeline import stage, run_pipeline
+from study_data import load_participant_data, data_formats, parquet_available, combined_data_patterns
+from condition_stats import load_summaries
+
+import combine_data
+import analyze_data
+import check_data
+import stat_analysis
+import heatmap_generator
+
+participants = [1,2,3,4,5,7,8,9,10,11,12,13,14,15,16]
+parent_folder = 'Assets/Studies/CHI26_Study2_Saltation'
+processing_folder = f'{parent_folder}/data_processing'
+analysis_folder = f'{processing_folder}/analysis/{analyze_data.participant_string(participants)}'
+heatmap_folder = f'{processing_folder}/heatmaps/{analyze_data.participant_string(participants)}'
+scripts_folder = 'Assets/Scripts'
+
+def main():
+    args = parse_args()
+    manifest_path = f'{processing_folder}/cache/pipeline_manifest.json'
+    params = {"participants": participants, "format": args.format, "dataset": args.dataset}
+    run_pipeline(build_stages(args.format, args.dataset, args.workers), manifest_path, args.workers, args.force, params=params)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the whole data processing of the study, skipping unchanged stages.")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Number of processes to run independent stages (stats, heatmaps) side by side, and the checked measures over (default: 2)")
+    parser.add_argument("--force", action="store_true",
+                        help="Run every stage even if its inputs are unchanged")
+    parser.add_argument("--format", choices=data_formats + ["none"], default="xlsx",
+                        help="Format of the per-participant p#_data files combine writes, none to skip them (default: xlsx)")
+    parser.add_argument("--dataset", action="store_true",
+                        help="Have combine also write the study-level Parquet dataset")
+    args = parser.parse_args()
+
+    if (args.format in ("parquet", "feather") or args.dataset) and not parquet_available:
+        parser.error("Parquet and feather output need pyarrow (pip install pyarrow)")
+    if args.format == "none" and not args.dataset:
+        parser.error("Nothing to write, use --dataset with --format none")
+    return args
+
+def build_stages(fmt="xlsx", dataset=False, workers=1):
+    """
+    Stages of the study, combine writing the files of `fmt` and `dataset` (see combine_data)
+    and check spreading its measures over `workers` processes.
+
+    combine -> data -> analyze -> check
+                    -> stats
+                    -> heatmaps
+    """
+    ps = analyze_data.participant_string(participants)
+    return [
+        stage("combine", partial(combine, fmt, dataset), inputs=[
+            f'{parent_folder}/trial_info/*.csv', f'{parent_folder}/trial_responses/*.csv',
+            f'{processing_folder}/combine_data.py', f'{scripts_folder}/study_data.py', f'{scripts_folder}/file_manifest.py',
+            f'{parent_folder}/drawings/p*/*.png', f'{processing_folder}/heatmap_generator.py',
+            f'{scripts_folder}/drawing_features.py', f'{scripts_folder}/drawing_cache.py', f'{scripts_folder}/drawing_archive.py', f'{scripts_folder}/arm_coordinates.py',
+        ], outputs=combined_data_patterns(f'{processing_folder}/data', fmt, dataset)),
+        stage("data", load_data, after=["combine"], inputs=[
+            f'{processing_folder}/data/p*_data.*', f'{processing_folder}/data/study_data/*/*.parquet',
+            f'{scripts_folder}/study_data.py',
+        ]),
+        stage("analyze", analyze, after=["data"], inputs=[f'{processing_folder}/analyze_data.py', f'{scripts_folder}/condition_stats.py', f'{scripts_folder}/arm_coordinates.py'],
+              outputs=[f'{analysis_folder}/{ps}_analysis.xlsx', f'{analysis_folder}/{ps}_analysis.csv',
+                       f'{analysis_folder}/jackknife_influence.csv']),
+        stage("check", partial(check, workers), after=["analyze"], inputs=[f'{processing_folder}/check_data.py', f'{scripts_folder}/assumption_checks.py'],
+              outputs=[f'{analysis_folder}/normality_results.csv', f'{analysis_folder}/homogeneity_results.csv']),
+        stage("stats", stats, after=["data"], inputs=[f'{processing_folder}/stat_analysis.py', f'{scripts_folder}/stat_export.py', f'{scripts_folder}/rm_anova.py', f'{scripts_folder}/assumption_checks.py'],
+              outputs=[f'{analysis_folder}/stat_{ps}.csv', f'{analysis_folder}/stat_{ps}.parquet', f'{analysis_folder}/rm_anova_{ps}.csv']),
+        stage("heatmaps", heatmaps, after=["data"], inputs=[
+            f'{processing_folder}/heatmap_generator.py', f'{scripts_folder}/heatmap_core.py', f'{scripts_folder}/drawing_cache.py', f'{scripts_folder}/drawing_cube.py', f'{scripts_folder}/drawing_archive.py', f'{scripts_folder}/drawing_registration.py', f'{scripts_folder}/arm_coordinates.py',
+            'Assets/arm_mask.png', f'{parent_folder}/drawings/p*/*.png',
+        ], outputs=[f'{heatmap_folder}/*.png']),
+    ]
+
+# --- Stages, each gets the results of the stages it runs after ---
+def combine(fmt, dataset):
+    combine_data.combine_pairs(fmt, dataset, incremental=True, drawing_features=True)
+
+def load_data(_):
+    return load_participant_data(f'{processing_folder}/data', participants)
+
+def analyze(df):
+    # Copies, the scripts add and flip columns in place
+    filtered, excel_file = analyze_data.analyze_participant_data(df.copy(), participants, analysis_folder, f'{processing_folder}/data')
+    analyze_data.generate_graph(filtered.copy(), excel_file, analysis_folder)
+    analyze_data.report_influence(load_summaries(f'{processing_folder}/data', participants), analysis_folder)
+    # check_data works on the long format that the analysis file is saved in
+    return analyze_data.long_format(filtered)
+
+def check(workers, filtered):
+    check_data.check_analysis_data(filtered.copy(), analysis_folder, workers)
+
+def stats(df):
+    results = stat_analysis.perform_stat_analysis(df.copy(), participants, analysis_folder)
+    print(results.head())
+
+def heatmaps(df):
+    heatmap_generator.generate_heatmaps(df, participants)
+
+if __name__ == "__main__":
+    main()
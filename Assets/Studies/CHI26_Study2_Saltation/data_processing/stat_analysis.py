@@ -2,6 +2,23 @@ import pandas as pd
 import pingouin as pg
 import numpy as np
 import os
+import sys
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from assumption_checks import run_assumption_checks
+from rm_anova import repeated_measures_analysis
+from stat_export import long_table, wide_table
+
+# Exported measures, one column per measure and cell named by stat_template
+stat_measures = ["Location1Error", "Location2Error", "Location3Error"]
+stat_by = ["Temperature", "Duration", "Direction"]
+stat_template = "{measure}_T{0}_D{1}_Dir{2}"
+
+# Dependent variables of the repeated-measures analysis, all analyzed at once
+rm_measures = ["Location1Error", "Location2Error", "Location3Error"]
+# Within-subject factors, crossed
+rm_factors = ["Temperature", "Duration", "Direction"]
 
 def main():
     participants = [1,2,3,4,5,7,8,9,10,11,12,13,14,15,16]
@@ -14,26 +31,7 @@ def main():
     print(results.head())
 
 def process_participant_data(folder_path, participants):
-    all_data = []
-
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
-
-            df["Participant"] = p
-
-            all_data.append(df)
-        else:
-            print(f"Warning: File not found for participant {p}")
-
-    if not all_data:
-        print("No data loaded.")
-        return pd.DataFrame()
-
-    combined = pd.concat(all_data, ignore_index=True)
-
-    return combined
+    return load_participant_data(folder_path, participants)
 
 def perform_stat_analysis(df, participants, output_folder):
 
@@ -66,29 +64,40 @@ def perform_stat_analysis(df, participants, output_folder):
 
     print(f'Valid Trials: {df_filtered["Location1Error"].count()} / {df["Participant"].count()}, {df_filtered["Location1Error"].count() / df["Participant"].count()}')
 
-    df_expanded = {}
-
-    for loc_col in ["Location1Error", "Location2Error", "Location3Error"]:
-        grouped = df_filtered.groupby(["Temperature", "Duration", "Direction"])[loc_col].apply(list)
-
-        max_len = grouped.map(len).max()
-
-        expanded = pd.DataFrame({
-            f"{loc_col}_T{temp}_D{dur}_Dir{direction}": values + [None] * (max_len - len(values))
-            for (temp, dur, direction), values in grouped.items()
-        })
-
-        df_expanded[loc_col] = expanded
-
-    df_final = pd.concat(df_expanded.values(), axis=1)
+    # One padded column per measure and cell, from the long table
+    long = long_table(df_filtered, stat_measures, stat_by)
+    df_final = wide_table(long, stat_by, stat_template)
 
     filename_out = f"stat_{participant_string(participants)}.csv"
     output_path = os.path.join(output_folder, filename_out)
     print(f"Saved to {output_path}")
     df_final.to_csv(output_path, index=False)
+    # Compact long format, without the padding and object columns of the wide one
+    long.to_parquet(os.path.splitext(output_path)[0] + ".parquet", index=False)
+
+    analyze_repeated_measures(df_filtered, participants, output_folder)
 
     return df_final
 
+def analyze_repeated_measures(df_filtered, participants, output_folder):
+    """
+    Repeated-measures ANOVA of the valid trials, with Friedman/Wilcoxon tests of
+    the measures check_data's Shapiro-Wilk test finds not normal in some cell.
+    Saves 'rm_anova_<ps>.csv' and 'rm_nonparametric_<ps>.csv'.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): The ANOVA and nonparametric tables, see repeated_measures_analysis.
+    """
+    normality, _ = run_assumption_checks(df_filtered, rm_measures, rm_factors, "Temperature")
+    nonnormal = normality.loc[normality["Normality_OK"] == 0, "Measure"].unique().tolist()
+    anova, nonparametric = repeated_measures_analysis(df_filtered, rm_measures, rm_factors, nonnormal=nonnormal)
+
+    ps = participant_string(participants)
+    anova.to_csv(os.path.join(output_folder, f"rm_anova_{ps}.csv"), index=False)
+    nonparametric.to_csv(os.path.join(output_folder, f"rm_nonparametric_{ps}.csv"), index=False)
+    print(f"Repeated-measures results saved to {output_folder}, not normal: {nonnormal if nonnormal else 'none'}")
+    return anova, nonparametric
+
 def participant_string(participants):
     """
     Convert list of participant numbers into compact string.
@@ -116,4 +125,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
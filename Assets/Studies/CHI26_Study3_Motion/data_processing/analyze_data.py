@@ -2,16 +2,47 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 import numpy as np
+import sys
+import argparse
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data
+from condition_stats import summarize_trials, merge_summaries, summary_table, update_summaries, load_summaries, jackknife_report
+
+# Conditions and measures kept as mergeable per-participant statistics (see condition_stats)
+summary_by = ["Direction", "Temperature", "Duration"]
+summary_values = ["FeltMotion"]
+summary_matches = ["ThermalMatch", "DirectionMatch"]
 
 def main():
-    participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
+    args = parse_args()
+    participants = args.participants or [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
     parent_folder = 'Assets/Studies/CHI26_Study3_Motion'
     input_folder = f'{parent_folder}/data_processing/data'
     output_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
 
+    if args.jackknife:
+        report_influence(load_summaries(input_folder, participants), output_folder)
+        return
+
+    if args.from_summaries:
+        # Merges the stored per-participant statistics, no trial data is read
+        plot_probabilities(load_summaries(input_folder, participants), output_folder)
+        return
+
     combined_data, excel_file = process_participant_data(input_folder, participants, output_folder)
     generate_graph(combined_data, excel_file, output_folder)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyze the trials of the participants and plot the motion probabilities.")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to include instead of the configured list")
+    parser.add_argument("--from-summaries", action="store_true",
+                        help="Only plot, from the condition summaries stored by an earlier run")
+    parser.add_argument("--jackknife", action="store_true",
+                        help="Only score each participant's influence on the condition estimates, from the stored summaries")
+    return parser.parse_args()
+
 def process_participant_data(folder_path, participants, output_folder):
     """
     Reads Excel files named 'p#_responses.xlsx' for given participants,
@@ -26,35 +57,37 @@ def process_participant_data(folder_path, participants, output_folder):
     Returns:
         pd.DataFrame: Combined processed DataFrame.
     """
-    all_data = []
-    filtered_data = []
+    df = load_participant_data(folder_path, participants)
+    if df.empty:
+        return pd.DataFrame()
 
-    for p in participants:
-        filename = os.path.join(folder_path, f"p{p}_data.xlsx")
-        if os.path.exists(filename):
-            df = pd.read_excel(filename)
+    return analyze_participant_data(df, participants, output_folder, folder_path)
 
-            # Add participant number
-            df["Participant"] = p
+def analyze_participant_data(df, participants, output_folder, summary_folder=None):
+    """
+    Adds the derived columns to the combined trials of all participants, keeps
+    the valid trials and saves them as 'p#-p#_analysis.xlsx' and '.csv'.
 
-            # Compute new columns
-            df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
-            df["DirectionMatch"] = (df["Direction"] == df["FeltDirection"]).astype(int)
+    Args:
+        df (pd.DataFrame): Trials from load_participant_data, modified in place.
+        participants (list of int): Participant numbers, used for the file name.
+        output_folder (str): Path to save the combined analysis file.
+        summary_folder (str): Folder to store the participants' condition summaries in.
 
-            include_mask = (df["ThermalMatch"] == 1) & (df["DirectionMatch"] == 1)
-            df_filtered = df[include_mask].copy()
+    Returns:
+        (pd.DataFrame, str): Valid trials and the path of the saved xlsx.
+    """
+    # Compute new columns
+    df["ThermalMatch"] = (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])).astype(int)
+    df["DirectionMatch"] = (df["Direction"] == df["FeltDirection"]).astype(int)
 
-            all_data.append(df)
-            filtered_data.append(df_filtered)
-        else:
-            print(f"Warning: File not found for participant {p}")
+    include_mask = (df["ThermalMatch"] == 1) & (df["DirectionMatch"] == 1)
 
-    if not all_data:
-        print("No data loaded.")
-        return pd.DataFrame()
+    if summary_folder:
+        update_summaries(summary_folder, summarize_conditions(df, include_mask))
 
-    all_combined = pd.concat(all_data, ignore_index=True)
-    filtered_combined = pd.concat(filtered_data, ignore_index=True)
+    all_combined = df
+    filtered_combined = df[include_mask].reset_index(drop=True)
     os.makedirs(output_folder, exist_ok=True)
 
     print(f'Thermal Match: {all_combined["ThermalMatch"].sum()} / {all_combined["ThermalMatch"].count()}, {all_combined["ThermalMatch"].sum() / all_combined["ThermalMatch"].count()}')
@@ -78,15 +111,34 @@ def generate_graph(df, excel_file, output_folder):
     grouped by Temperature x Duration, one plot per Direction.
     Only includes rows where ThermalMatch == 1 and DirectionMatch == 1.
     """
-    df = df[(df["ThermalMatch"] == 1) & (df["DirectionMatch"] == 1)]
+    valid = (df["ThermalMatch"] == 1) & (df["DirectionMatch"] == 1)
+    grouped = plot_probabilities(summarize_conditions(df, valid), output_folder)
 
-    grouped = (
-        df.groupby(["Direction", "Temperature", "Duration"])
-        .agg(FeltMotion_mean=("FeltMotion", "mean"),
-             FeltMotion_sem=("FeltMotion",
-                             lambda x: 0 if len(x) <= 1 else x.std(ddof=1) / np.sqrt(len(x))))
-        .reset_index()
-    )
+    with pd.ExcelWriter(excel_file, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
+        grouped.to_excel(writer, sheet_name="FeltMotion_Prob", index=False)
+    print(f"Saved FeltMotion probability table into {excel_file}")
+
+def summarize_conditions(df, valid):
+    """
+    Per-participant statistics of each condition, FeltMotion over the valid trials.
+    """
+    return summarize_trials(df, summary_by, summary_values, summary_matches, valid)
+
+def report_influence(summaries, output_folder):
+    """
+    Leave-one-participant-out estimates of every condition and the influence of each participant on them.
+    """
+    return jackknife_report(summaries, summary_by, summary_values, summary_matches, output_folder)
+
+def plot_probabilities(summaries, output_folder):
+    """
+    Draws the bar graph of generate_graph from condition summaries, of any participants.
+
+    Returns:
+        pd.DataFrame: FeltMotion mean and SEM per Direction, Temperature and Duration.
+    """
+    table = summary_table(merge_summaries(summaries, summary_by), summary_by, summary_values)
+    grouped = table[summary_by + ["FeltMotion_mean", "FeltMotion_sem"]]
 
     temp_colors = {
         -15: {"color": "#82AACC", "label": "Cold"},
@@ -111,9 +163,9 @@ def generate_graph(df, excel_file, output_folder):
         'ytick.major.width': 2.0,
     })
 
-    directions   = sorted(df["Direction"].unique())
-    durations    = sorted(df["Duration"].unique())
-    temperatures = sorted(df["Temperature"].unique())
+    directions   = sorted(grouped["Direction"].unique())
+    durations    = sorted(grouped["Duration"].unique())
+    temperatures = sorted(grouped["Temperature"].unique())
 
     os.makedirs(output_folder, exist_ok=True)
 
@@ -169,10 +221,7 @@ def generate_graph(df, excel_file, output_folder):
     fig.savefig(outpath, dpi=300, bbox_inches="tight")
     plt.close()
     print(f"Saved combined bar plot: {outpath}")
-
-    with pd.ExcelWriter(excel_file, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
-        grouped.to_excel(writer, sheet_name="FeltMotion_Prob", index=False)
-    print(f"Saved FeltMotion probability table into {excel_file}")
+    return grouped
 
 def participant_string(participants):
     """
@@ -201,4 +250,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
+import sys
+import argparse
 import pandas as pd
-from scipy.stats import shapiro, levene
 import itertools
 import os
 
+sys.path.append('Assets/Scripts')
+from assumption_checks import run_assumption_checks
+
+# Dependent variables checked, each in every Temperature × Duration × Direction cell
+check_measures = ["FeltMotion"]
+check_by = ["Temperature", "Duration", "Direction"]
+# Levene's test compares the temperatures within each Duration × Direction
+check_group = "Temperature"
+
 def main():
+    args = parse_args()
     participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
     parent_folder = 'Assets/Studies/CHI26_Study3_Motion'
     input_folder = f'{parent_folder}/data_processing/analysis/{participant_string(participants)}'
@@ -12,8 +23,26 @@ def main():
     # Load your dataframe
     df = pd.read_excel(os.path.join(input_folder, f"{participant_string(participants)}_analysis.xlsx"))
 
+    check_analysis_data(df, output_folder, args.workers)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the normality and homogeneity of the valid trials.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to spread the checked measures over (default: 1)")
+    return parser.parse_args()
+
+def check_analysis_data(df, output_folder, workers=1):
+    """
+    Runs the normality and homogeneity checks and the per-participant outlier
+    stats on the valid trials and saves them as csv.
+
+    Args:
+        df (pd.DataFrame): Valid trials, as saved by analyze_data.
+        output_folder (str): Folder for the result csv files.
+        workers (int): Number of processes to spread the checked measures over.
+    """
     # === Run checks ===
-    normality_results, homogeneity_results = run_checks(df)
+    normality_results, homogeneity_results = run_checks(df, workers)
 
     # Save to CSVs
     normality_results.to_csv(os.path.join(output_folder, "normality_results.csv"), index=False)
@@ -50,41 +79,15 @@ def flag_outliers(stats):
     return stats
 
 
-def run_checks(df):
-    results_normality = []
-    results_homogeneity = []
-
-    # === Normality check (Shapiro–Wilk per condition) ===
-    for (temp, dur, dir), subset in df.groupby(["Temperature", "Duration", "Direction"]):
-        stat, p = shapiro(subset["FeltMotion"])
-        results_normality.append({
-            "Temperature": temp,
-            "Duration": dur,
-            "Direction": dir,
-            "Shapiro_W": stat,
-            "p_value": p,
-            "Normality_OK": 1 if p > 0.005 else 0
-        })
-
-    df_normality = pd.DataFrame(results_normality)
-
-    # === Homogeneity of variances (Levene’s test across temperatures) ===
-    # Here we check variance across Temperature levels for each Duration × Location
-    for (dur, dir), subset in df.groupby(["Duration", "Direction"]):
-        groups = [g["FeltMotion"].values for _, g in subset.groupby("Temperature")]
-        if len(groups) > 1:  # Need at least 2 groups
-            stat, p = levene(*groups)
-            results_homogeneity.append({
-                "Duration": dur,
-                "Direction": dir,
-                "Levene_W": stat,
-                "p_value": p,
-                "Homoscedasticity_OK": 1 if p > 0.005 else 0
-            })
-
-    df_homogeneity = pd.DataFrame(results_homogeneity)
-
-    return df_normality, df_homogeneity
+def run_checks(df, workers=1):
+    """
+    Shapiro-Wilk per cell and Levene across temperatures of every checked
+    measure, with Holm corrected p values and Q-Q summary stats.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): Normality and homogeneity results, see run_assumption_checks.
+    """
+    return run_assumption_checks(df, check_measures, check_by, check_group, workers=workers)
 
 def participant_string(participants):
     """
@@ -113,4 +116,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 import os
 import re
+import sys
+import glob
+import argparse
+import numpy as np
 import pandas as pd
 
+sys.path.append('Assets/Scripts')
+from study_data import data_formats, parquet_available, write_participant_data, write_dataset_partition, participant_data_path, dataset_partition_path
+from file_manifest import load_manifest, save_manifest, file_fingerprints, files_unchanged
+
 # --- Configure Paths ---
 parent_folder = 'Assets/Studies/CHI26_Study3_Motion'
 conditions_folder = f'{parent_folder}/trial_info'
 responses_folder = f'{parent_folder}/trial_responses'
 output_folder = f'{parent_folder}/data_processing/data'  # Optional: to save combined files
+drawings_folder = f'{parent_folder}/drawings'
+mask_cache_folder = f'{parent_folder}/data_processing/cache/drawings'
 identifier_pattern = r"p\d+"   # Regex pattern to identify matching key (e.g., p12)
 
-# --- Create output folder if needed ---
-os.makedirs(output_folder, exist_ok=True)
-
 # --- Helper function to map files by identifier ---
 def get_files_by_identifier(folder):
     file_map = {}
@@ -23,37 +30,144 @@ def get_files_by_identifier(folder):
                 file_map[key] = os.path.join(folder, fname)
     return file_map
 
-# --- Get Excel file names (only files ending with .xls or .xlsx) ---
-files1 = get_files_by_identifier(conditions_folder)
-files2 = get_files_by_identifier(responses_folder)
+def main():
+    args = parse_args()
+    combine_pairs(args.format, args.dataset, args.incremental, args.drawing_features)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Combine trial conditions and responses per participant.")
+    parser.add_argument("--format", choices=data_formats + ["none"], default="xlsx",
+                        help="Format of the per-participant p#_data files, none to skip them (default: xlsx)")
+    parser.add_argument("--dataset", action="store_true",
+                        help="Also write the study-level Parquet dataset partitioned by participant")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-merge participants whose input or output files changed since the last run")
+    parser.add_argument("--drawing-features", action="store_true",
+                        help="Add the geometry of each trial's drawing (DrawnLocation, DrawnMin, DrawnMax, DrawnArea, DrawnBlobs)")
+    args = parser.parse_args()
+
+    if (args.format in ("parquet", "feather") or args.dataset) and not parquet_available:
+        parser.error("Parquet and feather output need pyarrow (pip install pyarrow)")
+    if args.format == "none" and not args.dataset:
+        parser.error("Nothing to write, use --dataset with --format none")
+    return args
+
+def combine_pairs(fmt="xlsx", dataset=False, incremental=False, drawing_features=False):
+    """
+    Merges the trial conditions and responses of every participant.
+
+    Args:
+        fmt (str): Format of the per-participant files (see study_data.data_formats), or "none".
+        dataset (bool): Also write the study-level Parquet dataset.
+        incremental (bool): Skip pairs whose files are unchanged since the last run.
+        drawing_features (bool): Add the drawing geometry columns (see add_drawing_features).
+
+    Returns:
+        list of str: Keys (e.g. 'p12') of the participants that were merged.
+    """
+    # --- Create output folder if needed ---
+    os.makedirs(output_folder, exist_ok=True)
+
+    # --- Get Excel file names (only files ending with .xls or .xlsx) ---
+    files1 = get_files_by_identifier(conditions_folder)
+    files2 = get_files_by_identifier(responses_folder)
+
+    # --- Get intersecting filenames (pairs) ---
+    common_keys = set(files1.keys()) & set(files2.keys())
+
+    # --- Manifest of the files each pair was merged from and written to ---
+    manifest_path = os.path.join(output_folder, "combine_manifest.json")
+    manifest = load_manifest(manifest_path)
+    settings = {"format": fmt, "dataset": dataset, "drawing_features": drawing_features}
+    rebuilt, skipped = [], []
+
+    # --- Process each matched pair ---
+    for key in sorted(common_keys, key=lambda k: int(k[1:])):
+        path1 = files1[key]
+        path2 = files2[key]
+
+        # This script counts as an input too, editing the merge rebuilds every pair
+        in_paths = [path1, path2, os.path.relpath(__file__)]
+        if drawing_features:
+            # The drawings and the scripts and red fill settings they are read with
+            in_paths += sorted(glob.glob(os.path.join(drawings_folder, key, f"{key}_trial*_drawing.png")))
+            in_paths += [os.path.relpath(os.path.join(os.path.dirname(__file__), "heatmap_generator.py")), 'Assets/Scripts/drawing_features.py', 'Assets/Scripts/drawing_cache.py']
+        out_paths = []
+        if fmt != "none":
+            out_paths.append(participant_data_path(output_folder, key, fmt))
+        if dataset:
+            out_paths.append(dataset_partition_path(output_folder, int(key[1:])))
+
+        # Skip pairs merged with the same settings whose inputs and outputs are untouched
+        entry = manifest.get(key, {})
+        if incremental and entry.get("settings") == settings:
+            unchanged, files = files_unchanged(in_paths + out_paths, entry.get("files", {}))
+            if unchanged:
+                entry["files"] = files
+                skipped.append(key)
+                continue
+
+        df1 = pd.read_csv(path1)
+        df2 = pd.read_csv(path2)
+        df2 = df2.iloc[:, 1:]
+        df2 = df2.drop_duplicates(subset='trialNumber', keep='last')
+
+        # Combine data: choose method
+        combined = pd.concat([df1, df2], axis=1)  # side-by-side
+
+        # Insert trial column at 2nd column
+        # Reorder columns: move column at index 4 to index 1
+        cols = list(combined.columns)
+        col_to_move = cols.pop(4)
+        cols.insert(1, col_to_move)
+        combined = combined[cols]
+
+        # Rename Headers
+        combined.columns = ['Participant', 'Trial', 'Temperature', 'Duration', 'Direction', 'FeltThermal', 'FeltMotion', 'FeltDirection']
+
+        # Drop rows left empty by the side-by-side concat (reading xlsx back always skipped them)
+        combined = combined.dropna(how="all")
+
+        if drawing_features:
+            combined = add_drawing_features(combined, int(key[1:]))
 
-# --- Get intersecting filenames (pairs) ---
-common_keys = set(files1.keys()) & set(files2.keys())
+        # Save combined result
+        if fmt != "none":
+            out_path = write_participant_data(combined, output_folder, key, fmt)
+            print(f"Combined {key}: saved to {out_path}")
+        if dataset:
+            out_path = write_dataset_partition(combined, output_folder, int(key[1:]))
+            print(f"Combined {key}: saved to {out_path}")
 
-# --- Process each matched pair ---
-for key in common_keys:
-    path1 = files1[key]
-    path2 = files2[key]
+        manifest[key] = {"settings": settings, "files": file_fingerprints(in_paths + out_paths)}
+        rebuilt.append(key)
 
-    df1 = pd.read_csv(path1)
-    df2 = pd.read_csv(path2)
-    df2 = df2.iloc[:, 1:]
-    df2 = df2.drop_duplicates(subset='trialNumber', keep='last')
+    save_manifest(manifest, manifest_path)
+    print(f"Rebuilt {len(rebuilt)} participant(s): {', '.join(rebuilt) or '-'}")
+    if skipped:
+        print(f"Unchanged {len(skipped)} participant(s): {', '.join(skipped)}")
+    return rebuilt
 
-    # Combine data: choose method
-    combined = pd.concat([df1, df2], axis=1)  # side-by-side
+def add_drawing_features(combined, participant):
+    """
+    Adds the geometry of each trial's drawing (see drawing_geometry) after the responses,
+    NaN for trials without a drawing.
+    """
+    # Imported here, a combine run without drawing features needs neither OpenCV nor matplotlib
+    from drawing_archive import load_study_masks
+    from drawing_features import stack_drawings, drawing_geometry
+    from heatmap_core import load_arm_mask
+    from heatmap_generator import red_fill
 
-    # Insert trial column at 2nd column
-    # Reorder columns: move column at index 4 to index 1
-    cols = list(combined.columns)
-    col_to_move = cols.pop(4)
-    cols.insert(1, col_to_move)
-    combined = combined[cols]
+    masks = load_study_masks(drawings_folder, participant, mask_cache_folder, red_fill)
+    trials = combined["Trial"].astype(int).tolist()
+    stack, found = stack_drawings(masks, trials, load_arm_mask().shape)
 
-    # Rename Headers
-    combined.columns = ['Participant', 'Trial', 'Temperature', 'Duration', 'Direction', 'FeltThermal', 'FeltMotion', 'FeltDirection']
+    at = len(combined.columns)
+    for name, values in drawing_geometry(stack).items():
+        combined.insert(at, name, np.where(found, values, np.nan))
+        at += 1
+    return combined
 
-    # Save combined result
-    out_path = os.path.join(output_folder, f"{key}_data.xlsx")
-    combined.to_excel(out_path, index=False)
-    print(f"Combined {key}: saved to {out_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import os
-import cv2
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -10,6 +9,18 @@ import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter
 import random
 import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append('Assets/Scripts')
+from study_data import load_participant_data, trials_by_condition
+from drawing_cube import update_drawing_cube, open_drawing_cube, cube_heatmap
+from heatmap_core import HeatmapAccumulator, load_arm_mask, render_heatmap, save_heatmap
+from drawing_registration import load_registration
+from heatmap_bootstrap import trial_stacks, cube_stacks, bootstrap_heatmap, save_bootstrap_maps
+from heatmap_contrast import paired_differences, cluster_permutation_test, save_contrast_map
+from arm_coordinates import wrist_pixel, elbow_pixel, arm_to_canvas
 
 participants = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
 temperatures = [9, -15]
@@ -17,211 +28,252 @@ directions =  [1, 0]
 durations = [0.1, 1, 2]
 
 parent_folder = 'Assets/Studies/CHI26_Study3_Motion'
+# Drawings packed by pack_drawings.py, read with --archive
+drawing_archive_path = f'{parent_folder}/data_processing/data/drawing_archive.bin'
+# Per-participant transforms estimated by register_drawings.py, applied with --register
+registration_path = f'{parent_folder}/data_processing/data/drawing_registration.json'
+
+# Red circle fill applied to each drawing before it is added to a heatmap
+red_fill = {
+    "lower_red1": [0, 100, 100],
+    "upper_red1": [10, 255, 255],
+    "lower_red2": [160, 100, 100],
+    "upper_red2": [180, 255, 255],
+    "close_passes": 1,
+}
 
 def main():
+    args = parse_args()
+
+    df = load_participant_data(f'{parent_folder}/data_processing/data', args.participants or participants)
+    drawings = drawing_archive_path if args.archive else None
+    transforms = load_registration(registration_path) if args.register else None
+    generate_heatmaps(df, args.participants or participants, args.workers, drawings, transforms,
+                      args.bootstrap, not args.bootstrap_participants_only, args.contrast)
+
+def generate_heatmaps(df, participants, workers=1, drawings=None, transforms=None, bootstrap=0, resample_trials=True, contrast=0):
+    """
+    Saves one heatmap per condition, summed over the valid trials of the participants.
+
+    Args:
+        df (pd.DataFrame): Trials from load_participant_data.
+        participants (list of int): Participants to include, also names the output folder.
+        workers (int): Number of processes to spread the conditions over.
+        drawings (str): Drawing archive to read instead of the study drawings folder.
+        transforms (dict): {participant: 2x3 matrix} registration applied to the drawings on the fly.
+        bootstrap (int): Number of resamples for the confidence interval and stability
+            maps saved next to each heatmap, none by default.
+        resample_trials (bool): Resample the trials within the resampled participants,
+            otherwise only participants are resampled, from the drawing cube.
+        contrast (int): Number of permutations for the hot - cold contrast map of every
+            direction and duration and its cluster test, none by default.
+    """
     # --- Configuration ---
-    input_folder = f'{parent_folder}/data_processing/data'
     output_folder = f'{parent_folder}/data_processing/heatmaps/{participant_string(participants)}'
+    cache_folder = f'{parent_folder}/data_processing/cache/drawings'
+    cube_folder = f'{parent_folder}/data_processing/cache/drawing_cube'
+    drawings = drawings or f"{parent_folder}/drawings"
     os.makedirs(output_folder, exist_ok=True)
 
+    # Look conditions up from the grouped trials of every participant
+    condition_trials = group_valid_trials(df)
+
+    # Per-participant, per-condition drawing counts, only new or changed participants are recounted
+    conditions = [
+        (temperature, direction, duration)
+        for temperature in temperatures for direction in directions for duration in durations
+    ]
+    shape = load_arm_mask().shape
+    cube, cube_index = update_drawing_cube(cube_folder, participants, conditions, condition_trials,
+                                           drawings, cache_folder, red_fill, shape, transforms)
+
+    jobs = []
     for temperature in temperatures:
         for direction in directions:
             for duration in durations:
                 filename = f"{participant_string(participants)}_temp-{temperature}_dir-{direction}_dur-{duration}.png"
-                process_data(input_folder, output_folder, participants, filename, temperature, direction, duration)
+                jobs.append((output_folder, condition_trials, participants, filename, temperature, direction, duration))
 
                 """ for participant in participants:
                     filename = f"p{participant}_temp-{temperature}_dir-{direction}_dur-{duration}.png"
-                    process_data(input_folder, output_folder, participants, filename, temperature, direction, duration) """
+                    jobs.append((output_folder, condition_trials, [participant], filename, temperature, direction, duration)) """
+
+    if workers > 1:
+        # Workers memory-map the drawing cube instead of each receiving a copy
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cube_folder,)) as executor:
+            # map() yields in submission order, so output does not depend on the worker count
+            for summary in executor.map(run_job, jobs):
+                print(summary)
+    else:
+        # One count buffer, reused for every condition
+        accumulator = HeatmapAccumulator(shape)
+        for job in jobs:
+            print(process_data(cube, cube_index, accumulator, *job))
+
+    if bootstrap:
+        if resample_trials:
+            stacks = trial_stacks(drawings, participants, conditions, condition_trials, cache_folder, red_fill, transforms)
+        else:
+            stacks = cube_stacks(cube, cube_index, participants, conditions)
+        bootstrap_jobs = []
+        for i, (_, _, _, filename, *condition) in enumerate(jobs):
+            condition = tuple(condition)
+            # One seed per condition, so the maps do not depend on the worker count
+            bootstrap_jobs.append((stacks[condition], bootstrap, (0, i), os.path.join(output_folder, filename)) + condition[:2])
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for summary in executor.map(bootstrap_maps, bootstrap_jobs):
+                    print(summary)
+        else:
+            for job in bootstrap_jobs:
+                print(bootstrap_maps(job))
+
+    if contrast:
+        hot, cold = temperatures
+        contrast_jobs = []
+        for i, (_, _, _, filename, temperature, *rest) in enumerate(jobs):
+            if temperature != hot:
+                continue
+            kept, differences = paired_differences(cube, cube_index, participants, (hot, *rest), (cold, *rest), condition_trials)
+            file_path = os.path.join(output_folder, filename.replace(f"temp-{hot}", "contrast"))
+            contrast_jobs.append((differences, kept, contrast, (1, i), file_path, hot, rest[0]))
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(contrast_map, contrast_jobs))
+        else:
+            results = [contrast_map(job) for job in contrast_jobs]
+
+        rows = []
+        for file_path, kept, clusters in results:
+            print(f"Saved {file_path}, {len(kept)} participants, {sum(c['p_value'] < .05 for c in clusters)} significant clusters")
+            for cluster in clusters:
+                rows.append({"Map": os.path.basename(file_path), "Participants": len(kept), **cluster})
+        table_path = os.path.join(output_folder, f"{participant_string(participants)}_contrast_clusters.csv")
+        pd.DataFrame(rows, columns=["Map", "Participants", "sign", "mass", "pixels", "p_value"]).to_csv(table_path, index=False)
+        print(f"Saved cluster table to {table_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate drawing heatmaps for every condition.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to spread the conditions over (default: 1)")
+    parser.add_argument("--participants", type=int, nargs="+",
+                        help="Participants to pool instead of the configured list")
+    parser.add_argument("--archive", action="store_true",
+                        help="Read the drawings from the archive packed by pack_drawings.py instead of the drawings folder")
+    parser.add_argument("--register", action="store_true",
+                        help="Align each participant's drawings with the transform saved by register_drawings.py")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="Also save confidence interval and stability maps of every heatmap from N resamples")
+    parser.add_argument("--bootstrap-participants-only", action="store_true",
+                        help="Resample whole participants only, not their trials")
+    parser.add_argument("--contrast", type=int, default=0, metavar="N",
+                        help="Also save hot - cold contrast maps per direction and duration, cluster-tested with N permutations")
+    return parser.parse_args()
+
+# Drawing cube and count buffer of a worker process, set up by init_worker
+worker_cube = None
+worker_accumulator = None
+
+def init_worker(cube_folder):
+    global worker_cube, worker_accumulator
+    worker_cube = open_drawing_cube(cube_folder)
+    worker_accumulator = HeatmapAccumulator(worker_cube[1]["shape"])
+
+def run_job(job):
+    return process_data(*worker_cube, worker_accumulator, *job)
+
+def bootstrap_maps(job):
+    """
+    Saves the confidence interval and stability maps of one heatmap.
+    """
+    stacks, n_boot, seed, file_path, temperature, direction = job
+    maps = bootstrap_heatmap(stacks, n_boot, seed=seed)
+    saved = save_bootstrap_maps(maps, file_path, lambda: heatmap_patches(temperature))
+    return f"Saved {', '.join(saved)} from {n_boot} resamples"
 
-def process_data(input_folder, output_folder, participants, filename, temperature, direction, duration):
-    valid_trials = {}
-    for par in participants:
-        valid_trials[par] = []
+def contrast_map(job):
+    """
+    Tests and saves the hot - cold contrast of one direction and duration.
+    """
+    differences, kept, n_perm, seed, file_path, temperature, direction = job
+    result = cluster_permutation_test(differences, n_perm, seed=seed)
+    save_contrast_map(result, file_path, lambda: heatmap_patches(temperature))
+    return file_path, kept, result["clusters"]
 
-    # --- Loop through Excel files ---
-    for data_file in os.listdir(input_folder):
-        
-        if data_file.endswith(('.xlsx', '.xls')) and not data_file.startswith("~"):
-            file_participant = int(data_file.strip("p").strip("_data.xlsx"))
-            if file_participant in participants:
-                file_path = os.path.join(input_folder, data_file)
-
-                try:
-                    # Read Excel file
-                    df = pd.read_excel(file_path, sheet_name=0)
-                    #print(f"Loaded: {filename} with shape {df.shape}")                    
-
-                    condition = (
-                        (df["Temperature"] == temperature) &
-                        (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"])) &
-                        (df["Direction"] == direction) &
-                        (df["Duration"] == duration)
-                    )
-
-                    valid_trials[file_participant] = df[condition]['Trial'].tolist()
-                    #print(valid_trials)
-
-                except Exception as e:
-                    print(f"❌ Failed to process {data_file}: {e}")
-    
-    generate_heatmap(output_folder, valid_trials, temperature, filename)
+def group_valid_trials(df):
+    if df.empty:
+        return {}
 
-def generate_heatmap(output_folder, trials_to_process, temperature, filename):
-    mask_filepath = f"Assets/arm_mask.png"
-    mask_img = Image.open(mask_filepath).convert("L")
-    mask_array = np.array(mask_img)
-    # Convert to binary mask
-    binary_mask = (mask_array > 128).astype(int)  # 1s where heatmap is allowed
+    valid = (
+        (np.sign(df["Temperature"]) == np.sign(df["FeltThermal"]))
+    )
 
-    # Get heat map data
-    heat_map = np.zeros(mask_array.shape)
+    return trials_by_condition(df[valid], ["Temperature", "Direction", "Duration"])
 
-    for par in trials_to_process:
-        par_folder = os.path.join(f"{parent_folder}/drawings/", f"p{par}")
-        for trial in trials_to_process[par]:
-            filepath = os.path.join(par_folder, f"p{par}_trial{int(trial)}_drawing.png")
-            heat_map = process_drawing(filepath, heat_map)
+def process_data(cube, cube_index, accumulator, output_folder, condition_trials, participants, filename, temperature, direction, duration):
+    condition = (temperature, direction, duration)
+    trials = condition_trials.get(condition, {})
+    valid_trials = {par: trials.get(par, []) for par in participants}
+
+    cube_heatmap(cube, cube_index, participants, [condition], accumulator)
+    return generate_heatmap(output_folder, valid_trials, accumulator, temperature, filename)
 
-    # Shift
+def generate_heatmap(output_folder, trials_to_process, accumulator, temperature, filename):
+    # Shift, in place on the drawing counts summed from the drawing cube
     """ n_pixels = 50
-    heat_map = np.roll(heat_map, shift=-n_pixels, axis=1)
+    heat_map = accumulator.counts
+    heat_map[:, :-n_pixels] = heat_map[:, n_pixels:]
     heat_map[:, -n_pixels:] = 0 """
     
+    # Smoothed and cut to the arm, transparent around it
     sigma = 1
-    heat_map = gaussian_filter(heat_map, sigma=sigma)
-    masked_data = heat_map * binary_mask           # Apply mask
-
-    # Transparent background
-    masked_alpha = np.where(binary_mask, 1.0, 0.0)
+    masked_data, masked_alpha = accumulator.masked_heatmap(sigma)
 
     # Heat map
-    plt.figure(figsize=(10, 10))
     cmap = None
     if temperature < 0:
         cmap = plt.cm.bone
     else:
         cmap = plt.cm.hot
     #cmap = cmap.reversed()
-    plt.imshow(masked_data, cmap=cmap, interpolation='antialiased', alpha=masked_alpha)
-    plt.axis('off')
 
+    patches = heatmap_patches(temperature)
+
+    # === Render in memory, cropped to the drawing extent ===
+    rgba = render_heatmap(masked_data, cmap, masked_alpha, patches)
+
+    file_path = os.path.join(output_folder, filename)
+    save_heatmap(rgba, file_path)
+
+    summary = f"Saved to {file_path} with {sum(len(par) for par in trials_to_process.values())} files processed"
+    for par in trials_to_process:
+        summary += f"\n\t{par}: {trials_to_process[par]}"
+    return summary
+
+def heatmap_patches(temperature):
+    """
+    Marker patches drawn over the heatmaps of a condition, new ones on every call.
+    """
     # Coordinates where you want to place the circles (in image coordinates, i.e., pixels)
-    circle_coords = [(330, 155), (190, 155)]
+    circle_coords = [wrist_pixel, elbow_pixel]
     circle_radius = 5
     circle_color = 'gray'
-    ax = plt.gca()
+    patches = []
     for (x, y) in circle_coords:
         circ = Circle((x, y), radius=circle_radius, edgecolor='gray', facecolor='none', alpha=0.8, linewidth=2)
-        ax.add_patch(circ)
+        patches.append(circ)
 
     # Rectangle center coordinates
-    rect_center = (106, 155)
+    rect_center = arm_to_canvas(-6)  # 6 cm past the elbow
     rect_width = 10
     rect_height = 10
     x0 = rect_center[0] - rect_width / 2
     y0 = rect_center[1] - rect_height / 2
     rect = Rectangle((x0, y0), rect_width, rect_height,
                     linewidth=2, edgecolor='gray', facecolor='none', alpha=0.8)
-    ax.add_patch(rect)
-# === Save temp file first ===
-    file_path = os.path.join(output_folder, filename)
-    temp_path = file_path.replace(".png", "_raw.png")
-    plt.savefig(temp_path, dpi=300, bbox_inches='tight')
-    plt.close()
-
-    # === Crop with Pillow ===
-    crop_box = (300, 275, 1300, 775)  # (left, upper, right, lower)
-    img = Image.open(temp_path)
-    cropped_img = img.crop(crop_box)
-
-    transparent_img = make_border_white_transparent(cropped_img)
-    transparent_img.save(file_path)
-
-    # Remove temp file (optional)
-    os.remove(temp_path)
-
-    print(f"Saved to {file_path} with {sum(len(par) for par in trials_to_process.values())} files processed")
-    for par in trials_to_process:
-        print(f"\t{par}: {trials_to_process[par]}")
-
-    plt.close()
-
-def make_border_white_transparent(img, margin=150, white_thresh=250):
-    """
-    Turns white pixels transparent only within `margin` pixels from the border.
-    """
-    img = img.convert("RGBA")
-    width, height = img.size
-    datas = img.getdata()
-
-    new_data = []
-    for i, item in enumerate(datas):
-        x = i % width
-        y = i // width
-
-        # Check if pixel is near the border
-        near_border = (x < margin or x >= width - margin or 
-                       y < margin or y >= height - margin)
-
-        if near_border and item[0] > white_thresh and item[1] > white_thresh and item[2] > white_thresh:
-            new_data.append((255, 255, 255, 0))  # transparent
-        else:
-            new_data.append(item)
-
-    img.putdata(new_data)
-    return img
-
-def process_drawing(filepath, heat_map):
-    if os.path.isfile(filepath):
-        #print(f"Processing {filepath}")
-    #if os.path.isfile(filepath) and "Am19_thermal" in filename:
-        # Convert png to array
-        fill_red_circles(filepath, filepath)
-        drawing = Image.open(filepath).convert("L")
-        mask_array = np.array(drawing)
-        binary_drawing = (mask_array > 50).astype(int)
-        # Need to binary drawing to match heatmap
-        heat_map += binary_drawing
-        #heat_map[0:550, 300:620] += binary_drawing[0:550, 300:620]
-        #heat_map[0:540, 1810:2075] += binary_drawing[0:540, 1810:2075]
-    return heat_map  
-
-def fill_red_circles(image_path, save_path=None):
-    # Read the image
-    img = cv2.imread(image_path)
-
-    # Convert to HSV color space for better red detection
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-    # Define red color range in HSV (two ranges for red wrap-around)
-    lower_red1 = np.array([0, 100, 100])
-    upper_red1 = np.array([10, 255, 255])
-
-    lower_red2 = np.array([160, 100, 100])
-    upper_red2 = np.array([180, 255, 255])
-
-    # Create masks for red regions
-    mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-    mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-    mask = mask1 | mask2
-
-    # Optional: clean noise
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-
-    # Find contours in red mask
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    # Fill each red contour on original image
-    for cnt in contours:
-        cv2.drawContours(img, [cnt], -1, (0, 0, 255), thickness=cv2.FILLED)  # Red in BGR
-
-    # Save or return result
-    if save_path:
-        #print(f"Saving to {save_path}")
-        cv2.imwrite(save_path, img)
-    return img
+    patches.append(rect)
+    return patches
 
 def sign(number):
         if number > 0:
@@ -258,4 +310,5 @@ def participant_string(participants):
 
     return "p" + "-".join(parts)
         
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()